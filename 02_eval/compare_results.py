@@ -0,0 +1,430 @@
+from typing import Dict, List, Tuple
+
+import os
+import re
+import sys
+
+from argparse import ArgumentParser, Namespace
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.jsonl_reader import JsonlReader
+from parquet_results import read_parquet_results
+
+# Older result files have no ticker or quarter columns, both are
+# recovered from the prompt in that case
+TICKER_PATTERN = re.compile(r"Ticker: (\S+)\n")
+QUARTER_PATTERN = re.compile(r"Quarter: (\S+)\n")
+
+
+class ResultColumns:
+    """
+    Columnar view of an eval results file, one numpy array per field,
+    sorted by example id so runs can be aligned without dict lookups.
+
+    Parameters
+    ----------
+    name: str
+        Name of the run, used in reports
+
+    ids: np.ndarray
+        Example ids
+
+    scores: np.ndarray
+        Judge scores
+
+    exact: np.ndarray
+        Exact match flags
+
+    tickers: np.ndarray
+        Company tickers
+
+    quarters: np.ndarray
+        Earnings call quarters
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ids: np.ndarray,
+        scores: np.ndarray,
+        exact: np.ndarray,
+        tickers: np.ndarray,
+        quarters: np.ndarray,
+    ) -> None:
+        order = np.argsort(ids, kind="stable")
+
+        self.name = name
+        self.ids = ids[order]
+        self.scores = scores[order]
+        self.exact = exact[order]
+        self.tickers = tickers[order]
+        self.quarters = quarters[order]
+
+    def __len__(self) -> int:
+        """ Number of results in the run
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int:
+            Number of rows
+        """
+
+        return len(self.ids)
+
+    def take(self, positions: np.ndarray) -> "ResultColumns":
+        """ Select rows by position
+
+        Parameters
+        ----------
+        positions: np.ndarray
+            Row positions to keep
+
+        Returns
+        -------
+        ResultColumns
+            Columns restricted to the given rows
+        """
+
+        return ResultColumns(
+            self.name,
+            self.ids[positions],
+            self.scores[positions],
+            self.exact[positions],
+            self.tickers[positions],
+            self.quarters[positions],
+        )
+
+
+def load_result_columns(path: str) -> ResultColumns:
+    """ Load an eval results file into columns. Only the fields
+    needed for comparisons are kept, and for parquet files only
+    those columns are read.
+
+    Parameters
+    ----------
+    path: str
+        Results file written by eval.py, jsonlines or parquet
+
+    Returns
+    -------
+    ResultColumns
+        Columns of the results file
+    """
+
+    name = os.path.basename(path)
+    for suffix in (".json", ".parquet", "_results"):
+        name = name[: -len(suffix)] if name.endswith(suffix) else name
+
+    if path.endswith(".parquet"):
+        table = read_parquet_results(
+            path, columns=["id", "score", "is_exact_match", "ticker", "q"]
+        )
+        return ResultColumns(
+            name,
+            table["id"].to_numpy(),
+            table["score"].to_numpy().astype(np.float64),
+            table["is_exact_match"].to_numpy(zero_copy_only=False),
+            np.array(table["ticker"].to_pylist(), dtype=object),
+            np.array(table["q"].to_pylist(), dtype=object),
+        )
+
+    ids, scores, exact, tickers, quarters = [], [], [], [], []
+
+    with JsonlReader(path) as reader:
+        for row in reader:
+            ids.append(row["id"])
+            scores.append(row["score"])
+            exact.append(row["is_exact_match"])
+            tickers.append(row.get("ticker") or search_prompt(TICKER_PATTERN, row))
+            quarters.append(row.get("q") or search_prompt(QUARTER_PATTERN, row))
+
+    return ResultColumns(
+        name,
+        np.array(ids, dtype=np.int64),
+        np.array(scores, dtype=np.float64),
+        np.array(exact, dtype=bool),
+        np.array(tickers, dtype=object),
+        np.array(quarters, dtype=object),
+    )
+
+
+def search_prompt(pattern: re.Pattern, row: Dict) -> str:
+    """ Recover a field of the example from the prompt of a result row
+
+    Parameters
+    ----------
+    pattern: re.Pattern
+        Pattern with one group capturing the field
+
+    row: Dict
+        Row of a results file
+
+    Returns
+    -------
+    str
+        Captured field, "unknown" if the prompt does not contain it
+    """
+
+    match = pattern.search(row.get("prompt", ""))
+
+    return match.group(1) if match else "unknown"
+
+
+def align(base: ResultColumns, other: ResultColumns) -> Tuple[ResultColumns, ResultColumns]:
+    """ Restrict two runs to the examples both of them scored, in
+    the same order. An id found on several rows of a run is paired by
+    its first row.
+
+    Parameters
+    ----------
+    base: ResultColumns
+        Reference run
+
+    other: ResultColumns
+        Run compared to the reference
+
+    Returns
+    -------
+    Tuple[ResultColumns, ResultColumns]
+        Both runs restricted to their shared example ids
+    """
+
+    _, base_positions, other_positions = np.intersect1d(base.ids, other.ids, return_indices=True)
+
+    return base.take(base_positions), other.take(other_positions)
+
+
+def paired_bootstrap(
+    deltas: np.ndarray,
+    samples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 42,
+    chunk_size: int = 100,
+) -> Dict[str, float]:
+    """ Paired bootstrap of the mean per-example score delta. Resamples
+    are drawn in chunks so memory stays bounded for large runs.
+
+    Parameters
+    ----------
+    deltas: np.ndarray
+        Per-example score deltas between two aligned runs
+
+    samples: int = 1000
+        Number of bootstrap resamples
+
+    confidence: float = 0.95
+        Confidence level of the interval
+
+    seed: int = 42
+        Seed of the resampling
+
+    chunk_size: int = 100
+        Number of resamples drawn at once
+
+    Returns
+    -------
+    Dict[str, float]
+        Lower and upper bound of the mean delta, and the two-sided
+        p-value of the delta being zero
+    """
+
+    if len(deltas) == 0:
+        return {"lower": 0.0, "upper": 0.0, "p_value": 1.0}
+
+    rng = np.random.default_rng(seed)
+    means = np.empty(samples)
+
+    for start in range(0, samples, chunk_size):
+        count = min(chunk_size, samples - start)
+        positions = rng.integers(0, len(deltas), size=(count, len(deltas)))
+        means[start:start + count] = deltas[positions].mean(axis=1)
+
+    tail = (1 - confidence) / 2
+    lower, upper = np.quantile(means, [tail, 1 - tail])
+    p_value = min(1.0, 2 * min((means <= 0).mean(), (means >= 0).mean()))
+
+    return {"lower": float(lower), "upper": float(upper), "p_value": float(p_value)}
+
+
+def exact_match_confusion(base: ResultColumns, other: ResultColumns) -> np.ndarray:
+    """ 2x2 confusion of exact matches between two aligned runs
+
+    Parameters
+    ----------
+    base: ResultColumns
+        Reference run
+
+    other: ResultColumns
+        Run compared to the reference, aligned with base
+
+    Returns
+    -------
+    np.ndarray
+        Counts indexed by [base exact match, other exact match]
+    """
+
+    cells = base.exact.astype(np.int64) * 2 + other.exact.astype(np.int64)
+
+    return np.bincount(cells, minlength=4).reshape(2, 2)
+
+
+def group_deltas(keys: np.ndarray, deltas: np.ndarray) -> List[Tuple[str, int, float]]:
+    """ Mean score delta per group, most regressed group first
+
+    Parameters
+    ----------
+    keys: np.ndarray
+        Group of every example, e.g. its ticker
+
+    deltas: np.ndarray
+        Per-example score deltas
+
+    Returns
+    -------
+    List[Tuple[str, int, float]]
+        Group, number of examples and mean delta
+    """
+
+    groups, inverse = np.unique(keys.astype(str), return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(groups))
+    means = np.bincount(inverse, weights=deltas, minlength=len(groups)) / np.maximum(counts, 1)
+    order = np.argsort(means, kind="stable")
+
+    return [(str(groups[i]), int(counts[i]), float(means[i])) for i in order]
+
+
+def compare_runs(
+    base: ResultColumns, other: ResultColumns, bootstrap_samples: int = 1000, top: int = 10
+) -> None:
+    """ Print the comparison of a run against the reference run
+
+    Parameters
+    ----------
+    base: ResultColumns
+        Reference run
+
+    other: ResultColumns
+        Run compared to the reference
+
+    bootstrap_samples: int = 1000
+        Number of paired bootstrap resamples
+
+    top: int = 10
+        Number of most regressed tickers and quarters to list
+
+    Returns
+    -------
+    None
+    """
+
+    base, other = align(base, other)
+    deltas = other.scores - base.scores
+
+    print(f"========== {other.name} vs {base.name} ==========")
+    print("Shared examples:", len(deltas))
+
+    if len(deltas) == 0:
+        return
+
+    print(f"Avg score: {base.scores.mean():.3f} -> {other.scores.mean():.3f}")
+    print(f"Avg precision score: {base.exact.mean():.3f} -> {other.exact.mean():.3f}")
+    print(
+        f"Examples improved: {int((deltas > 0).sum())}, "
+        f"regressed: {int((deltas < 0).sum())}, "
+        f"unchanged: {int((deltas == 0).sum())}"
+    )
+
+    bootstrap = paired_bootstrap(deltas, samples=bootstrap_samples)
+    print(
+        f"Mean score delta: {deltas.mean():+.3f} "
+        f"(95% CI [{bootstrap['lower']:+.3f}, {bootstrap['upper']:+.3f}], "
+        f"p={bootstrap['p_value']:.4f})"
+    )
+
+    confusion = exact_match_confusion(base, other)
+    print("Exact match confusion (base x other):")
+    print(f"  both miss: {confusion[0, 0]}, gained: {confusion[0, 1]}")
+    print(f"  lost: {confusion[1, 0]}, both match: {confusion[1, 1]}")
+
+    for name, keys in (("ticker", base.tickers), ("quarter", base.quarters)):
+        regressions = [group for group in group_deltas(keys, deltas) if group[2] < 0]
+        print(f"Most regressed by {name}:")
+        for key, count, mean in regressions[:top]:
+            print(f"  {key}: n={count} delta={mean:+.3f}")
+
+
+def main() -> None:
+    """ Main script comparing eval result files
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+
+    args = parse_arguments()
+
+    runs = [load_result_columns(path) for path in args.results]
+
+    base = runs[0]
+    for other in runs[1:]:
+        compare_runs(base, other, args.bootstrap_samples, args.top)
+
+
+def parse_arguments() -> Namespace:
+    """ Argument Parser setup
+    The following arguments are used in this script:
+        results
+            Result files, the first one is the reference run
+            that every other run is compared to
+
+        --bootstrap-samples
+            Number of paired bootstrap resamples
+            default 1000
+
+        --top
+            Number of most regressed tickers and quarters to list
+            default 10
+
+    Returns
+    -------
+    argparse.Namespace
+        Namespace object storing the given args as attributes
+    """
+
+    parser = ArgumentParser()
+
+    parser.add_argument(
+        "results",
+        nargs="+",
+        help="Result files, every run is compared to the first one",
+    )
+    parser.add_argument(
+        "--bootstrap-samples",
+        type=int,
+        default=1000,
+        help="The number of paired bootstrap resamples",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="The number of most regressed tickers and quarters to list",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
-from typing import AsyncGenerator, List
+from typing import AsyncGenerator, List, Optional, Dict, Any, Set, Tuple
 
-import jsonlines
+import json
 import os
+import sys
 import logging
 
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
 
 from load_earnings_call_dataset import load_earnings_call_dataset, EarningsCallsDataset
 from lamini.generation.base_prompt_object import PromptObject
 from eval_pipeline import evaluate_model
+from eval_metrics import StreamingMetrics
+from parquet_results import write_parquet_results
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.atomic_jsonl_writer import AtomicJsonlWriter, get_partial_path
+from utils.jsonl_reader import shard_bounds
+from utils.response_cache import ResponseCache
 
 
 def main() -> None:
@@ -26,19 +36,119 @@ def main() -> None:
 
     setup_logging(args)
 
-    dataset = slice_dataset(load_dataset(args), args.max_examples)
+    if args.shards > 1 and args.shard_index is None:
+        launch_shards(args)
+        return
+
+    run_eval(args)
+
+
+def launch_shards(args: Namespace) -> None:
+    """ Run every shard of the evaluation in a local process pool,
+    then merge the per-shard result files into the experiment results
+
+    Parameters
+    ----------
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            shards
+                Number of shards, and of worker processes
+
+    Returns
+    -------
+    None
+    """
+
+    shard_args = [
+        Namespace(**{**vars(args), "shard_index": shard_index})
+        for shard_index in range(args.shards)
+    ]
+
+    with ProcessPoolExecutor(max_workers=args.shards) as executor:
+        # list() re-raises the first failure from a worker
+        list(executor.map(run_eval, shard_args))
+
+    merge_results(args)
+
+
+def run_eval(args: Namespace) -> None:
+    """ Evaluate the examples of a single shard, or of the whole run
+    when it is not sharded, checkpointing results as they finish. This
+    is also the entrypoint of each worker process started by
+    launch_shards.
+
+    Parameters
+    ----------
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            max_examples
+                Max number of examples to evaluate
+            shards, shard_index
+                Shard being evaluated, if any
+            resume
+                Skip examples already in the results file
+            no_cache, cache_readonly
+                Response cache mode
+            judge_all
+                Disable local scoring
+            adaptive_concurrency, max_concurrency
+                Adaptive in-flight request limit
+            output_format
+                Also write the final results as parquet if "parquet"
+
+    Returns
+    -------
+    None
+    """
+
+    setup_logging(args)
+
+    shard_index = args.shard_index if args.shards > 1 else None
+    results_path = get_results_path(args, shard_index)
+
+    # An interrupted run leaves its checkpoint under the partial name
+    checkpoint_path = get_partial_path(results_path)
+    if not os.path.exists(checkpoint_path):
+        checkpoint_path = results_path
+
+    previous_results = None
+    if args.resume and os.path.exists(checkpoint_path):
+        previous_results = load_results(checkpoint_path)
+        logging.warning(f"Resuming with {len(previous_results)} results from {checkpoint_path}")
+
+    done_ids = {row["id"] for row in previous_results or []}
+
+    dataset = slice_dataset(
+        load_dataset(args), args.max_examples, args.shards, shard_index or 0, done_ids
+    )
+
+    cache = load_cache(args)
+
+    max_concurrency = args.max_concurrency if args.adaptive_concurrency else None
 
-    results = evaluate_model(dataset)
+    evaluate_model(
+        dataset, results_path, previous_results, cache, args.judge_all, max_concurrency
+    )
+
+    if cache is not None:
+        cache.close()
 
-    save_results(results, args)
+    if args.output_format == "parquet" and shard_index is None:
+        save_parquet(load_results(results_path), args)
 
 
 async def slice_dataset(
         dataset: EarningsCallsDataset,
-        max_examples: int
+        max_examples: int,
+        shards: int = 1,
+        shard_index: int = 0,
+        done_ids: Optional[Set[int]] = None,
     ) -> AsyncGenerator[PromptObject, None]:
     """ Enforce the max_examples limit on the provided
-    dataset
+    dataset, restrict it to one shard of the limited
+    example index space, and skip already evaluated examples
 
     Parameters
     ----------
@@ -48,6 +158,15 @@ async def slice_dataset(
     max_examples: int
         Upper limit of example count
 
+    shards: int = 1
+        Number of shards the examples are split into
+
+    shard_index: int = 0
+        Shard of the examples to yield
+
+    done_ids: Optional[Set[int]] = None
+        Ids of examples already evaluated, which are not yielded
+
     Yields
     ------
     PromptObject
@@ -55,9 +174,12 @@ async def slice_dataset(
 
     """
 
-    for index, example in enumerate(dataset):
-        if index < max_examples:
-            yield PromptObject(prompt=example.get_prompt(), data={"example": example})
+    start, stop = shard_bounds(min(max_examples, len(dataset)), shards, shard_index)
+
+    for example in dataset.iter_range(start, stop):
+        if done_ids and example.get_id() in done_ids:
+            continue
+        yield PromptObject(prompt=example.get_prompt(), data=example)
 
 
 def parse_arguments() -> Namespace:
@@ -74,6 +196,40 @@ def parse_arguments() -> Namespace:
             Max number of examples to evaluate
             default 100
 
+        --shards
+            Number of shards to split the examples into
+            default 1
+
+        --shard-index
+            Shard to evaluate, when omitted with --shards > 1 every
+            shard is run in a local process pool and merged
+
+        --resume
+            Keep the results of an interrupted run and only
+            evaluate the missing examples
+
+        --no-cache
+            Send every prompt to the model, bypassing the response cache
+
+        --cache-readonly
+            Serve cached responses without storing new ones
+
+        --judge-all
+            Send every result to the LLM judge, disabling local scoring
+
+        --adaptive-concurrency
+            Adapt the number of in-flight requests of each stage to
+            the latency and errors of the API
+
+        --max-concurrency
+            Upper bound of the adaptive in-flight request limit
+            default 64
+
+        --output-format
+            Format of the results file, jsonl or parquet, which is
+            written next to the jsonlines results
+            default jsonl
+
     Returns
     -------
     argparse.Namespace
@@ -103,6 +259,56 @@ def parse_arguments() -> Namespace:
         help="The max number of examples to evaluate",
     )
 
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="The number of shards to split the examples into",
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=None,
+        help="The shard to evaluate, runs and merges all shards locally if omitted",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip examples already in the results file of an interrupted run",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Send every prompt to the model, bypassing the response cache",
+    )
+    parser.add_argument(
+        "--cache-readonly",
+        action="store_true",
+        help="Serve cached responses without storing new ones",
+    )
+    parser.add_argument(
+        "--judge-all",
+        action="store_true",
+        help="Send every result to the LLM judge, disabling local scoring",
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="Adapt the number of in-flight requests to API latency and errors",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=64,
+        help="The upper bound of the adaptive in-flight request limit",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=["jsonl", "parquet"],
+        default="jsonl",
+        help="The format of the results file",
+    )
+
     return parser.parse_args()
 
 
@@ -169,14 +375,37 @@ def load_dataset(args: Namespace) -> EarningsCallsDataset:
         raise ValueError(f"Unknown dataset: {args.data}")
 
 
-def save_results(results: List[PromptObject], args: Namespace) -> None:
-    """ Store results in provided path in args
+def load_cache(args: Namespace) -> Optional[ResponseCache]:
+    """ Open the response cache shared by the generation stages
 
     Parameters
     ----------
-    results: List[PromptObject]
-        Return list of query results to LLM
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            no_cache
+                Disable the cache
+            cache_readonly
+                Do not store new responses
+
+    Returns
+    -------
+    Optional[ResponseCache]
+        Response cache, None when disabled
+    """
+
+    if args.no_cache:
+        return None
+
+    return ResponseCache("../data/cache/responses.sqlite", readonly=args.cache_readonly)
+
+
+def get_results_path(args: Namespace, shard_index: Optional[int] = None) -> str:
+    """ Build the results file path for the experiment, or for one
+    shard of it
 
+    Parameters
+    ----------
     args: Namespace
         Input arguments to the main script
         The following values are used:
@@ -184,11 +413,16 @@ def save_results(results: List[PromptObject], args: Namespace) -> None:
                 Path and file name for the evaluation data
             model
                 Name of the model to evaluate
-                default meta-llama/Meta-Llama-3.1-8B-Instruct
+            shards
+                Number of shards the examples are split into
+
+    shard_index: Optional[int] = None
+        Shard of the results, None for the merged experiment results
 
     Returns
     -------
-    None
+    str
+        Path of the results file
     """
 
     base_path = "../data/results"
@@ -197,21 +431,141 @@ def save_results(results: List[PromptObject], args: Namespace) -> None:
     if not os.path.exists(base_path):
         os.makedirs(base_path)
 
-    file_name = f"{base_path}/{experiment_name}_results.json"
-
-    with jsonlines.open(file_name, "w") as writer:
-        for result in results:
-            writer.write(
-                {
-                    "id": result.data["result"]["example_id"],
-                    "prompt": result.data["result"]["prompt"],
-                    "response": result.data["result"]["response"],
-                    "reference_response": result.data["result"]["reference_response"],
-                    "is_exact_match": result.data["result"]["is_exact_match"],
-                    "score": result.data["result"]["score"],
-                    "explanation": result.data["result"]["explanation"],
-                }
-            )
+    if shard_index is None:
+        return f"{base_path}/{experiment_name}_results.json"
+
+    return f"{base_path}/{experiment_name}_shard_{shard_index}_of_{args.shards}_results.json"
+
+
+def load_results(path: str) -> List[Dict[str, Any]]:
+    """ Read the rows checkpointed to a results file. A partial last
+    line, left behind if a run died mid write, is dropped from the
+    file so later appends start on a fresh line.
+
+    Parameters
+    ----------
+    path: str
+        Results file location
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        Rows of the results file
+    """
+
+    rows = []
+    valid_size = 0
+
+    with open(path, "rb") as results_file:
+        for line in results_file:
+            if not line.endswith(b"\n"):
+                break
+            if line.strip():
+                rows.append(json.loads(line))
+            valid_size += len(line)
+
+    if valid_size != os.path.getsize(path):
+        os.truncate(path, valid_size)
+
+    return rows
+
+
+def get_parquet_paths(args: Namespace) -> Tuple[str, str]:
+    """ Build the parquet results path of the experiment and the
+    examples path shared by every experiment on the dataset
+
+    Parameters
+    ----------
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            data
+                Path and file name for the evaluation data
+            model
+                Name of the model to evaluate
+
+    Returns
+    -------
+    Tuple[str, str]
+        Results and examples parquet paths
+    """
+
+    results_path = os.path.splitext(get_results_path(args))[0] + ".parquet"
+    examples_path = os.path.join(os.path.dirname(results_path), f"{args.data}_examples.parquet")
+
+    return results_path, examples_path
+
+
+def save_parquet(rows: List[Dict[str, Any]], args: Namespace) -> None:
+    """ Store result rows in the parquet results of the experiment.
+    Prompts and references go to the dataset's examples file, which
+    stores each example once and is shared across experiments.
+
+    Parameters
+    ----------
+    rows: List[Dict[str, Any]]
+        Rows of the results
+
+    args: Namespace
+        Input arguments to the main script, see get_parquet_paths
+
+    Returns
+    -------
+    None
+    """
+
+    results_path, examples_path = get_parquet_paths(args)
+
+    write_parquet_results(sorted(rows, key=lambda row: row["id"]), results_path, examples_path)
+
+
+def merge_results(args: Namespace) -> None:
+    """ Merge the per-shard result files into the experiment results,
+    ordered by example id, and report the metrics over all shards
+
+    Parameters
+    ----------
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            data
+                Path and file name for the evaluation data
+            model
+                Name of the model to evaluate
+            shards
+                Number of shards to merge
+            output_format
+                Also write the merged results as parquet if "parquet"
+
+    Returns
+    -------
+    None
+    """
+
+    rows: List[Dict[str, Any]] = []
+    shard_paths = [get_results_path(args, index) for index in range(args.shards)]
+
+    for shard_path in shard_paths:
+        rows.extend(load_results(shard_path))
+
+    rows.sort(key=lambda row: row["id"])
+
+    metrics = StreamingMetrics()
+
+    for row in rows:
+        metrics.update(row)
+
+    with AtomicJsonlWriter(get_results_path(args)) as writer:
+        writer.write_batch(rows)
+
+    if args.output_format == "parquet":
+        save_parquet(rows, args)
+
+    for shard_path in shard_paths:
+        os.remove(shard_path)
+
+    metrics.report()
+
 
 if __name__ == "__main__":
     main()
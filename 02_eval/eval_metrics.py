@@ -0,0 +1,318 @@
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import math
+import random
+
+
+class MetricGroup:
+    """
+    Running count, exact match count and score sum for one
+    group of results, e.g. a single ticker or quarter.
+
+    Parameters
+    ----------
+    None
+
+    """
+
+    __slots__ = ("count", "exact_matches", "score_sum")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.exact_matches = 0
+        self.score_sum = 0.0
+
+    def update(self, is_exact_match: bool, score: float) -> None:
+        """ Add a single result to the group
+
+        Parameters
+        ----------
+        is_exact_match: bool
+            Whether the model's value and units matched the reference
+
+        score: float
+            Judge score of the result
+
+        Returns
+        -------
+        None
+        """
+
+        self.count += 1
+        self.exact_matches += int(is_exact_match)
+        self.score_sum += score
+
+    def get_exact_match_rate(self) -> float:
+        """ Fraction of results in the group that are exact matches
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Exact match rate, 0 for an empty group
+        """
+
+        return self.exact_matches / self.count if self.count else 0.0
+
+    def get_mean_score(self) -> float:
+        """ Mean judge score of the results in the group
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Mean score, 0 for an empty group
+        """
+
+        return self.score_sum / self.count if self.count else 0.0
+
+
+class StreamingMetrics:
+    """
+    Metrics accumulator for evaluation results that updates as each
+    result arrives. The memory used is constant in the number of results:
+    score mean and variance use Welford's algorithm, scores are counted
+    in a histogram, breakdowns are kept per ticker and per quarter, and
+    confidence intervals are bootstrapped from a fixed size reservoir
+    sample of the results.
+
+    Parameters
+    ----------
+    reservoir_size: int = 1000
+        Max number of results kept for bootstrap confidence intervals
+
+    bootstrap_samples: int = 1000
+        Number of bootstrap resamples of the reservoir
+
+    seed: int = 42
+        Seed of the reservoir sampling and bootstrap resampling
+
+    """
+
+    def __init__(
+        self, reservoir_size: int = 1000, bootstrap_samples: int = 1000, seed: int = 42
+    ) -> None:
+        self.reservoir_size = reservoir_size
+        self.bootstrap_samples = bootstrap_samples
+        self.random = random.Random(seed)
+
+        self.count = 0
+        self.exact_matches = 0
+        self.score_sum = 0.0
+        self.mean_score = 0.0
+        self.score_m2 = 0.0
+        self.histogram: Counter = Counter()
+        self.by_ticker: Dict[str, MetricGroup] = {}
+        self.by_quarter: Dict[str, MetricGroup] = {}
+        self.reservoir: List[Tuple[bool, float]] = []
+
+    def update(self, result: Dict[str, Any]) -> None:
+        """ Add a single scored result to the metrics
+
+        Parameters
+        ----------
+        result: Dict[str, Any]
+            Row of the results file, holding is_exact_match and score,
+            and optionally ticker and q
+
+        Returns
+        -------
+        None
+        """
+
+        is_exact_match = bool(result["is_exact_match"])
+        score = result["score"]
+
+        self.count += 1
+        self.exact_matches += int(is_exact_match)
+        self.score_sum += score
+
+        delta = score - self.mean_score
+        self.mean_score += delta / self.count
+        self.score_m2 += delta * (score - self.mean_score)
+
+        self.histogram[score] += 1
+
+        for groups, key in ((self.by_ticker, result.get("ticker")), (self.by_quarter, result.get("q"))):
+            if key is not None:
+                groups.setdefault(key, MetricGroup()).update(is_exact_match, score)
+
+        # Reservoir sampling (Algorithm R) keeps a uniform sample of all results
+        if len(self.reservoir) < self.reservoir_size:
+            self.reservoir.append((is_exact_match, score))
+        else:
+            slot = self.random.randrange(self.count)
+            if slot < self.reservoir_size:
+                self.reservoir[slot] = (is_exact_match, score)
+
+    def get_exact_match_rate(self) -> float:
+        """ Fraction of the results seen so far that are exact matches
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Exact match rate, 0 without results
+        """
+
+        return self.exact_matches / self.count if self.count else 0.0
+
+    def get_mean_score(self) -> float:
+        """ Mean judge score of the results seen so far. This is computed
+        from the exact score sum, so it matches a plain average regardless
+        of the order the results arrived in.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Mean score, 0 without results
+        """
+
+        return self.score_sum / self.count if self.count else 0.0
+
+    def get_score_variance(self) -> float:
+        """ Sample variance of the judge scores seen so far
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Variance, 0 with fewer than two results
+        """
+
+        return self.score_m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def get_postfix(self) -> Dict[str, str]:
+        """ Live metrics for display in a tqdm progress bar
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Dict[str, str]
+            Formatted running exact match rate and mean score
+        """
+
+        return {
+            "exact": f"{self.get_exact_match_rate():.3f}",
+            "score": f"{self.get_mean_score():.3f}",
+        }
+
+    def get_confidence_intervals(
+        self, confidence: float = 0.95
+    ) -> Optional[Dict[str, Tuple[float, float]]]:
+        """ Bootstrap confidence intervals of the exact match rate and
+        the mean score from the reservoir sample
+
+        Parameters
+        ----------
+        confidence: float = 0.95
+            Confidence level of the intervals
+
+        Returns
+        -------
+        Optional[Dict[str, Tuple[float, float]]]
+            Lower and upper bounds per metric, None without results
+        """
+
+        if not self.reservoir:
+            return None
+
+        size = len(self.reservoir)
+        exact_means = []
+        score_means = []
+
+        for _ in range(self.bootstrap_samples):
+            sample = self.random.choices(self.reservoir, k=size)
+            exact_means.append(sum(item[0] for item in sample) / size)
+            score_means.append(sum(item[1] for item in sample) / size)
+
+        return {
+            "exact": get_percentile_interval(exact_means, confidence),
+            "score": get_percentile_interval(score_means, confidence),
+        }
+
+    def report(self) -> None:
+        """ Print the aggregate metrics of all results seen so far
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        print("Total results:", self.count)
+
+        if not self.count:
+            return
+
+        print("Avg precision score:", self.get_exact_match_rate())
+        print("Avg score:", self.get_mean_score())
+        print("Score std dev:", math.sqrt(self.get_score_variance()))
+
+        intervals = self.get_confidence_intervals()
+        print("95% CI precision score: [{:.3f}, {:.3f}]".format(*intervals["exact"]))
+        print("95% CI score: [{:.3f}, {:.3f}]".format(*intervals["score"]))
+
+        print("Score histogram:")
+        for score in sorted(self.histogram):
+            print(f"  {score}: {self.histogram[score]}")
+
+        for name, groups in (("ticker", self.by_ticker), ("quarter", self.by_quarter)):
+            if not groups:
+                continue
+            print(f"By {name}:")
+            for key in sorted(groups):
+                group = groups[key]
+                print(
+                    f"  {key}: n={group.count} "
+                    f"precision={group.get_exact_match_rate():.3f} "
+                    f"score={group.get_mean_score():.3f}"
+                )
+
+
+def get_percentile_interval(values: List[float], confidence: float) -> Tuple[float, float]:
+    """ Percentile interval of bootstrap estimates
+
+    Parameters
+    ----------
+    values: List[float]
+        Bootstrap estimates of a metric
+
+    confidence: float
+        Confidence level of the interval
+
+    Returns
+    -------
+    Tuple[float, float]
+        Lower and upper bound of the interval
+    """
+
+    values = sorted(values)
+    tail = (1 - confidence) / 2
+    lower = values[int(tail * (len(values) - 1))]
+    upper = values[int(round((1 - tail) * (len(values) - 1)))]
+
+    return lower, upper
@@ -1,78 +1,246 @@
 import asyncio
 import logging
+import os
+import sys
 
 from tqdm import tqdm
-from typing import List, Any, AsyncGenerator, Generator, Union
+from typing import List, Any, AsyncGenerator, Dict, Generator, Optional, Union
 
 from lamini.generation.base_prompt_object import PromptObject
-from lamini.generation.generation_node import GenerationNode
 from lamini.generation.generation_pipeline import GenerationPipeline
 from lamini.generation.modify_node import ModifyNode
 
-from load_earnings_call_dataset import EarningsCallsDataset
+from load_earnings_call_dataset import EarningsCallsDataset, EarningsCallsExample
+from eval_metrics import StreamingMetrics
+from local_scorer import prescore
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.adaptive_concurrency import AIMDLimiter, make_limiter
+from utils.async_jsonl_sink import AsyncJsonlSink
+from utils.atomic_jsonl_writer import AtomicJsonlWriter
+from utils.cached_generation_node import CachedGenerationNode
+from utils.prompt_templates import LLAMA3_CHAT, SCORE
+from utils.token_budget import render_within_budget
+from utils.response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
 
-def evaluate_model(dataset: AsyncGenerator[PromptObject, None]) -> List[Any]:
-    """ Run model evaluation with the provided dataset
+# Results checkpointed per fsync, a crash loses at most this many, or
+# the results of the last second
+RESULTS_BATCH_SIZE = 32
+
+
+def evaluate_model(
+        dataset: AsyncGenerator[PromptObject, None],
+        results_path: str,
+        previous_results: Optional[List[Dict[str, Any]]] = None,
+        cache: Optional[ResponseCache] = None,
+        judge_all: bool = False,
+        max_concurrency: Optional[int] = None,
+    ) -> StreamingMetrics:
+    """ Run model evaluation with the provided dataset, streaming
+    each result to results_path as soon as it is scored
 
     Parameters
     ----------
-    dataset: EarningsCallsDataset
-        Object handling the loading and formatting of the jsonlines
-        example data
+    dataset: AsyncGenerator[PromptObject, None]
+        Prompts built from the examples still to be evaluated
+
+    results_path: str
+        Jsonlines file the results are checkpointed to
 
-    args: Namespace
-        Input args at runtime
+    previous_results: Optional[List[Dict[str, Any]]] = None
+        Results already checkpointed to results_path, or to its partial
+        file after an interrupted run. When given, new results are
+        appended to that file instead of replacing it, and the metrics
+        cover both.
+
+    cache: Optional[ResponseCache] = None
+        Cache of generate responses, None sends every prompt
+
+    judge_all: bool = False
+        Send every result to the LLM judge, even ones that can be
+        scored locally
+
+    max_concurrency: Optional[int] = None
+        Upper bound of the adaptive in-flight request limit of each
+        stage, None leaves concurrency to the inference queue
 
     Returns
     -------
-    results: List[Any]
-        Returned results from the evaluation pipline
+    metrics: StreamingMetrics
+        Metrics over the previous and newly scored results
     """
 
-    results = asyncio.run(run_evaluation_pipeline(dataset))
+    metrics = StreamingMetrics()
 
-    print("Total results:", len(results))
-    print(
-        "Avg precision score:",
-        sum([result.data["result"]["is_exact_match"] for result in results])
-        / len(results),
-    )
-    print(
-        "Avg score:",
-        sum([result.data["result"]["score"] for result in results]) / len(results),
+    for row in previous_results or []:
+        metrics.update(row)
+
+    asyncio.run(
+        run_evaluation_pipeline(
+            dataset,
+            results_path,
+            metrics,
+            append=previous_results is not None,
+            cache=cache,
+            judge_all=judge_all,
+            max_concurrency=max_concurrency,
+        )
     )
 
-    return results
+    metrics.report()
+
+    if cache is not None:
+        cache.report()
+
+    return metrics
+
+
+async def run_evaluation_pipeline(
+        dataset: AsyncGenerator[PromptObject, None],
+        results_path: str,
+        metrics: StreamingMetrics,
+        append: bool = False,
+        cache: Optional[ResponseCache] = None,
+        judge_all: bool = False,
+        max_concurrency: Optional[int] = None,
+    ) -> None:
+    """ Run model evaluation with the provided dataset. Results are
+    written in small batches by a background thread and fsync'd to
+    results_path + ".partial", so an interrupted run keeps everything
+    scored up to the last batch. The file is renamed to results_path
+    once the run completes. Results are folded into metrics rather
+    than kept, so memory does not grow with the run.
+
+    Parameters
+    ----------
+    dataset: AsyncGenerator[PromptObject, None]
+        Prompts built from the examples to evaluate
+
+    results_path: str
+        Jsonlines file the results are checkpointed to
+
+    metrics: StreamingMetrics
+        Accumulator updated with every result
 
+    append: bool = False
+        Append to the partial or complete results file instead of
+        replacing it
 
-async def run_evaluation_pipeline(dataset: AsyncGenerator[PromptObject, None]) -> List[Any]:
-    """ Run model evaluation with the provided dataset
+    cache: Optional[ResponseCache] = None
+        Cache of generate responses, None sends every prompt
+
+    judge_all: bool = False
+        Send every result to the LLM judge
+
+    max_concurrency: Optional[int] = None
+        Upper bound of the adaptive in-flight request limit of each
+        stage, None disables the limiters
+
+    Returns
+    -------
+    None
+    """
+
+    pipeline = EvaluationPipeline(cache, judge_all, max_concurrency)
+    results = pipeline.call(dataset)
+
+    writer = AtomicJsonlWriter(results_path, append=append, fsync=True)
+
+    async with AsyncJsonlSink(writer, batch_size=RESULTS_BATCH_SIZE) as sink:
+        pbar = tqdm(desc="Saving results", unit=" results")
+        async for result in results:
+            row = get_result_row(result)
+            await sink.write(row)
+
+            metrics.update(row)
+            postfix = metrics.get_postfix()
+            if pipeline.model_gen_stage.limiter is not None:
+                postfix["limit"] = round(pipeline.model_gen_stage.limiter.limit, 1)
+            pbar.set_postfix(postfix, refresh=False)
+            pbar.update()
+
+    score_stage = pipeline.score_stage
+    total = score_stage.local_count + score_stage.cached_count + score_stage.sent_count
+    print(f"Judge calls avoided by local scoring: {score_stage.local_count} of {total}")
+
+    for name, stage in (("Model stage", pipeline.model_gen_stage), ("Score stage", score_stage)):
+        if stage.limiter is not None:
+            stage.limiter.report(name)
+
+
+def get_result_row(result: PromptObject) -> Dict[str, Any]:
+    """ Format a scored result as a row of the results file
 
     Parameters
     ----------
-    dataset: EarningsCallsDataset
-        Object handling the loading and formatting of the jsonlines
-        example data
+    result: PromptObject
+        Result returned from the evaluation pipeline
 
     Returns
     -------
-    result_list: List[Any]
-        Returned results from the evaluation pipline
+    Dict[str, Any]
+        Row of the results file
+    """
+
+    return result.data.to_row()
+
+
+class EvaluationResult:
+    """
+    Judge score of a model response, with the example it answers.
+    The row fields are derived from the example when the row is
+    written, rather than copied into every in-flight result.
+
+    Parameters
+    ----------
+    example: EarningsCallsExample
+        Evaluated example, holding the model response
+
+    score: int
+        Judge score, from 1 to 5
+
+    explanation: str
+        Judge explanation of the score
+
     """
 
-    results = EvaluationPipeline().call(dataset)
+    __slots__ = ("example", "score", "explanation")
+
+    def __init__(self, example: EarningsCallsExample, score: int, explanation: str) -> None:
+        self.example = example
+        self.score = score
+        self.explanation = explanation
+
+    def to_row(self) -> Dict[str, Any]:
+        """ Format the result as a row of the results file
 
-    result_list = []
+        Parameters
+        ----------
+        None
 
-    pbar = tqdm(desc="Saving results", unit=" results")
-    async for result in results:
-        result_list.append(result)
-        pbar.update()
+        Returns
+        -------
+        Dict[str, Any]
+            Row of the results file
+        """
 
-    return result_list
+        example = self.example
+
+        return {
+            "id": example.get_id(),
+            "ticker": example.get_ticker(),
+            "q": example.get_quarter(),
+            "prompt": example.get_prompt(),
+            "response": example.response,
+            "reference_response": example.get_response_json(),
+            "is_exact_match": example.is_exact_match(example.response),
+            "score": self.score,
+            "explanation": self.explanation,
+        }
 
 
 class EvaluationPipeline(GenerationPipeline):
@@ -82,16 +250,29 @@ class EvaluationPipeline(GenerationPipeline):
 
     Parameters
     ----------
-    None
+    cache: Optional[ResponseCache] = None
+        Cache of generate responses shared by the generation stages
+
+    judge_all: bool = False
+        Send every result to the LLM judge
+
+    max_concurrency: Optional[int] = None
+        Upper bound of the adaptive in-flight request limit, each
+        generation stage gets its own limiter. None disables them.
 
     """
 
-    def __init__(self) -> None:
+    def __init__(
+            self,
+            cache: Optional[ResponseCache] = None,
+            judge_all: bool = False,
+            max_concurrency: Optional[int] = None,
+        ) -> None:
         super().__init__()
 
-        self.model_gen_stage = LaminiModelStage()
+        self.model_gen_stage = LaminiModelStage(cache, make_limiter(max_concurrency))
         self.modify_stage = ModifyStage()
-        self.score_stage = ScoreStage()
+        self.score_stage = ScoreStage(cache, judge_all, make_limiter(max_concurrency))
 
     def forward(
             self, x: Union[Generator[PromptObject, None, None], AsyncGenerator[PromptObject, None]]
@@ -122,20 +303,26 @@ class EvaluationPipeline(GenerationPipeline):
         return x
 
 
-class LaminiModelStage(GenerationNode):
+class LaminiModelStage(CachedGenerationNode):
     """
     Extension of a GenerationNode for generation calls within a pipeline
 
     Parameters
     ----------
-    None
+    cache: Optional[ResponseCache] = None
+        Cache of generate responses, None sends every prompt
+
+    limiter: Optional[AIMDLimiter] = None
+        Adaptive limit on in-flight requests
 
     """
 
-    def __init__(self):
+    def __init__(self, cache: Optional[ResponseCache] = None, limiter: Optional[AIMDLimiter] = None):
         super().__init__(
             model_name="meta-llama/Meta-Llama-3.1-8B-Instruct",
             max_new_tokens=150,
+            cache=cache,
+            limiter=limiter,
         )
 
     def preprocess(self, prompt: PromptObject) -> PromptObject:
@@ -152,10 +339,11 @@ class LaminiModelStage(GenerationNode):
             Formatted new prompt ready for forward call
         """
 
-        example = prompt.data["example"]
-        new_prompt = "<|begin_of_text|><|start_header_id|>user<|end_header_id|>"
-        new_prompt += example.get_prompt() + "<|eot_id|>"
-        new_prompt += "<|start_header_id|>assistant<|end_header_id|>"
+        example = prompt.data
+        # The instructions open the prompt and the question ends it
+        new_prompt = render_within_budget(
+            LLAMA3_CHAT, self.get_prompt_budget(), "prompt", "middle", prompt=example.get_prompt()
+        )
         return PromptObject(prompt=new_prompt, data=prompt.data)
 
 
@@ -185,24 +373,61 @@ class ModifyStage(ModifyNode):
         None
         """
 
-        result.data["example"].response = result.response
+        result.data.response = result.response
 
 
-class ScoreStage(GenerationNode):
+class ScoreStage(CachedGenerationNode):
     """
-    Extension of a GenerationNode for scoring of a prompt within a pipeline
+    Extension of a GenerationNode for scoring of a prompt within a pipeline.
+    Responses the rubric decides without a judge, such as exact or unit
+    converted value matches, are scored locally by local_scorer.prescore
+    and never sent to the LLM judge.
 
     Parameters
     ----------
-    None
+    cache: Optional[ResponseCache] = None
+        Cache of generate responses, None sends every prompt
+
+    judge_all: bool = False
+        Send every result to the LLM judge
+
+    limiter: Optional[AIMDLimiter] = None
+        Adaptive limit on in-flight requests
 
     """
 
-    def __init__(self):
+    def __init__(
+            self,
+            cache: Optional[ResponseCache] = None,
+            judge_all: bool = False,
+            limiter: Optional[AIMDLimiter] = None,
+        ):
         super().__init__(
             model_name="meta-llama/Meta-Llama-3.1-8B-Instruct",
             max_new_tokens=150,
+            cache=cache,
+            limiter=limiter,
         )
+        self.judge_all = judge_all
+
+    def get_local_response(self, example: PromptObject) -> Optional[Dict[str, Any]]:
+        """ Score the result locally when the rubric decides it
+
+        Parameters
+        ----------
+        example: PromptObject
+            Prompt object with the model stage response
+
+        Returns
+        -------
+        Optional[Dict[str, Any]]
+            Judge style response, None to send it to the judge
+        """
+
+        if self.judge_all:
+            return None
+
+        return prescore(example.data, example.data.response)
 
     def preprocess(self, example: PromptObject) -> None:
         """ Preprocess provided prompt object before generate call
@@ -217,27 +442,19 @@ class ScoreStage(GenerationNode):
         None
         """
 
-        response = example.data["example"].format_response(example.response)
-
-        prompt = "<s>[INSTR]A large language model (LLM) is going to answer a question. "
-        prompt += (
-            "Your job is to score the answer, comparing it to a golden reference. "
+        response = example.data.format_response(example.response)
+
+        # An overlong model answer is cut, the rubric and gold answer are kept
+        example.prompt = render_within_budget(
+            SCORE,
+            self.get_prompt_budget(),
+            "model_answer",
+            "head",
+            rubric=example.data.get_rubric(),
+            question=example.data.get_question(),
+            gold_answer=example.data.get_response(response),
+            model_answer=response,
         )
-        prompt += "You are an expert scorer.\n\n"
-        prompt += "Rate the answer using a score from 1 (lowest match) to 5 (highest match).\n"
-        prompt += example.data["example"].get_rubric()
-        prompt += "Use the full range. Read the gold answer carefully. "
-        prompt += "Explain your score in 2-3 sentences, then assign a score. "
-        prompt += 'Output your score as a JSON object in the format {"explanation" : str, "score" : int}\n'
-        prompt += "Use single quotes within your explanation. End your explanation with a double quote.\n"
-        prompt += "Prefer answers that are most similar to the gold answer, even if the gold answer refused to answer the question.\n\n"
-        prompt += f"========== question =========\n{example.data['example'].get_question()}\n\n"
-        prompt += f"========== gold answer =========\n{example.data['example'].get_response(response)}\n\n"
-        prompt += f"========== model answer =========\n{response}\n\n"
-        prompt += "=" * 40 + "\n\n"
-        prompt += f"How would you score the model's answer compared to the gold answer (using the 1-5 scale defined above)?[/INSTR]"
-
-        example.prompt = prompt
 
     def postprocess(self, result: PromptObject) -> None:
         """ Postprocess provided prompt object after generate call
@@ -252,12 +469,6 @@ class ScoreStage(GenerationNode):
         None
         """
 
-        result.data["result"] = {
-            "example_id": result.data["example"].get_id(),
-            "prompt": result.data["example"].get_prompt(),
-            "response": result.data["example"].response,
-            "reference_response": result.data["example"].get_response_json(),
-            "is_exact_match": result.data["example"].is_exact_match(result.data["example"].response),
-            "score": result.response["score"],
-            "explanation": result.response["explanation"],
-        }
+        result.data = EvaluationResult(
+            result.data, result.response["score"], result.response["explanation"]
+        )
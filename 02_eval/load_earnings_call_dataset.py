@@ -1,7 +1,20 @@
-from typing import Generator, Dict, Any
+from array import array
+from typing import Generator, Dict, Any, Optional
 
-import jsonlines
+import os
 import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.jsonl_reader import JsonlReader
+from utils.prompt_templates import (
+    EARNINGS_QUERY,
+    EARNINGS_QUESTION,
+    SCORE_RUBRIC,
+    VALUE,
+    VALUE_ANSWER,
+)
 
 
 class EarningsCallsExample:
@@ -17,13 +30,26 @@ class EarningsCallsExample:
         Index location of the example
 
     example: Dict[str, Any]
-        Key/Value pairs of information for the jsonline example
+        Key/Value pairs of information for the jsonline example. Only
+        the fields used are kept, in slots, with the ticker, date and
+        quarter interned since many examples share them.
 
     """
 
+    __slots__ = ("index", "ticker", "date", "q", "question", "answer", "value", "units", "response")
+
     def __init__(self, index, example) -> None:
         self.index = index
-        self.example = example
+        self.ticker = sys.intern(example["ticker"])
+        self.date = sys.intern(example["date"])
+        self.q = sys.intern(example["q"])
+        self.question = example["question"]
+        self.answer = example["answer"]
+        self.value = example["value"]
+        self.units = example["units"]
+
+        # Model response, set by the evaluation pipeline
+        self.response: Optional[Dict[str, Any]] = None
 
     def get_id(self) -> int:
         """ Getter function for the example ID
@@ -40,9 +66,39 @@ class EarningsCallsExample:
 
         return self.index
 
+    def get_ticker(self) -> str:
+        """ Getter function for the company ticker of the example
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            Ticker string within the example data
+        """
+
+        return self.ticker
+
+    def get_quarter(self) -> str:
+        """ Getter function for the quarter of the earnings call
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            Quarter string within the example data, e.g. 2020-Q3
+        """
+
+        return self.q
+
     def get_prompt(self) -> str:
         """ Getter function to build the prompt format using
-        information within the self.example dictionary.
+        information of this example.
 
         Parameters
         ----------
@@ -51,26 +107,12 @@ class EarningsCallsExample:
         Returns
         -------
         prompt: str
-            Formatting prompt string containing self.example information
+            Formatting prompt string containing the example information
         """
 
-        prompt = (
-            "You are a financial analyst with extensive experience at Goldman Sachs. "
+        return EARNINGS_QUESTION.render(
+            date=self.date, ticker=self.ticker, q=self.q, question=self.question
         )
-        prompt += "You are reading questions that you have heard from a client about a specific earnings call. "
-        prompt += "The question asks about specific numbers mentioned in the call. "
-        prompt += "Format your answer as a json object with the following fields: { 'answer': str, 'value': float, 'units': str }. "
-        prompt += "Limit value to 2 significant digits. "
-        prompt += "For example if the answer is 22%, the value should be 22.0 and the units should be 'percent'. "
-        prompt += "The question is about this earnings call:\n"
-        prompt += "====================\n"
-        prompt += f"Date of the call: {self.example['date']}\n"
-        prompt += f"Ticker: {self.example['ticker']}\n"
-        prompt += f"Quarter: {self.example['q']}\n"
-        prompt += "====================\n"
-        prompt += "The client asks\n"
-        prompt += self.example["question"]
-        return prompt
 
     def get_query(self) -> str:
         """ Getter function to build a query using this example data
@@ -82,15 +124,12 @@ class EarningsCallsExample:
         Returns
         -------
         prompt: str
-            Formatting prompt string containing self.example information
+            Formatting prompt string containing the example information
         """
 
-        prompt = f"Date of the call: {self.example['date']}\n"
-        prompt += f"Ticker: {self.example['ticker']}\n"
-        prompt += f"Quarter: {self.example['q']}\n"
-        prompt += self.example["question"]
-
-        return prompt
+        return EARNINGS_QUERY.render(
+            date=self.date, ticker=self.ticker, q=self.q, question=self.question
+        )
 
     def is_exact_match(self, response: Dict[str, Any]) -> bool:
         """ Comparison of a response from Lamini.generate with the
@@ -114,8 +153,8 @@ class EarningsCallsExample:
             return False
 
         return (
-            self.example["units"] == response["units"]
-            and self.example["value"] == response["value"]
+            self.units == response["units"]
+            and self.value == response["value"]
         )
 
     def get_question(self) -> str:
@@ -132,7 +171,7 @@ class EarningsCallsExample:
             Question string within the example data
         """
 
-        return self.example["question"]
+        return self.question
 
     def get_response(self, response: Dict[str, Any]) -> str:
         """ Getter function for the expected response for this example
@@ -150,11 +189,10 @@ class EarningsCallsExample:
             example
         """
 
-        expected_response = f"Value: {self.example['value']} {self.example['units']}\n"
         if "answer" in response and isinstance(response, dict) and response["answer"] != "N/A":
-            expected_response += f"Answer: {self.example['answer']}\n"
+            return VALUE_ANSWER.render(value=self.value, units=self.units, answer=self.answer)
 
-        return expected_response
+        return VALUE.render(value=self.value, units=self.units)
 
     def get_response_json(self) -> Dict[str, Any]:
         """ Getter function for the expected response in json format
@@ -171,9 +209,9 @@ class EarningsCallsExample:
         """
 
         return {
-            "answer": self.example["answer"],
-            "value": self.example["value"],
-            "units": self.example["units"],
+            "answer": self.answer,
+            "value": self.value,
+            "units": self.units,
         }
 
     def get_default_response(self) -> Dict[str, str]:
@@ -215,15 +253,15 @@ class EarningsCallsExample:
         if "value" not in response:
             return "Unknown value\n"
 
-        formatted_response = f"Value: {response['value']} {response['units']}\n"
-
         if response["answer"] != "N/A":
-            formatted_response += f"Answer: {response['answer']}\n"
+            return VALUE_ANSWER.render(
+                value=response["value"], units=response["units"], answer=response["answer"]
+            )
 
-        return formatted_response
+        return VALUE.render(value=response["value"], units=response["units"])
 
     def get_rubric(self) -> str:
-        """ Rubric string construction and format
+        """ Rubric string, a constant shared by every example
 
         Parameters
         ----------
@@ -235,33 +273,34 @@ class EarningsCallsExample:
             Formatted rubric for queries in Lamini.generate
         """
 
-        prompt = "Read this scoring rubric carefully and follow the instructions precisely:\n"
-        prompt += "A score of 5 means that model's value is the same as the gold answer's id.\n"
-        prompt += "A score of 4 means that the model's answer is the same or a paraphrase of the gold answer, but the value may not be an exact match. For example, the values '1 million' and '1000.0 thousand' are different ways of describing the same value\n"
-        prompt += "A score of 3 means that the model's answer is similar as the gold answer's description, but the value may be wrong. Both answers may indicate that revenue is increased but the gold says 12 percent and the model say 50 million USD.\n"
-        prompt += "A score of 2 means that the model's answer is not similar to the gold answer, but the answer is plausible.\n"
-        prompt += "A score of 1 means that the model's answer is not similar to the gold answer, and the answer doesn't make sense.\n"
-
-        prompt += "Assign a 5 for a correct value even if other fields are missing.\n"
-
-        return prompt
+        return SCORE_RUBRIC
 
 class EarningsCallsDataset:
     """
     A Dataset handler for iteration as well as output type formatting for
     Lamini generate calls.
 
+    Rather than loading the whole jsonlines file into memory, the file is
+    read through a JsonlReader, which memory maps it and persists a line
+    offset index next to the data file (``<path>.idx``). Iteration shuffles
+    the line positions with a fixed seed and decodes each line on demand,
+    so peak memory is bounded by the index rather than the corpus.
+
     Parameters
     ----------
     path: str
         Dataset path string
 
+    seed: int = 42
+        Seed for the deterministic shuffle of the examples
+
     """
 
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, seed: int = 42) -> None:
         self.path = path
+        self.seed = seed
 
-        self.length = self.get_length()
+        self.reader = JsonlReader(path)
 
     def __len__(self) -> int:
         """ Length measured of lines within the json lines
@@ -273,13 +312,14 @@ class EarningsCallsDataset:
         Returns
         -------
         int:
-            Number of lines, as definied within __init__
+            Number of lines, as recorded in the offset index
         """
 
-        return self.length
+        return len(self.reader)
 
     def __iter__(self) -> Generator[EarningsCallsExample, None, None]:
-        """ Iteration of the provided jsonlines file
+        """ Iteration of the provided jsonlines file in a seeded,
+        deterministic shuffled order
 
         Parameters
         ----------
@@ -288,19 +328,56 @@ class EarningsCallsDataset:
         Yields
         ------
         EarningsCallsExample:
-            Number of lines, as definied within __init__
+            Example built from the next line of the shuffled order
+        """
+
+        return self.iter_range(0, len(self))
+
+    def iter_range(
+            self, start: int, stop: int
+        ) -> Generator[EarningsCallsExample, None, None]:
+        """ Iteration over a contiguous range of the shuffled order.
+        Example ids match the ones produced by a full iteration, so
+        disjoint ranges can be evaluated separately and merged.
+
+        Parameters
+        ----------
+        start: int
+            First position of the shuffled order to yield
+
+        stop: int
+            Position of the shuffled order to stop before
+
+        Yields
+        ------
+        EarningsCallsExample:
+            Example built from the next line of the shuffled order
         """
-        items = []
 
-        with jsonlines.open(self.path) as reader:
-            for obj in reader:
-                items.append(obj)
+        order = self.get_order()
 
-        random.seed(42)
-        random.shuffle(items)
+        for index in range(start, min(stop, len(order))):
+            yield EarningsCallsExample(index, self.reader[order[index]])
 
-        for index, item in enumerate(items):
-            yield EarningsCallsExample(index, item)
+    def get_order(self) -> array:
+        """ Return the seeded shuffle of line positions. Shuffling the
+        positions produces the same permutation as shuffling the loaded
+        items themselves, so example ids stay stable.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        array:
+            Line positions in iteration order
+        """
+
+        order = array("Q", range(len(self.reader)))
+        random.Random(self.seed).shuffle(order)
+
+        return order
 
     def get_length(self) -> int:
         """ Return the number of lines in the jsonlines file
@@ -309,13 +386,13 @@ class EarningsCallsDataset:
         ----------
         None
 
-        Yields
-        ------
+        Returns
+        -------
         int:
             number of lines within the jsonlines file
         """
 
-        return sum(1 for line in self)
+        return len(self)
 
     def get_output_type(self) -> Dict[str, str]:
         """ Return the dictionary for the output format
@@ -0,0 +1,218 @@
+from typing import Any, Dict, Optional, Tuple
+
+import math
+import re
+
+from load_earnings_call_dataset import EarningsCallsExample
+
+
+# Multipliers of the magnitude words that appear in units, e.g. "RMB billion"
+SCALES = {
+    "thousand": 1e3,
+    "k": 1e3,
+    "million": 1e6,
+    "mn": 1e6,
+    "mm": 1e6,
+    "billion": 1e9,
+    "bn": 1e9,
+    "trillion": 1e12,
+}
+
+# Spellings of the same base unit, mapped to one canonical name
+SYNONYMS = {
+    "%": "percent",
+    "percentage": "percent",
+    "pct": "percent",
+    "$": "dollar",
+    "usd": "dollar",
+    "us dollar": "dollar",
+    "u.s. dollar": "dollar",
+    "bp": "basis point",
+    "bps": "basis point",
+    "basis points": "basis point",
+    "x": "times",
+}
+
+# Base units expressed as a scaled version of another base unit
+CONVERSIONS = {
+    "basis point": (0.01, "percent"),
+}
+
+CURRENCIES = {"dollar"}
+
+# Relative tolerance for values to count as the same, the model is
+# asked to limit values to 2 significant digits
+RELATIVE_TOLERANCE = 0.05
+
+
+def parse_value(value: Any) -> Optional[float]:
+    """ Parse a response value into a float
+
+    Parameters
+    ----------
+    value: Any
+        Value field of a response, a number or a numeric string
+
+    Returns
+    -------
+    Optional[float]
+        Parsed value, None if the value is missing or not numeric
+    """
+
+    if isinstance(value, bool):
+        return None
+
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+
+    if isinstance(value, str):
+        cleaned = value.replace(",", "").replace("$", "").replace("%", "").strip()
+        try:
+            return parse_value(float(cleaned))
+        except ValueError:
+            return None
+
+    return None
+
+
+def normalize_quantity(value: Any, units: Any) -> Optional[Tuple[float, str]]:
+    """ Normalize a value and its units to a magnitude in a canonical
+    base unit, e.g. (1000.0, "thousand dollars") becomes (1e6, "dollar")
+
+    Parameters
+    ----------
+    value: Any
+        Value field of a response
+
+    units: Any
+        Units field of a response
+
+    Returns
+    -------
+    Optional[Tuple[float, str]]
+        Scaled value and canonical base unit, an empty base unit for
+        plain counts. None if the value is not numeric.
+    """
+
+    magnitude = parse_value(value)
+    if magnitude is None or not isinstance(units, str):
+        return None
+
+    words = []
+    for word in re.findall(r"[a-z.$%]+", units.lower()):
+        if word in SCALES:
+            magnitude *= SCALES[word]
+        else:
+            words.append(word)
+
+    base = SYNONYMS.get(" ".join(words), " ".join(words))
+    if len(base) > 1 and base.endswith("s"):
+        base = SYNONYMS.get(base[:-1], base[:-1])
+
+    if base in CONVERSIONS:
+        factor, base = CONVERSIONS[base]
+        magnitude *= factor
+
+    return magnitude, base
+
+
+def are_units_compatible(units: str, other_units: str) -> bool:
+    """ Whether two canonical base units describe the same kind of value.
+    A bare magnitude such as "million" is compatible with currencies,
+    since the references state dollar amounts that way.
+
+    Parameters
+    ----------
+    units: str
+        Canonical base unit
+
+    other_units: str
+        Canonical base unit
+
+    Returns
+    -------
+    bool
+        Result of the comparison
+    """
+
+    if units == other_units:
+        return True
+
+    return {units, other_units} <= CURRENCIES | {""} and "" in {units, other_units}
+
+
+def prescore(
+        example: EarningsCallsExample, response: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+    """ Score a model response locally when the rubric decides it
+    without a judge: a value equal to the reference in the same units,
+    up to their spelling, scores 5, and the same value in other units,
+    e.g. after magnitude scaling, or a value within rounding tolerance
+    of it scores 4. Everything else is left to the LLM judge.
+
+    Parameters
+    ----------
+    example: EarningsCallsExample
+        Example the response answers
+
+    response: Dict[str, Any]
+        Response of the model stage
+
+    Returns
+    -------
+    Optional[Dict[str, Any]]
+        Judge style response with explanation and score, None when
+        the response needs the LLM judge
+    """
+
+    if not isinstance(response, dict):
+        return None
+
+    if example.is_exact_match(response):
+        return {
+            "explanation": "Scored locally: the value and units exactly match the gold answer.",
+            "score": 5,
+        }
+
+    reference = example.get_response_json()
+    expected = normalize_quantity(reference["value"], reference["units"])
+    actual = normalize_quantity(response.get("value"), response.get("units"))
+
+    if expected is None or actual is None:
+        return None
+
+    if not are_units_compatible(expected[1], actual[1]):
+        return None
+
+    # The rubric gives a 4 to the same value in other units, e.g.
+    # "1 million" and "1000.0 thousand", units of compatible bases are
+    # the same if they have the same scale
+    same_units = normalize_quantity(1, reference["units"])[0] == normalize_quantity(1, response["units"])[0]
+
+    if math.isclose(expected[0], actual[0], rel_tol=1e-9):
+        if same_units:
+            return {
+                "explanation": (
+                    "Scored locally: the value is the same as the gold answer in the "
+                    f"same units ({actual[0]:g})."
+                ),
+                "score": 5,
+            }
+        return {
+            "explanation": (
+                "Scored locally: the value is the same as the gold answer after "
+                f"unit conversion ({actual[0]:g})."
+            ),
+            "score": 4,
+        }
+
+    if math.isclose(expected[0], actual[0], rel_tol=RELATIVE_TOLERANCE):
+        return {
+            "explanation": (
+                "Scored locally: the value matches the gold answer within rounding "
+                f"after unit normalization ({actual[0]:g} vs {expected[0]:g})."
+            ),
+            "score": 4,
+        }
+
+    return None
@@ -0,0 +1,194 @@
+from typing import Any, Dict, List, Optional
+
+import hashlib
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Scores, flags and the model response, one row per scored example
+RESULTS_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("example_key", pa.int64()),
+        ("ticker", pa.dictionary(pa.int32(), pa.string())),
+        ("q", pa.dictionary(pa.int32(), pa.string())),
+        ("response_answer", pa.string()),
+        ("response_value", pa.float64()),
+        ("response_units", pa.dictionary(pa.int32(), pa.string())),
+        ("is_exact_match", pa.bool_()),
+        ("score", pa.int8()),
+        ("explanation", pa.string()),
+    ]
+)
+
+# Prompts and references, stored once per dataset and joined on
+# example_key, a hash of their content, as ids are only positions in
+# the dataset and change with it
+EXAMPLES_SCHEMA = pa.schema(
+    [
+        ("example_key", pa.int64()),
+        ("prompt", pa.string()),
+        ("reference_answer", pa.string()),
+        ("reference_value", pa.float64()),
+        ("reference_units", pa.dictionary(pa.int32(), pa.string())),
+    ]
+)
+
+
+def to_float(value: Any) -> Optional[float]:
+    """ Coerce a response value to a float column entry
+
+    Parameters
+    ----------
+    value: Any
+        Value field of a response
+
+    Returns
+    -------
+    Optional[float]
+        Value as a float, None if it is not numeric
+    """
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_example_key(row: Dict[str, Any]) -> int:
+    """ Key of the prompt and reference of a result row in the
+    examples table
+
+    Parameters
+    ----------
+    row: Dict[str, Any]
+        Row in the format of the jsonlines results file
+
+    Returns
+    -------
+    int
+        Signed 64 bit hash of the prompt and reference response
+    """
+
+    payload = json.dumps([row["prompt"], row["reference_response"]], sort_keys=True, default=str)
+
+    return int.from_bytes(hashlib.blake2b(payload.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def write_parquet_results(
+    rows: List[Dict[str, Any]], results_path: str, examples_path: str
+) -> None:
+    """ Write result rows as a typed results table, and add their
+    prompts and references to the dataset's examples table, keyed by
+    their content so that rows of another version of the dataset are
+    stored alongside instead of being joined to the wrong prompts
+
+    Parameters
+    ----------
+    rows: List[Dict[str, Any]]
+        Rows in the format of the jsonlines results file
+
+    results_path: str
+        Parquet file of the results
+
+    examples_path: str
+        Parquet file of the examples, shared by every run on the dataset
+
+    Returns
+    -------
+    None
+    """
+
+    responses = [row["response"] if isinstance(row["response"], dict) else {} for row in rows]
+    keys = [get_example_key(row) for row in rows]
+
+    results = pa.table(
+        {
+            "id": [row["id"] for row in rows],
+            "example_key": keys,
+            "ticker": [row.get("ticker") for row in rows],
+            "q": [row.get("q") for row in rows],
+            "response_answer": [str(response.get("answer", "")) for response in responses],
+            "response_value": [to_float(response.get("value")) for response in responses],
+            "response_units": [str(response.get("units", "")) for response in responses],
+            "is_exact_match": [row["is_exact_match"] for row in rows],
+            "score": [row["score"] for row in rows],
+            "explanation": [row["explanation"] for row in rows],
+        },
+        schema=RESULTS_SCHEMA,
+    )
+    pq.write_table(results, results_path)
+
+    examples = pa.table(
+        {
+            "example_key": keys,
+            "prompt": [row["prompt"] for row in rows],
+            "reference_answer": [row["reference_response"]["answer"] for row in rows],
+            "reference_value": [to_float(row["reference_response"]["value"]) for row in rows],
+            "reference_units": [row["reference_response"]["units"] for row in rows],
+        },
+        schema=EXAMPLES_SCHEMA,
+    )
+
+    stored = None
+    known = set()
+    if os.path.exists(examples_path):
+        stored = pq.read_table(examples_path, schema=EXAMPLES_SCHEMA)
+        known.update(stored["example_key"].to_pylist())
+
+    # Only examples not stored yet, once each, e.g. a question asked twice
+    new = []
+    for key in keys:
+        new.append(key not in known)
+        known.add(key)
+    examples = examples.filter(pa.array(new, pa.bool_()))
+
+    if stored is not None:
+        examples = pa.concat_tables([stored, examples])
+
+    pq.write_table(examples.sort_by("example_key"), examples_path)
+
+
+def read_parquet_results(
+    results_path: str,
+    examples_path: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List] = None,
+) -> pa.Table:
+    """ Read a results table, optionally only some columns and rows.
+    Filters are pushed down to the parquet reader, so row groups that
+    cannot match are skipped, e.g. filters=[("ticker", "=", "AAPL")].
+
+    Parameters
+    ----------
+    results_path: str
+        Parquet file of the results
+
+    examples_path: Optional[str] = None
+        Parquet file of the examples, joined on example_key when given
+
+    columns: Optional[List[str]] = None
+        Results columns to read, None reads all of them
+
+    filters: Optional[List] = None
+        pyarrow filters on the results columns
+
+    Returns
+    -------
+    pa.Table
+        Results, with the example columns when examples_path is given
+    """
+
+    if columns is not None and examples_path is not None and "example_key" not in columns:
+        columns = ["example_key"] + columns
+
+    results = pq.read_table(results_path, columns=columns, filters=filters)
+
+    if examples_path is not None:
+        examples = pq.read_table(examples_path)
+        results = results.join(examples, "example_key").sort_by("id")
+
+    return results
+
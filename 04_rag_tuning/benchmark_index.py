@@ -0,0 +1,364 @@
+import faiss
+import lamini
+import numpy as np
+import os
+import sys
+import time
+
+from argparse import ArgumentParser, Namespace
+from typing import Any, Dict, List, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.ann_index import IndexSpec, get_index_bytes
+from utils.embedding_ingest import FakeEmbedder, batched, embed_batch
+from utils.jsonl_reader import stream_jsonl
+from utils.rag_index import RagIndex
+
+DEFAULT_CONFIGS = [
+    "flat",
+    "ivf-flat:nlist=1024,nprobe=8",
+    "ivf-flat:nlist=1024,nprobe=32",
+    "ivf-pq:nlist=1024,pq_m=16,nprobe=16",
+    "ivf-pq:nlist=1024,pq_m=48,nprobe=32",
+    "hnsw:hnsw_m=32,ef_search=32",
+    "hnsw:hnsw_m=32,ef_search=128",
+]
+
+
+def main() -> None:
+    """ Compare index types and parameters on the same vectors and
+    queries, against the exact results of a flat index
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+
+    args = parse_arguments()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    if args.index_dir:
+        vectors, queries = load_real_embeddings(args)
+    else:
+        vectors, queries = make_synthetic_embeddings(args)
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, dimension {vectors.shape[1]}, k {args.k}")
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    results = []
+    built: Dict[Tuple, Tuple[Any, float]] = {}
+    for config in args.configs:
+        spec = IndexSpec.parse(config)
+        structure = spec.get_structure()
+        if structure not in built:
+            built[structure] = build_index(spec, vectors, args.train_size)
+        index, build_seconds = built[structure]
+        spec.configure(index)
+        results.append(evaluate(spec, index, build_seconds, queries, truth, args.k))
+
+    report(results, args.k)
+
+
+def make_synthetic_embeddings(args: Namespace) -> Tuple[np.ndarray, np.ndarray]:
+    """ Normalized vectors drawn around random centers, which cluster
+    like real embeddings, unlike uniform noise
+
+    Parameters
+    ----------
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            synthetic, dimension, queries, seed
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Indexed vectors and held out query vectors, float32
+    """
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((max(args.synthetic // 100, 1), args.dimension), dtype=np.float32)
+
+    def sample(count: int) -> np.ndarray:
+        vectors = centers[rng.integers(len(centers), size=count)]
+        vectors = vectors + 0.5 * rng.standard_normal((count, args.dimension), dtype=np.float32)
+        return np.ascontiguousarray(vectors / np.linalg.norm(vectors, axis=1, keepdims=True))
+
+    return sample(args.synthetic), sample(args.queries)
+
+
+def load_real_embeddings(args: Namespace) -> Tuple[np.ndarray, np.ndarray]:
+    """ Vectors of a saved flat or HNSW RAG index, and embeddings of
+    the questions of a jsonlines file
+
+    Parameters
+    ----------
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            index_dir, questions, queries, fake_embedder
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Indexed vectors and query vectors, float32
+    """
+
+    with RagIndex(args.index_dir, readonly=True) as rag_index:
+        if rag_index.spec.kind not in ("flat", "hnsw"):
+            raise ValueError(f"Vectors cannot be read back exactly from a {rag_index.spec.kind} index")
+        inner = faiss.downcast_index(rag_index.index.index)
+        vectors = inner.reconstruct_n(0, inner.ntotal)
+
+    embedder = FakeEmbedder(vectors.shape[1]) if args.fake_embedder else lamini.Embedding()
+    questions = [line["question"] for line in stream_jsonl(args.questions, args.queries)]
+    queries = np.vstack([embed_batch(embedder, batch) for batch in batched(questions, 32)])
+
+    return np.ascontiguousarray(vectors, dtype=np.float32), queries
+
+
+def build_index(spec: IndexSpec, vectors: np.ndarray, train_size: int) -> Tuple[Any, float]:
+    """ Build an index of the vectors, trained on a random sample
+
+    Parameters
+    ----------
+    spec: IndexSpec
+        Index type and parameters
+
+    vectors: np.ndarray
+        Vectors to add, their ids are their positions
+
+    train_size: int
+        Number of training vectors
+
+    Returns
+    -------
+    Tuple[Any, float]
+        Index and build seconds, training included
+    """
+
+    start = time.perf_counter()
+
+    index = spec.build(vectors.shape[1])
+    if spec.needs_training:
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), min(train_size, len(vectors)), replace=False)]
+        spec.check_training_size(len(sample))
+        index.train(sample)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+
+    return index, time.perf_counter() - start
+
+
+def evaluate(
+    spec: IndexSpec, index: Any, build_seconds: float, queries: np.ndarray, truth: np.ndarray, k: int
+) -> Dict[str, Any]:
+    """ Recall, query throughput and size of an index
+
+    Parameters
+    ----------
+    spec: IndexSpec
+        Index type and parameters
+
+    index: Any
+        Index built from the spec
+
+    build_seconds: float
+        Build time
+
+    queries: np.ndarray
+        Query vectors
+
+    truth: np.ndarray
+        Exact k nearest ids of every query
+
+    k: int
+        Number of neighbors
+
+    Returns
+    -------
+    Dict[str, Any]
+        Row of the report
+    """
+
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    seconds = time.perf_counter() - start
+
+    found = sum(len(np.intersect1d(row, exact)) for row, exact in zip(ids, truth))
+    size = get_index_bytes(index)
+
+    return {
+        "index": spec.get_factory_string(),
+        "search": ",".join(f"{name}={value}" for name, value in spec.get_search_parameters().items()),
+        "build_seconds": build_seconds,
+        "qps": len(queries) / seconds if seconds > 0 else float("inf"),
+        "recall": found / (len(queries) * k),
+        "mb": size / 1024 / 1024,
+        "bytes_per_vector": size / index.ntotal,
+    }
+
+
+def report(results: List[Dict[str, Any]], k: int) -> None:
+    """ Print the results, one row per configuration
+
+    Parameters
+    ----------
+    results: List[Dict[str, Any]]
+        Rows from evaluate
+
+    k: int
+        Number of neighbors
+
+    Returns
+    -------
+    None
+    """
+
+    print(
+        f"{'index':<22}{'search':<14}{'build s':>9}{'QPS':>10}"
+        f"{f'recall@{k}':>11}{'MB':>9}{'B/vector':>10}"
+    )
+    for row in results:
+        print(
+            f"{row['index']:<22}{row['search']:<14}{row['build_seconds']:>9.2f}{row['qps']:>10.0f}"
+            f"{row['recall']:>11.3f}{row['mb']:>9.1f}{row['bytes_per_vector']:>10.0f}"
+        )
+
+
+def parse_arguments() -> Namespace:
+    """ Argument Parser setup
+    The following arguments are used in this script:
+        --configs
+            Index configurations, as "kind:name=value,...", see
+            IndexSpec.parse
+            default flat, ivf-flat, ivf-pq and hnsw at two operating
+            points each
+
+        --k
+            Number of neighbors recall is measured at
+            default 10
+
+        --synthetic
+            Number of synthetic vectors, unless --index-dir is given
+            default 100000
+
+        --dimension
+            Size of the synthetic vectors
+            default 384
+
+        --queries
+            Max number of queries
+            default 1000
+
+        --index-dir
+            Saved flat or HNSW RAG index to read real vectors from
+
+        --questions
+            Jsonlines file of the questions embedded as real queries
+            default ../data/golden_test_set.jsonl
+
+        --fake-embedder
+            Embed the questions with the deterministic FakeEmbedder
+
+        --train-size
+            Number of vectors IVF indexes are trained on
+            default 32768
+
+        --threads
+            Number of faiss threads, 0 keeps the faiss default
+            default 0
+
+        --seed
+            Seed of the synthetic vectors
+            default 0
+
+    Returns
+    -------
+    argparse.Namespace
+        Namespace object storing the given args as attributes
+    """
+
+    parser = ArgumentParser()
+
+    parser.add_argument(
+        "--configs",
+        nargs="+",
+        default=DEFAULT_CONFIGS,
+        help="The index configurations, as kind:name=value,...",
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=10,
+        help="The number of neighbors recall is measured at",
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=100000,
+        help="The number of synthetic vectors",
+    )
+    parser.add_argument(
+        "--dimension",
+        type=int,
+        default=384,
+        help="The size of the synthetic vectors",
+    )
+    parser.add_argument(
+        "--queries",
+        type=int,
+        default=1000,
+        help="The max number of queries",
+    )
+    parser.add_argument(
+        "--index-dir",
+        type=str,
+        default=None,
+        help="The saved flat or HNSW RAG index to read real vectors from",
+    )
+    parser.add_argument(
+        "--questions",
+        type=str,
+        default="../data/golden_test_set.jsonl",
+        help="The jsonlines file of questions embedded as real queries",
+    )
+    parser.add_argument(
+        "--fake-embedder",
+        action="store_true",
+        help="Embed the questions with a deterministic fake embedder",
+    )
+    parser.add_argument(
+        "--train-size",
+        type=int,
+        default=32768,
+        help="The number of vectors IVF indexes are trained on",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="The number of faiss threads, 0 keeps the default",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The seed of the synthetic vectors",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
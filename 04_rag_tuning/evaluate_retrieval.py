@@ -0,0 +1,346 @@
+import asyncio
+import lamini
+import numpy as np
+import os
+import sys
+
+from argparse import ArgumentParser, Namespace
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.bm25_index import Bm25Index
+from utils.embedding_ingest import FakeEmbedder
+from utils.hybrid_retrieval import RETRIEVAL_MODES, RETRIEVAL_STAGES, RRF_K, HybridRetriever
+from utils.jsonl_reader import stream_jsonl
+from utils.number_grounding import Quantity, extract_quantities, get_number_index
+from utils.prompt_templates import EARNINGS_QUERY
+from utils.query_filters import parse_query_filter
+from utils.rag_index import RagIndex
+
+
+def main() -> None:
+    """ Compare the retrievers on the questions of a golden test set,
+    searched in a saved RAG index
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+
+    args = parse_arguments()
+
+    with RagIndex(args.index_dir, readonly=True) as index:
+        index.set_search_parameters(args.nprobe, args.ef_search)
+        bm25 = Bm25Index.open(index, args.bm25_k1, args.bm25_b)
+        embedder = FakeEmbedder(index.meta["dimension"]) if args.fake_embedder else lamini.Embedding()
+
+        # Questions about transcripts missing from the index cannot be answered
+        # by any retriever and are left out
+        sources = index.get_sources()
+        examples = list(stream_jsonl(args.questions, args.max_questions))
+        indexed = [
+            example for example in examples if (example["ticker"].encode(), example["q"].encode()) in sources
+        ]
+        print(f"{len(indexed)} of {len(examples)} questions are about indexed calls, k {args.k}")
+        if not indexed:
+            return
+
+        with HybridRetriever(
+            index, bm25, embedder, args.candidates, args.vector_weight, args.bm25_weight, args.rrf_k
+        ) as retriever:
+            results = [asyncio.run(evaluate(retriever, indexed, mode, args)) for mode in args.modes]
+
+    report(results, args.k)
+
+
+def get_gold_quantity(example: Dict[str, Any]) -> Optional[Quantity]:
+    """ Value of the gold answer, as the number grounding checks find
+    it in transcripts
+
+    Parameters
+    ----------
+    example: Dict[str, Any]
+        Golden test set line with value and units
+
+    Returns
+    -------
+    Optional[Quantity]
+        Quantity of the value, None if the example has none
+    """
+
+    if not example.get("has_value") or not isinstance(example.get("value"), (int, float)):
+        return None
+
+    quantities = extract_quantities(f"{example['value']:g} {example.get('units', '')}")
+
+    return quantities[0] if quantities else None
+
+
+async def evaluate(
+    retriever: HybridRetriever, examples: List[Dict[str, Any]], mode: str, args: Namespace
+) -> Dict[str, Any]:
+    """ Recall and latency of a retriever. A question is a hit if one
+    of its k chunks is from the call it is about, and an answer hit if
+    one of these chunks also mentions the value of its gold answer.
+
+    Parameters
+    ----------
+    retriever: HybridRetriever
+        Retriever over the index
+
+    examples: List[Dict[str, Any]]
+        Golden test set lines about indexed calls
+
+    mode: str
+        One of RETRIEVAL_MODES
+
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            k, query_filter
+
+    Returns
+    -------
+    Dict[str, Any]
+        Row of the report
+    """
+
+    index = retriever.rag_index
+    source_hits = 0
+    answer_hits = 0
+    answers = 0
+    timings: Dict[str, List[float]] = {stage: [] for stage in RETRIEVAL_STAGES}
+
+    for example in examples:
+        query_filter = None
+        if args.query_filter:
+            query = EARNINGS_QUERY.render(
+                date=example.get("date", ""), ticker=example["ticker"], q=example["q"], question=example["question"]
+            )
+            query_filter = parse_query_filter(query)
+
+        hits, query_timings = await retriever.retrieve(example["question"], args.k, query_filter, mode)
+        for stage, seconds in query_timings.items():
+            timings[stage].append(seconds)
+
+        key = (example["ticker"].encode(), example["q"].encode())
+        relevant = [row for row, _ in hits if (index.chunks[row]["ticker"], index.chunks[row]["q"]) == key]
+        source_hits += bool(relevant)
+
+        quantity = get_gold_quantity(example)
+        if quantity is not None:
+            answers += 1
+            answer_hits += any(get_number_index(index.get_text(row)).contains(quantity) for row in relevant)
+
+    return {
+        "mode": mode,
+        "source_recall": source_hits / len(examples),
+        "answer_recall": answer_hits / answers if answers else float("nan"),
+        "latency": {stage: np.array(seconds) * 1000 for stage, seconds in timings.items() if seconds},
+    }
+
+
+def report(results: List[Dict[str, Any]], k: int) -> None:
+    """ Print the recall and the mean latency of every stage of every
+    retriever, and the 95th percentile of the total
+
+    Parameters
+    ----------
+    results: List[Dict[str, Any]]
+        Rows from evaluate
+
+    k: int
+        Number of chunks per question
+
+    Returns
+    -------
+    None
+    """
+
+    print(
+        f"{'mode':<8}{f'call@{k}':>9}{f'answer@{k}':>10}"
+        + "".join(f"{stage + ' ms':>11}" for stage in RETRIEVAL_STAGES)
+        + f"{'p95 ms':>9}"
+    )
+    for row in results:
+        latency = row["latency"]
+        print(
+            f"{row['mode']:<8}{row['source_recall']:>9.3f}{row['answer_recall']:>10.3f}"
+            + "".join(
+                f"{latency[stage].mean():>11.2f}" if stage in latency else f"{'-':>11}" for stage in RETRIEVAL_STAGES
+            )
+            + f"{np.percentile(latency['total'], 95):>9.2f}"
+        )
+
+
+def parse_arguments() -> Namespace:
+    """ Argument Parser setup
+    The following arguments are used in this script:
+        --index-dir
+            Directory of the saved RAG index, built by rag.py
+            default ../data/cache/rag_index
+
+        --questions
+            Jsonlines file of questions with ticker, q, date, value
+            and units
+            default ../data/golden_test_set.jsonl
+
+        --max-questions
+            Max number of questions, unset uses them all
+
+        --modes
+            Retrievers to compare, among vector, bm25 and hybrid
+            default all three
+
+        --k
+            Number of chunks retrieved per question
+            default 2
+
+        --candidates
+            Number of chunks each retriever contributes to the hybrid
+            fusion
+            default 20
+
+        --vector-weight
+            Weight of the faiss ranking in the fusion
+            default 1.0
+
+        --bm25-weight
+            Weight of the BM25 ranking in the fusion
+            default 1.0
+
+        --rrf-k
+            Rank offset of the fusion
+            default 60
+
+        --bm25-k1
+            BM25 term frequency saturation
+            default 1.2
+
+        --bm25-b
+            BM25 strength of the chunk length normalization
+            default 0.75
+
+        --nprobe
+            IVF lists scanned per query, unset keeps the saved value
+
+        --ef-search
+            HNSW candidates explored per query, unset keeps the saved
+            value
+
+        --query-filter
+            Restrict every question to its ticker, quarter and call
+            date, as rag.py does for queries that name them
+
+        --fake-embedder
+            Embed the questions with the deterministic FakeEmbedder,
+            for an index built with it
+
+    Returns
+    -------
+    argparse.Namespace
+        Namespace object storing the given args as attributes
+    """
+
+    parser = ArgumentParser()
+
+    parser.add_argument(
+        "--index-dir",
+        type=str,
+        default="../data/cache/rag_index",
+        help="The directory of the saved RAG index",
+    )
+    parser.add_argument(
+        "--questions",
+        type=str,
+        default="../data/golden_test_set.jsonl",
+        help="The jsonlines file of questions",
+    )
+    parser.add_argument(
+        "--max-questions",
+        type=int,
+        default=None,
+        help="The max number of questions",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=RETRIEVAL_MODES,
+        default=list(RETRIEVAL_MODES),
+        help="The retrievers to compare",
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=2,
+        help="The number of chunks retrieved per question",
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=20,
+        help="The number of chunks each retriever contributes to the fusion",
+    )
+    parser.add_argument(
+        "--vector-weight",
+        type=float,
+        default=1.0,
+        help="The weight of the faiss ranking in the fusion",
+    )
+    parser.add_argument(
+        "--bm25-weight",
+        type=float,
+        default=1.0,
+        help="The weight of the BM25 ranking in the fusion",
+    )
+    parser.add_argument(
+        "--rrf-k",
+        type=int,
+        default=RRF_K,
+        help="The rank offset of the fusion",
+    )
+    parser.add_argument(
+        "--bm25-k1",
+        type=float,
+        default=1.2,
+        help="The BM25 term frequency saturation",
+    )
+    parser.add_argument(
+        "--bm25-b",
+        type=float,
+        default=0.75,
+        help="The BM25 strength of the chunk length normalization",
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=None,
+        help="The number of IVF lists scanned per query",
+    )
+    parser.add_argument(
+        "--ef-search",
+        type=int,
+        default=None,
+        help="The number of HNSW candidates explored per query",
+    )
+    parser.add_argument(
+        "--query-filter",
+        action="store_true",
+        help="Restrict every question to its ticker, quarter and call date",
+    )
+    parser.add_argument(
+        "--fake-embedder",
+        action="store_true",
+        help="Embed the questions with a deterministic fake embedder",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
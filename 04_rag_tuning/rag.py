@@ -1,50 +1,479 @@
-import faiss
+import asyncio
 import lamini
-import jsonlines
+import os
+import sys
 
-# Number of nearest chunks to return
-k = 2
+from argparse import ArgumentParser, Namespace
+from typing import Optional
 
-# Set up for the index, which holds the embeddings, and the splits, which holds the corresponding plain text
-index = None
-splits = []
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
-# Instantiate Lamini's embedding client
-embedding_client = lamini.Embedding()
+from utils.ann_index import INDEX_TYPES, IndexSpec
+from utils.bm25_index import Bm25Index
+from utils.embedding_ingest import FakeEmbedder
+from utils.hybrid_retrieval import RETRIEVAL_MODES, RETRIEVAL_STAGES, RRF_K, HybridRetriever
+from utils.jsonl_reader import stream_jsonl
+from utils.prompt_templates import RAG_QUESTION
+from utils.query_filters import QueryFilter, parse_call_date, parse_query_filter
+from utils.rag_index import RagIndex
+from utils.token_budget import CONTEXT_TOKENS, render_within_budget
 
-with jsonlines.open("data.jsonl", "r") as file:
-    for item in file:
-        # Create an embedding for every 'transcript' item in the file and add to the index
-        transcript_embedding = embedding_client.generate(item['transcript'])
-        if not index:
-            index = faiss.IndexFlatL2(transcript_embedding.size) # Set the size of the index based on model embedding size
-        index.add(transcript_embedding)
-        splits.append(item['transcript'])
 
-question = "What is TSMC's 2019 revenue in USD?"
+def main() -> None:
+    """ Update the index, retrieve the chunks most relevant to the question
+    and answer it from them
 
-# Generate the embedding for the question
-question_embedding = embedding_client.generate(question)
+    Parameters
+    ----------
+    None
 
-# Find the k nearest neighbors in the index for the question embedding
-distances, indices = index.search(question_embedding, k)
+    Returns
+    -------
+    None
+    """
 
-# Retrieve the relevant data from the splits based on hits in the index
-relevant_data = [splits[i] for i in indices[0] if i >= 0]
+    args = parse_arguments()
 
-# Instantiate Lamini's LLM client
-llm = lamini.Lamini(model_name="meta-llama/Meta-Llama-3.1-8B-Instruct")
+    # Instantiate Lamini's embedding client, or the local fake one
+    if args.fake_embedder:
+        embedding_client = FakeEmbedder()
+    else:
+        embedding_client = lamini.Embedding()
 
-# Form the prompt using the RAG hits and the question
-prompt = f"""\
-<|begin_of_text|><|start_header_id|>user<|end_header_id|>
+    # Open the index saved by previous runs, which holds the embeddings, the
+    # metadata of every chunk and the plain text of the transcripts
+    index = RagIndex(args.index_dir, readonly=args.serve, spec=get_index_spec(args))
+    index.set_search_parameters(args.nprobe, args.ef_search)
 
-{relevant_data}
-{question}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-"""
+    if not args.serve:
+        # Split the new and changed transcripts into chunks, embed them in batches
+        # and add them to the index, unchanged transcripts are not embedded again
+        stats = asyncio.run(
+            index.update(
+                embedding_client,
+                stream_jsonl(args.data),
+                args.chunk_tokens,
+                args.chunk_overlap,
+                args.batch_size,
+                args.concurrency,
+                args.prune,
+            )
+        )
+        stats.report()
 
-print(prompt)
+    # Open the keyword index of the chunks, rebuilt from the text store if they changed
+    bm25 = Bm25Index.open(index)
 
-# Send the prompt to the LLM to generate an answer!
-response = llm.generate(prompt)
-print(response)
+    # Restrict the search to the chunks of the ticker, quarter and dates given as
+    # arguments or named in the question
+    query_filter = get_query_filter(args, index)
+
+    # Embed the question and search faiss while BM25 scores it, then fuse the two
+    # rankings, among the chunks that match the filter, or all of them if none do
+    with HybridRetriever(
+        index, bm25, embedding_client, args.candidates, args.vector_weight, args.bm25_weight, args.rrf_k
+    ) as retriever:
+        hits, timings = asyncio.run(retriever.retrieve(args.question, args.k, query_filter, args.retrieval))
+        if not hits and query_filter:
+            print(f"No chunks match {query_filter}, searching all of them")
+            hits, timings = asyncio.run(retriever.retrieve(args.question, args.k, None, args.retrieval))
+
+    stages = ", ".join(f"{stage} {timings[stage] * 1000:.1f} ms" for stage in RETRIEVAL_STAGES if stage in timings)
+    print(f"Retrieved {len(hits)} chunks by {args.retrieval} search, {query_filter}: {stages}")
+
+    # Retrieve the text of the hits from the text store, best first
+    relevant_data = [index.get_text(row) for row, _ in hits]
+
+    # Form the prompt using the RAG hits and the question, dropping the lowest ranked hits
+    # that do not fit the token budget
+    prompt = render_within_budget(
+        RAG_QUESTION,
+        CONTEXT_TOKENS - args.max_new_tokens,
+        "context",
+        "drop",
+        context=relevant_data,
+        question=args.question,
+    )
+
+    print(prompt)
+
+    if args.fake_embedder:
+        return
+
+    # Instantiate Lamini's LLM client
+    llm = lamini.Lamini(model_name="meta-llama/Meta-Llama-3.1-8B-Instruct")
+
+    # Send the prompt to the LLM to generate an answer!
+    response = llm.generate(prompt, max_new_tokens=args.max_new_tokens)
+    print(response)
+
+
+def get_index_spec(args: Namespace) -> Optional[IndexSpec]:
+    """ Index type and parameters from the arguments
+
+    Parameters
+    ----------
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            index_type, nlist, pq_m, hnsw_m, train_size
+
+    Returns
+    -------
+    Optional[IndexSpec]
+        Spec of the index type, None to use the saved index as is
+    """
+
+    if args.index_type is None:
+        return None
+
+    return IndexSpec(
+        args.index_type,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        hnsw_m=args.hnsw_m,
+        train_size=args.train_size,
+    )
+
+
+def get_query_filter(args: Namespace, index: RagIndex) -> QueryFilter:
+    """ Metadata filter of the search, from the arguments, completed
+    with the ticker, quarter and call date found in the question
+
+    Parameters
+    ----------
+    args: Namespace
+        Input arguments to the main script
+        The following values are used:
+            question, ticker, quarter, date_from, date_to, no_query_filter
+
+    index: RagIndex
+        Index searched, whose tickers can be named in the question
+
+    Returns
+    -------
+    QueryFilter
+        Filter of the search, empty to search every chunk
+    """
+
+    dates = []
+    for date in (args.date_from, args.date_to):
+        day = parse_call_date(date) if date else 0
+        if date and not day:
+            raise ValueError(f"Cannot parse the date {date}, expected YYYY-MM-DD")
+        dates.append(day)
+
+    query_filter = QueryFilter(args.ticker or (), args.quarter or (), *dates)
+    if args.no_query_filter:
+        return query_filter
+
+    return query_filter.update(parse_query_filter(args.question, index.get_tickers()))
+
+
+def parse_arguments() -> Namespace:
+    """ Argument Parser setup
+    The following arguments are used in this script:
+        --data
+            Jsonlines file, or directory of shards, of transcripts
+            default data.jsonl
+
+        --question
+            Question to answer
+            default What is TSMC's 2019 revenue in USD?
+
+        --k
+            Number of nearest chunks to return
+            default 2
+
+        --max-new-tokens
+            Token budget of the answer, the prompt gets the rest of
+            the context window
+            default 256
+
+        --chunk-tokens
+            Token budget of the transcript chunks
+            default 256
+
+        --chunk-overlap
+            Tokens repeated between consecutive chunks
+            default 32
+
+        --batch-size
+            Number of chunks embedded per API call
+            default 32
+
+        --concurrency
+            Max number of embedding calls in flight
+            default 4
+
+        --index-dir
+            Directory of the persistent index
+            default ../data/cache/rag_index
+
+        --serve
+            Answer from the saved index without updating it, the
+            index is memory mapped and nothing is embedded but the
+            question
+
+        --prune
+            Remove the transcripts that are not in the data from the
+            index
+
+        --index-type
+            flat, ivf-flat, ivf-pq or hnsw, see utils/ann_index.py.
+            A saved index of another type, or with other nlist, pq-m
+            or hnsw-m, is rebuilt. Unset keeps the saved index, or
+            builds a flat one.
+
+        --nlist
+            Number of IVF lists
+            default 1024
+
+        --pq-m
+            Number of PQ codes per vector
+            default 16
+
+        --hnsw-m
+            Neighbors per HNSW node
+            default 32
+
+        --train-size
+            Number of vectors IVF indexes are trained on
+            default 32768
+
+        --nprobe
+            IVF lists scanned per query, unset keeps the saved value
+
+        --ef-search
+            HNSW candidates explored per query, unset keeps the saved
+            value
+
+        --retrieval
+            vector for faiss search, bm25 for keyword search, hybrid
+            for both fused by reciprocal rank fusion
+            default hybrid
+
+        --candidates
+            Number of chunks each retriever contributes to the hybrid
+            fusion
+            default 20
+
+        --vector-weight
+            Weight of the faiss ranking in the fusion
+            default 1.0
+
+        --bm25-weight
+            Weight of the BM25 ranking in the fusion
+            default 1.0
+
+        --rrf-k
+            Rank offset of the fusion, higher values flatten the weight
+            of the top ranks
+            default 60
+
+        --ticker
+            Tickers the retrieved chunks must be from, by default the
+            ticker named in the question, if any
+
+        --quarter
+            Quarters the retrieved chunks must be from, e.g. 2021-Q3,
+            by default the quarter named in the question, if any
+
+        --date-from
+            First call date, YYYY-MM-DD, of the retrieved chunks
+
+        --date-to
+            Last call date, YYYY-MM-DD, of the retrieved chunks
+
+        --no-query-filter
+            Do not take the ticker, quarter and call date from the
+            question, only from the arguments
+
+        --fake-embedder
+            Embed locally with the deterministic FakeEmbedder and
+            skip the LLM call, for testing without API calls
+
+    Returns
+    -------
+    argparse.Namespace
+        Namespace object storing the given args as attributes
+    """
+
+    parser = ArgumentParser()
+
+    parser.add_argument(
+        "--data",
+        type=str,
+        default="data.jsonl",
+        help="The jsonlines file, or directory of shards, of transcripts",
+    )
+    parser.add_argument(
+        "--question",
+        type=str,
+        default="What is TSMC's 2019 revenue in USD?",
+        help="The question to answer",
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=2,
+        help="The number of nearest chunks to return",
+    )
+    parser.add_argument(
+        "--max-new-tokens",
+        type=int,
+        default=256,
+        help="The token budget of the answer",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=256,
+        help="The token budget of the transcript chunks",
+    )
+    parser.add_argument(
+        "--chunk-overlap",
+        type=int,
+        default=32,
+        help="The number of tokens repeated between consecutive chunks",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="The number of chunks embedded per API call",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="The max number of embedding calls in flight",
+    )
+    parser.add_argument(
+        "--index-dir",
+        type=str,
+        default="../data/cache/rag_index",
+        help="The directory of the persistent index",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Answer from the saved index without updating it",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Remove the transcripts that are not in the data from the index",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=INDEX_TYPES,
+        default=None,
+        help="The faiss index type, unset keeps the saved index",
+    )
+    parser.add_argument(
+        "--nlist",
+        type=int,
+        default=1024,
+        help="The number of IVF lists",
+    )
+    parser.add_argument(
+        "--pq-m",
+        type=int,
+        default=16,
+        help="The number of PQ codes per vector",
+    )
+    parser.add_argument(
+        "--hnsw-m",
+        type=int,
+        default=32,
+        help="The number of neighbors per HNSW node",
+    )
+    parser.add_argument(
+        "--train-size",
+        type=int,
+        default=32768,
+        help="The number of vectors IVF indexes are trained on",
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=None,
+        help="The number of IVF lists scanned per query",
+    )
+    parser.add_argument(
+        "--ef-search",
+        type=int,
+        default=None,
+        help="The number of HNSW candidates explored per query",
+    )
+    parser.add_argument(
+        "--retrieval",
+        choices=RETRIEVAL_MODES,
+        default="hybrid",
+        help="The retriever, faiss, BM25 or both fused",
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=20,
+        help="The number of chunks each retriever contributes to the fusion",
+    )
+    parser.add_argument(
+        "--vector-weight",
+        type=float,
+        default=1.0,
+        help="The weight of the faiss ranking in the fusion",
+    )
+    parser.add_argument(
+        "--bm25-weight",
+        type=float,
+        default=1.0,
+        help="The weight of the BM25 ranking in the fusion",
+    )
+    parser.add_argument(
+        "--rrf-k",
+        type=int,
+        default=RRF_K,
+        help="The rank offset of the fusion",
+    )
+    parser.add_argument(
+        "--ticker",
+        nargs="+",
+        default=None,
+        help="The tickers the retrieved chunks must be from",
+    )
+    parser.add_argument(
+        "--quarter",
+        nargs="+",
+        default=None,
+        help="The quarters the retrieved chunks must be from, e.g. 2021-Q3",
+    )
+    parser.add_argument(
+        "--date-from",
+        type=str,
+        default=None,
+        help="The first call date, YYYY-MM-DD, of the retrieved chunks",
+    )
+    parser.add_argument(
+        "--date-to",
+        type=str,
+        default=None,
+        help="The last call date, YYYY-MM-DD, of the retrieved chunks",
+    )
+    parser.add_argument(
+        "--no-query-filter",
+        action="store_true",
+        help="Do not take the ticker, quarter and call date from the question",
+    )
+    parser.add_argument(
+        "--fake-embedder",
+        action="store_true",
+        help="Embed locally with a deterministic fake embedder and skip the LLM call",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
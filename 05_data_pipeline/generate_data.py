@@ -1,15 +1,41 @@
-from typing import Union, Iterator, AsyncIterator, Generator, Dict, Any, AsyncGenerator
+from typing import Union, Iterator, AsyncIterator, Generator, AsyncGenerator, Optional
 import asyncio
-import itertools
-import jsonlines
+import hashlib
+import json
 import logging
+import os
+import sys
 
+from argparse import ArgumentParser, Namespace
 from tqdm import tqdm
 
-from lamini.generation.generation_node import GenerationNode
+from lamini.generation.base_node_object import BaseGenerationNode
 from lamini.generation.generation_pipeline import GenerationPipeline
 from lamini.generation.base_prompt_object import PromptObject
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.adaptive_concurrency import AIMDLimiter, make_limiter
+from utils.async_jsonl_sink import AsyncJsonlSink
+from utils.atomic_jsonl_writer import SUFFIXES, AtomicJsonlWriter
+from utils.cached_generation_node import CachedGenerationNode
+from utils.jsonl_reader import stream_jsonl
+from utils.minhash_index import MinHashIndex
+from utils.number_grounding import find_ungrounded
+from utils.pipeline_dag import PipelineDAG
+from utils.prompt_templates import (
+    ANSWER_GENERATION,
+    ANSWER_QUESTION,
+    ANSWER_UNUSED,
+    COMPANY_INFO,
+    QUESTION_GENERATION,
+)
+from utils.response_cache import ResponseCache
+from utils.rotating_jsonl_writer import RotatingJsonlWriter
+from utils.text_chunker import chunk_bounds
+from utils.token_budget import render_within_budget
+from utils.transcript_records import QAPair, QuestionSet, TranscriptChunk, TranscriptStore
+
 logger = logging.getLogger(__name__)
 
 logging.basicConfig(
@@ -20,17 +46,100 @@ logging.basicConfig(
 
 class QuestionAnswerPipeline(GenerationPipeline):
     """
-    An extension fo the GenerationPipeline that will put two
-    nodes in sequence, one to generate questions from a provided
-    prompt, and the next to answer the generated question from the
-    prior node.
+    An extension fo the GenerationPipeline that will put five
+    nodes in sequence, one to split transcripts into chunks, one to
+    generate questions from each chunk, one to drop near-duplicate
+    questions, one to answer the remaining questions from the chunk
+    they were asked about, and the last to check the numbers of each
+    answer against that chunk. The nodes run as stages of a
+    PipelineDAG, each with its own bounded input queue and workers,
+    so a slow stage does not hold up the others until its queue fills.
+
+    Parameters
+    ----------
+    cache: Optional[ResponseCache] = None
+        Cache of generate responses shared by both nodes
+
+    max_concurrency: Optional[int] = None
+        Upper bound of the adaptive in-flight request limit, each
+        node gets its own limiter. None disables them.
+
+    chunk_tokens: int = 512
+        Token budget of a transcript chunk
+
+    chunk_overlap: int = 64
+        Tokens repeated between consecutive chunks
+
+    question_index: Optional[MinHashIndex] = None
+        Index of the questions already generated, None keeps
+        every question
+
+    grounding: str = "drop"
+        What to do with answers whose numbers are not in the chunk,
+        "drop", "flag" or "off"
+
+    question_workers: int = 1
+        Number of concurrent request streams of the question generator
+
+    answer_workers: int = 1
+        Number of concurrent request streams of the answer generator
+
+    queue_size: int = 64
+        Max items waiting in the input queue of each stage
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        cache: Optional[ResponseCache] = None,
+        max_concurrency: Optional[int] = None,
+        chunk_tokens: int = 512,
+        chunk_overlap: int = 64,
+        question_index: Optional[MinHashIndex] = None,
+        grounding: str = "drop",
+        question_workers: int = 1,
+        answer_workers: int = 1,
+        queue_size: int = 64,
+    ):
         super(QuestionAnswerPipeline, self).__init__()
 
-        self.question_generator = QuestionGenerator()
-        self.answer_generator = AnswerGenerator()
+        self.transcript_chunker = TranscriptChunker(chunk_tokens, chunk_overlap)
+        self.question_generator = QuestionGenerator(cache, make_limiter(max_concurrency))
+        self.question_deduplicator = QuestionDeduplicator(question_index)
+        self.answer_generator = AnswerGenerator(cache, make_limiter(max_concurrency))
+        self.answer_verifier = AnswerVerifier(grounding)
+
+        # The nodes stay attributes of the pipeline, which connects them
+        # to the inference queue, the graph only schedules them
+        self.dag = (
+            PipelineDAG()
+            .add_stage("chunk", self.transcript_chunker, queue_size=queue_size)
+            .add_stage(
+                "question",
+                self.question_generator,
+                inputs=["chunk"],
+                workers=question_workers,
+                queue_size=queue_size,
+                output_type={
+                    "question_1": "str",
+                    "question_2": "str",
+                    "question_3": "str",
+                },
+            )
+            .add_stage("dedup", self.question_deduplicator, inputs=["question"], queue_size=queue_size)
+            .add_stage(
+                "answer",
+                self.answer_generator,
+                inputs=["dedup"],
+                workers=answer_workers,
+                queue_size=queue_size,
+                output_type={
+                    "answer_1": "str",
+                    "answer_2": "str",
+                    "answer_3": "str",
+                },
+            )
+            .add_stage("verify", self.answer_verifier, inputs=["answer"], queue_size=queue_size)
+        )
 
     def forward(self, x: Union[Iterator, AsyncIterator]) -> AsyncIterator:
         """ Main function for execution of a provided prompt. This
@@ -62,23 +171,65 @@ class QuestionAnswerPipeline(GenerationPipeline):
             https://github.com/lamini-ai/lamini/blob/main/lamini/generation/generation_node.py#L42
         """
 
-        x = self.question_generator(x, output_type={
-            "question_1": "str",
-            "question_2": "str",
-            "question_3": "str",
-        })
-        x = self.answer_generator(x)
-        return x
+        return self.dag.run(x)
+
+class TranscriptChunker(BaseGenerationNode):
+    """Node splitting the transcript of each earnings call into
+    overlapping chunks that fit the token budget, cut on sentence and
+    speaker turn boundaries. One PromptObject is yielded per chunk,
+    holding a TranscriptChunk, so every question is asked and answered
+    against its own chunk only, and the chunks of one call are sent in
+    parallel. Chunks are offsets into the shared transcript, which is
+    not copied.
+
+    Parameters
+    ----------
+    max_tokens: int = 512
+        Token budget of a chunk
+
+    overlap_tokens: int = 64
+        Tokens repeated between consecutive chunks
+    """
+
+    def __init__(self, max_tokens: int = 512, overlap_tokens: int = 64):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def __call__(self, *args, **kwargs):
+        return self.chunk(*args, **kwargs)
+
+    async def chunk(self, prompt: AsyncIterator[PromptObject]) -> AsyncIterator[PromptObject]:
+        """ Fan out each earnings call into one prompt per chunk
+
+        Parameters
+        ----------
+        prompt: AsyncIterator[PromptObject]
+            Earnings calls holding their Transcript
+
+        Yields
+        ------
+        PromptObject
+            Prompt holding a single TranscriptChunk
+        """
+
+        async for call in prompt:
+            transcript = call.data
+            bounds = chunk_bounds(transcript.text, self.max_tokens, self.overlap_tokens)
+            logger.info(f"Split {transcript.ticker}, {transcript.q} into {len(bounds)} chunks")
+
+            for index, (start, end) in enumerate(bounds):
+                chunk = TranscriptChunk(transcript, start, end, index, len(bounds))
+                yield PromptObject(prompt=call.prompt, data=chunk)
 
-def get_company_info(chunk: PromptObject) -> str:
+
+def get_company_info(chunk: TranscriptChunk) -> str:
     """Static function used for the GenerationNodes in the
     QuestionAnswerPipeline
 
     Parameters
     ----------
-    chunk: PromptObject
-        EarningsExample prompt data holding the
-        company metadata
+    chunk: TranscriptChunk
+        Chunk of the transcript holding the company metadata
 
     Returns
     -------
@@ -86,14 +237,13 @@ def get_company_info(chunk: PromptObject) -> str:
         Constructed string using the company metadata
 
     """
-    info = f"Company: {chunk.data['exchange']}\n"
-    info += f"Ticker: {chunk.data['ticker']}\n"
-    info += f"Date: {chunk.data['date']}\n"
-    info += f"Quarter: {chunk.data['q']}\n"
-    return info
+    transcript = chunk.transcript
+    return COMPANY_INFO.render(
+        exchange=transcript.exchange, ticker=transcript.ticker, date=transcript.date, q=transcript.q
+    )
 
 
-class QuestionGenerator(GenerationNode):
+class QuestionGenerator(CachedGenerationNode):
     """GenerationNode represents a step of processing in a pipeline.
 
     GenerationNode.__call__() is the entrypoint, which includes 3 sub-steps for each prompt:
@@ -108,11 +258,20 @@ class QuestionGenerator(GenerationNode):
     self.preprocess() or self.postprocess().
 
     You may implement self.preprocess() and self.postprocess() for your own purpose.
+
+    Responses are served from the cache, when one is given, for prompts
+    that were already sent in an earlier run, and the limiter, when one
+    is given, adapts the number of requests in flight.
     """
 
-    def __init__(self):
+    def __init__(
+        self, cache: Optional[ResponseCache] = None, limiter: Optional[AIMDLimiter] = None
+    ):
         super(QuestionGenerator, self).__init__(
-            model_name="meta-llama/Meta-Llama-3.1-8B-Instruct", max_new_tokens=150
+            model_name="meta-llama/Meta-Llama-3.1-8B-Instruct",
+            max_new_tokens=150,
+            cache=cache,
+            limiter=limiter,
         )
 
     def preprocess(self, prompt: PromptObject) -> None:
@@ -130,22 +289,24 @@ class QuestionGenerator(GenerationNode):
         """
 
         prompt.prompt = self.make_prompt(prompt)
-        logger.info(f"Generating question for {prompt.data['ticker']}, {prompt.data['q']}")
+        transcript = prompt.data.transcript
+        logger.info(f"Generating question for {transcript.ticker}, {transcript.q}")
 
-    def postprocess(self, prompt: PromptObject) -> Generator[PromptObject, None, None]:
+    def postprocess(self, prompt: PromptObject) -> PromptObject:
         """ Postprocess the resulting prompts from the generate call
-        of this Node. Iterate through all three questions generated
-        and build new PromptObjects for each question.
+        of this Node. The three questions generated from a chunk are
+        kept together, so they are answered in a single request that
+        sends the chunk once.
 
         Parameters
         ----------
         prompt: PromptObject
             Prompt within the GenerationPipeline
 
-        Yields
-        ------
-        ans: PromptObject
-            New PromptObject that contains a single question
+        Returns
+        -------
+        PromptObject
+            New PromptObject holding the QuestionSet of the chunk
         """
 
         response = prompt.response
@@ -154,19 +315,16 @@ class QuestionGenerator(GenerationNode):
             response["question_2"],
             response["question_3"],
         ]
-        for question in questions:
-            ans = PromptObject(prompt=question, data=prompt.data.copy())
-            yield ans
+        return PromptObject(prompt="", data=QuestionSet(prompt.data, questions))
 
-
-    def make_prompt(self, obj: Dict[str, Any]) -> str:
+    def make_prompt(self, obj: PromptObject) -> str:
         """ Construct a prompt using a template and inject the
         specific example information and question into the prompt.
 
         Parameters
         ----------
-        obj: Dict[str, Any]
-            Company example
+        obj: PromptObject
+            Prompt holding a TranscriptChunk
 
         Returns
         -------
@@ -174,52 +332,172 @@ class QuestionGenerator(GenerationNode):
             Formatted query with relevant information and question
         """
 
-        prompt = (
-            "<s>[INSTR]You are a financial analyst with extensive experience at Goldman Sachs."
+        # A transcript over the budget keeps its start and end
+        return render_within_budget(
+            QUESTION_GENERATION,
+            self.get_prompt_budget(),
+            "transcript",
+            "middle",
+            company_info=get_company_info(obj.data),
+            transcript=obj.data.text,
         )
-        prompt += "You are reading the earnings call transcript for the following company:\n\n"
-        prompt += "====================\n\n"
-        prompt += get_company_info(obj) + "\n"
-        prompt += "====================\n\n"
-        prompt += (
-            "You are reading the following section of the earnings call transcript:\n\n"
+
+class QuestionDeduplicator(BaseGenerationNode):
+    """Node dropping generated questions that are near-duplicates of a
+    question already generated for the same ticker, in this run or an
+    earlier one, before they cost an answer call. A chunk whose
+    questions are all duplicates is not sent to the AnswerGenerator.
+
+    Parameters
+    ----------
+    index: Optional[MinHashIndex] = None
+        Persistent index of the questions generated so far, None
+        keeps every question
+    """
+
+    def __init__(self, index: Optional[MinHashIndex] = None):
+        self.index = index
+
+        self.question_count = 0
+        self.duplicate_count = 0
+        self.skipped_count = 0
+
+    def __call__(self, *args, **kwargs):
+        return self.deduplicate(*args, **kwargs)
+
+    async def deduplicate(self, prompt: AsyncIterator[PromptObject]) -> AsyncIterator[PromptObject]:
+        """ Remove near-duplicate questions from each chunk
+
+        Parameters
+        ----------
+        prompt: AsyncIterator[PromptObject]
+            Chunks with their generated questions
+
+        Yields
+        ------
+        PromptObject
+            Chunk with the questions that are new
+        """
+
+        async for chunk in prompt:
+            if chunk is None:
+                continue
+
+            question_set = chunk.data
+            questions = question_set.questions
+            self.question_count += len(questions)
+
+            if self.index is not None:
+                questions = [
+                    question
+                    for position, question in enumerate(questions)
+                    if self.is_new(question_set.chunk, position, question)
+                ]
+                self.duplicate_count += len(question_set.questions) - len(questions)
+                question_set.questions = questions
+
+            if not questions:
+                self.skipped_count += 1
+                continue
+
+            yield chunk
+
+    def is_new(self, chunk: TranscriptChunk, position: int, question: str) -> bool:
+        """ Check a question against the index, adding it when it is new
+
+        Parameters
+        ----------
+        chunk: TranscriptChunk
+            Chunk the question was generated from
+
+        position: int
+            Position of the question among those of the chunk
+
+        question: str
+            Generated question
+
+        Returns
+        -------
+        bool
+            False if a near-duplicate was generated before
+        """
+
+        # The same question from the same chunk, e.g. when the pipeline is
+        # rerun over the same data, is not a duplicate of itself
+        transcript = chunk.transcript
+        origin = hashlib.sha256(
+            json.dumps([transcript.ticker, transcript.q, chunk.text, position]).encode("utf-8")
+        ).hexdigest()
+
+        duplicate = self.index.find_duplicate(question, transcript.ticker, origin)
+        if duplicate is not None:
+            logger.info(f"Dropped near-duplicate question {question!r} of {duplicate!r}")
+
+        return duplicate is None
+
+    def report(self) -> None:
+        """ Print the number of questions dropped as near-duplicates
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        ratio = self.duplicate_count / self.question_count if self.question_count else 0.0
+        print(
+            f"Near-duplicate questions dropped: {self.duplicate_count} of "
+            f"{self.question_count} ({ratio:.3f}), answer calls avoided: {self.skipped_count}"
         )
-        prompt += "====================\n\n"
-        prompt += obj.data["transcript"]
-        prompt += "====================\n\n"
-        prompt += "Consider the numbers in the transcript. "
-        prompt += "Ask three questions about the numbers in the transcript that require precise answers. "
-        prompt += "Only ask questions that can be answered using the transcript."
-        prompt +="[/INSTR]"
 
-        return prompt
 
-class AnswerGenerator(GenerationNode):
+class AnswerGenerator(CachedGenerationNode):
     """GenerationNode used to answer the questions coming
-    from the prior QuestionGenerator Node.
+    from the prior QuestionGenerator Node. The questions about a
+    chunk are answered in one request, with one structured output
+    field per question, so the transcript and company header are
+    sent once instead of once per question.
     """
 
-    def __init__(self):
+    def __init__(
+        self, cache: Optional[ResponseCache] = None, limiter: Optional[AIMDLimiter] = None
+    ):
         super(AnswerGenerator, self).__init__(
-            model_name="meta-llama/Meta-Llama-3.1-8B-Instruct", max_new_tokens=150
+            model_name="meta-llama/Meta-Llama-3.1-8B-Instruct",
+            # Budget of 150 tokens per question
+            max_new_tokens=450,
+            cache=cache,
+            limiter=limiter,
         )
 
-    def postprocess(self, prompt: PromptObject) -> None:
+    def postprocess(self, prompt: PromptObject) -> Generator[PromptObject, None, None]:
         """ Postprocess the resulting prompts from the generate call
-        of this Node. Iterate through all three questions generated
-        and build new PromptObjects for each question.
+        of this Node. Iterate through all three questions answered
+        and build new PromptObjects for each question and its answer.
 
         Parameters
         ----------
         prompt: PromptObject
             Prompt within the GenerationPipeline
 
-        Returns
-        -------
-        None
+        Yields
+        ------
+        ans: PromptObject
+            New PromptObject that contains a single question and answer
         """
 
-        logger.info(f"Generated answer for {prompt}")
+        question_set = prompt.data
+        for index, question in enumerate(question_set.questions, start=1):
+            ans = PromptObject(
+                prompt=prompt.prompt,
+                response={"output": prompt.response[f"answer_{index}"]},
+                data=QAPair(question_set.chunk, question),
+            )
+            logger.info(f"Generated answer for {ans}")
+            yield ans
 
     def preprocess(self, prompt: PromptObject) -> None:
         """ Construct a new prompt string given the prompt
@@ -235,114 +513,508 @@ class AnswerGenerator(GenerationNode):
         None
         """
 
-        prompt.data["question"] = prompt.prompt
         prompt.prompt = self.make_prompt(prompt)
 
     def make_prompt(self, obj: PromptObject) -> str:
         """ Construct a prompt using a template and inject the
-        specific example information and question into the prompt.
+        specific example information and questions into the prompt.
 
         Parameters
         ----------
-        obj: Dict[str, Any]
-            Company example
+        obj: PromptObject
+            Prompt holding the QuestionSet of a chunk
 
         Returns
         -------
         prompt: str
-            Formatted query with relevant information and question
+            Formatted query with relevant information and questions
         """
 
-        prompt = (
-            "<s>[INSTR] You are a financial analyst with extensive experience at Goldman Sachs."
-        )
-        prompt += "You are reading the earnings call transcript for the following company:\n\n"
-        prompt += "====================\n\n"
-        prompt += get_company_info(obj)
-        prompt += "====================\n\n"
-        prompt += (
-            "You are reading the following section of the earnings call transcript:\n\n"
+        question_set = obj.data
+
+        questions = [
+            ANSWER_QUESTION.render(index=index, question=question)
+            for index, question in enumerate(question_set.questions, start=1)
+        ]
+        unused = [f"answer_{index}" for index in range(len(question_set.questions) + 1, 4)]
+        if unused:
+            questions.append(ANSWER_UNUSED.render(fields=" and ".join(unused)))
+
+        # A transcript over the budget keeps its start and end
+        return render_within_budget(
+            ANSWER_GENERATION,
+            self.get_prompt_budget(),
+            "transcript",
+            "middle",
+            company_info=get_company_info(question_set.chunk),
+            transcript=question_set.chunk.text,
+            questions="".join(questions),
         )
-        prompt += "====================\n\n"
-        prompt += obj.data["transcript"] + "\n"
-        prompt += "====================\n\n"
-        prompt += "Consider the numbers in the transcript. "
-        prompt += "If the answer to the question cannot be found in the transcript, reply that you do not know. "
-        prompt += "Answer the following questions about the numbers in the transcript. "
-        prompt += obj.prompt
-        prompt += "[/INSTR]"
 
-        return prompt
 
+class AnswerVerifier(BaseGenerationNode):
+    """Node checking that the numbers of each answer appear in the
+    chunk it was answered from, after scale and percent normalization,
+    e.g. "$0.55 billion" matches "$550 million" and "50 bps" matches
+    "0.5%". Numbers the question mentions are not checked. Ungrounded
+    answers are likely hallucinated, they are dropped before they are
+    written, or flagged in the output. No LLM call is made.
+
+    Parameters
+    ----------
+    mode: str = "drop"
+        "drop" to remove ungrounded answers, "flag" to keep them with
+        a grounded field, "off" to skip the check
+    """
+
+    def __init__(self, mode: str = "drop"):
+        if mode not in ("drop", "flag", "off"):
+            raise ValueError(f"Unknown grounding mode: {mode}")
+
+        self.mode = mode
+
+        self.answer_count = 0
+        self.ungrounded_count = 0
+
+    def __call__(self, *args, **kwargs):
+        return self.verify(*args, **kwargs)
+
+    async def verify(self, prompt: AsyncIterator[PromptObject]) -> AsyncIterator[PromptObject]:
+        """ Check the numbers of every answer against its chunk
+
+        Parameters
+        ----------
+        prompt: AsyncIterator[PromptObject]
+            Answers returned from the AnswerGenerator
+
+        Yields
+        ------
+        PromptObject
+            Grounded answers, and ungrounded ones in flag mode
+        """
+
+        async for answer in prompt:
+            if answer is None:
+                continue
+
+            if self.mode == "off":
+                yield answer
+                continue
 
-async def load_earnings_calls() -> AsyncGenerator[PromptObject, None]:
+            pair = answer.data
+            self.answer_count += 1
+            ungrounded = find_ungrounded(str(answer.response["output"]), pair.chunk.text, pair.question)
+
+            if ungrounded:
+                self.ungrounded_count += 1
+                logger.info(f"Ungrounded numbers {ungrounded} in answer to {pair.question!r}")
+                if self.mode == "drop":
+                    continue
+
+            pair.grounded = not ungrounded
+            pair.ungrounded_numbers = ungrounded
+            yield answer
+
+    def report(self) -> None:
+        """ Print the number of ungrounded answers
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.mode == "off":
+            return
+
+        action = "dropped" if self.mode == "drop" else "flagged"
+        print(f"Ungrounded answers {action}: {self.ungrounded_count} of {self.answer_count}")
+
+
+async def load_earnings_calls(
+    path: str = "../data/test_set_transcripts.jsonl",
+    limit: Optional[int] = 1,
+    prefetch: int = 16,
+) -> AsyncGenerator[PromptObject, None]:
     """ Load the test data set that is the earnings call curated
     responses the pipeline is tested against.
 
+    Lines are decoded in a worker thread into a queue of at most
+    prefetch earnings calls. The pipeline only pulls the next call
+    when its inference queue has room, so reading stops while
+    completions are pending and memory does not grow with the corpus.
+
     Parameters
     ----------
-    None
+    path: str = "../data/test_set_transcripts.jsonl"
+        Jsonlines file, or directory of jsonlines shards
+
+    limit: Optional[int] = 1
+        Max number of earnings calls to load, None loads all of them
+
+    prefetch: int = 16
+        Max number of earnings calls read ahead of the pipeline
 
     Yields
     ------
     PromptObject
-        Constructed prompt object from a single line within the test set.
+        Constructed prompt object holding the Transcript of a single
+        line within the test set.
     """
 
-    path = "../data/test_set_transcripts.jsonl"
-
-    with jsonlines.open(path) as reader:
-        # Here we only read the 1st line from the .jsonl file.
-        for line in itertools.islice(reader, 1):
-            logger.info(f"Loaded earnings call for {line['ticker']}")
-            yield PromptObject(prompt="", data=line)
-
-async def save_answers(answers: Generator[PromptObject, None, None]) -> None:
-    """Store the generated results into the provided output path
+    lines = stream_jsonl(path, limit)
+    transcripts = TranscriptStore()
+    queue = asyncio.Queue(maxsize=prefetch)
+    end_of_lines = None
+    errors = []
+
+    async def read():
+        try:
+            while True:
+                line = await asyncio.to_thread(next, lines, end_of_lines)
+                if line is end_of_lines:
+                    break
+                await queue.put(line)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            await queue.put(end_of_lines)
+
+    reader = asyncio.ensure_future(read())
+
+    while True:
+        line = await queue.get()
+        if line is end_of_lines:
+            break
+        logger.info(f"Loaded earnings call for {line['ticker']}")
+        yield PromptObject(prompt="", data=transcripts.get(line))
+
+    await reader
+    if errors:
+        raise errors[0]
+
+async def save_answers(
+    answers: Generator[PromptObject, None, None],
+    sink: AsyncJsonlSink,
+) -> None:
+    """Store the generated results with the provided sink
 
     Parameters
     ----------
     answers: Generator[PromptObject, None, None]
         Answers returned from the GenerationPipeline
 
+    sink: AsyncJsonlSink
+        Batched writer of the output file, or of size-rotated shards
+
     Returns
     -------
     None
     """
 
-    path = "../data/results/generated_q_a.jsonl"
-
-    with jsonlines.open(path, "w") as writer:
-        pbar = tqdm(desc="Saving answers", unit=" answers")
-        async for answer in answers:
-            answer = {
-                "ticker": answer.data["ticker"],
-                "q": answer.data["q"],
-                "date": answer.data["date"],
-                "transcript": answer.data["transcript"],
-                "prompt": answer.prompt,
-                "question": answer.data["question"],
-                "answer": answer.response["output"],
-            }
-            writer.write(answer)
-            pbar.update()
-
-
-async def run_pipeline() -> None:
+    pbar = tqdm(desc="Saving answers", unit=" answers")
+    async for answer in answers:
+        pair = answer.data
+        transcript = pair.chunk.transcript
+        answer = {
+            "ticker": transcript.ticker,
+            "q": transcript.q,
+            "date": transcript.date,
+            "chunk_index": pair.chunk.index,
+            "transcript": pair.chunk.text,
+            "prompt": answer.prompt,
+            "question": pair.question,
+            "answer": answer.response["output"],
+            "grounded": pair.grounded,
+            "ungrounded_numbers": pair.ungrounded_numbers,
+        }
+        await sink.write(answer)
+        pbar.update()
+
+
+async def run_pipeline(args: Namespace) -> None:
     """Main execution function for this pipeline example
 
     Parameters
     ----------
-    None
+    args: Namespace
+        Input arguments to the script
+        The following values are used:
+            no_cache, cache_readonly
+                Response cache mode
+            adaptive_concurrency, max_concurrency
+                Adaptive in-flight request limit
+            chunk_tokens, chunk_overlap
+                Transcript chunking
+            input, full_corpus, prefetch
+                Earnings calls to load
+            max_shard_mb
+                Size of the output shards in full corpus mode
+            compression
+                Compression of the output files
+            no_dedup, dedup_threshold
+                Near-duplicate question filter
+            grounding
+                Handling of answers with numbers not in their chunk
+            question_workers, answer_workers, queue_size
+                Concurrency and queue bound of the pipeline stages
 
     Returns
     -------
     None
     """
 
-    earnings_calls = load_earnings_calls()
-    answers = QuestionAnswerPipeline().call(earnings_calls)
-    await save_answers(answers)
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache("../data/cache/responses.sqlite", readonly=args.cache_readonly)
+
+    max_concurrency = args.max_concurrency if args.adaptive_concurrency else None
+
+    question_index = None
+    if not args.no_dedup:
+        question_index = MinHashIndex(
+            "../data/cache/questions_minhash.sqlite", threshold=args.dedup_threshold
+        )
+
+    pipeline = QuestionAnswerPipeline(
+        cache,
+        max_concurrency,
+        args.chunk_tokens,
+        args.chunk_overlap,
+        question_index,
+        args.grounding,
+        args.question_workers,
+        args.answer_workers,
+        args.queue_size,
+    )
+
+    if args.full_corpus:
+        earnings_calls = load_earnings_calls(args.input, None, args.prefetch)
+        writer = RotatingJsonlWriter(
+            "../data/results/generated_q_a",
+            "generated_q_a",
+            args.max_shard_mb * 1024 * 1024,
+            args.compression,
+        )
+    else:
+        # Here we only read the 1st line from the .jsonl file.
+        earnings_calls = load_earnings_calls(args.input, 1, args.prefetch)
+        writer = AtomicJsonlWriter(
+            "../data/results/generated_q_a.jsonl" + SUFFIXES[args.compression], args.compression
+        )
+
+    # Output files keep a .partial suffix until the run completes
+    async with AsyncJsonlSink(writer) as sink:
+        answers = pipeline.call(earnings_calls)
+        await save_answers(answers, sink)
+
+    pipeline.dag.report()
+
+    for name, node in (
+        ("Question generator", pipeline.question_generator),
+        ("Answer generator", pipeline.answer_generator),
+    ):
+        if node.limiter is not None:
+            node.limiter.report(name)
+
+    pipeline.answer_verifier.report()
+
+    if question_index is not None:
+        pipeline.question_deduplicator.report()
+        question_index.close()
+
+    if cache is not None:
+        cache.report()
+        cache.close()
+
+
+def parse_arguments() -> Namespace:
+    """ Argument Parser setup
+    The following arguments are used in this script:
+        --no-cache
+            Send every prompt to the model, bypassing the response cache
+
+        --cache-readonly
+            Serve cached responses without storing new ones
+
+        --adaptive-concurrency
+            Adapt the number of in-flight requests of each node to
+            the latency and errors of the API
+
+        --max-concurrency
+            Upper bound of the adaptive in-flight request limit
+            default 64
+
+        --chunk-tokens
+            Token budget of the transcript chunks questions are
+            generated from
+            default 512
+
+        --chunk-overlap
+            Tokens repeated between consecutive chunks
+            default 64
+
+        --input
+            Earnings calls jsonlines file, or directory of shards
+            default ../data/test_set_transcripts.jsonl
+
+        --full-corpus
+            Generate from every earnings call instead of the first,
+            writing size-rotated shards to ../data/results/generated_q_a/
+
+        --prefetch
+            Max number of earnings calls read ahead of the pipeline
+            default 16
+
+        --max-shard-mb
+            Size of the output shards in full corpus mode, before
+            compression
+            default 256
+
+        --compression
+            Compression of the output files, zstd needs the
+            zstandard package
+            default none
+
+        --no-dedup
+            Answer every generated question, including near-duplicates
+            of questions generated before
+
+        --dedup-threshold
+            Estimated Jaccard similarity from which questions are
+            near-duplicates, also sets the LSH bands of the index
+            default 0.7
+
+        --grounding
+            Drop or flag answers with numbers that are not in their
+            transcript chunk, or turn the check off
+            default drop
+
+        --question-workers
+            Number of concurrent request streams of the question
+            generator stage
+            default 1
+
+        --answer-workers
+            Number of concurrent request streams of the answer
+            generator stage
+            default 1
+
+        --queue-size
+            Max items waiting in the input queue of each pipeline stage
+            default 64
+
+    Returns
+    -------
+    argparse.Namespace
+        Namespace object storing the given args as attributes
+    """
+
+    parser = ArgumentParser()
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Send every prompt to the model, bypassing the response cache",
+    )
+    parser.add_argument(
+        "--cache-readonly",
+        action="store_true",
+        help="Serve cached responses without storing new ones",
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="Adapt the number of in-flight requests to API latency and errors",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=64,
+        help="The upper bound of the adaptive in-flight request limit",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=512,
+        help="The token budget of the transcript chunks",
+    )
+    parser.add_argument(
+        "--chunk-overlap",
+        type=int,
+        default=64,
+        help="The number of tokens repeated between consecutive chunks",
+    )
+    parser.add_argument(
+        "--input",
+        type=str,
+        default="../data/test_set_transcripts.jsonl",
+        help="The earnings calls jsonlines file, or a directory of shards",
+    )
+    parser.add_argument(
+        "--full-corpus",
+        action="store_true",
+        help="Generate from every earnings call, writing size-rotated output shards",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=16,
+        help="The max number of earnings calls read ahead of the pipeline",
+    )
+    parser.add_argument(
+        "--max-shard-mb",
+        type=int,
+        default=256,
+        help="The size of the output shards in full corpus mode",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=["none", "gzip", "zstd"],
+        default="none",
+        help="The compression of the output files",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Answer every generated question, including near-duplicates",
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        default=0.7,
+        help="The estimated Jaccard similarity from which questions are near-duplicates",
+    )
+    parser.add_argument(
+        "--grounding",
+        choices=["drop", "flag", "off"],
+        default="drop",
+        help="Drop or flag answers with numbers that are not in their transcript chunk",
+    )
+    parser.add_argument(
+        "--question-workers",
+        type=int,
+        default=1,
+        help="The number of concurrent request streams of the question generator",
+    )
+    parser.add_argument(
+        "--answer-workers",
+        type=int,
+        default=1,
+        help="The number of concurrent request streams of the answer generator",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=64,
+        help="The max items waiting in the input queue of each pipeline stage",
+    )
+
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
-    asyncio.run(run_pipeline())
+    asyncio.run(run_pipeline(parse_arguments()))
@@ -1,8 +1,8 @@
 import json
-import jsonlines
 import logging
 import os
 import pandas as pd
+import sys
 import time
 
 from lamini.api.lamini_config import get_config
@@ -15,6 +15,10 @@ from lamini.error.error import (
 )
 from typing import Dict, Iterable, List, Optional, Union, Any, Generator
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.jsonl_reader import JsonlReader
+
 logger = logging.getLogger(__name__)
 
 
@@ -341,9 +345,9 @@ class Lamini:
         # Convert file records to appropriate format before uploading file
         items = []
         if file_path.endswith(".jsonl") or file_path.endswith(".jsonlines"):
-            with open(file_path) as dataset_file:
+            with JsonlReader(file_path) as reader:
 
-                for row in jsonlines.Reader(dataset_file):
+                for row in reader:
                     yield {"input": row[input_key], "output": row.get(output_key, "")}
 
         elif file_path.endswith(".csv"):
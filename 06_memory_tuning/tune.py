@@ -1,9 +1,15 @@
 from typing import Generator, Any, Dict
 import argparse
-import jsonlines
+import os
+import sys
 
 from lamini import Lamini
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.jsonl_reader import JsonlReader
+from utils.prompt_templates import LLAMA3_ANSWER, LLAMA3_CHAT, TRAINING_QUESTION
+
 
 def main() -> None:
     """Main runtime function for Instruction Fine Tuning
@@ -54,17 +60,11 @@ def load_training_data(path: str) -> Generator[Dict[str, Any], None, None]:
 
     limit = 10
 
-    with jsonlines.open(path) as reader:
-        for index, obj in enumerate(reader):
-            if index >= limit:
-                break
-
-            header = "<|begin_of_text|><|start_header_id|>user<|end_header_id|>"
-            header_end = "<|eot_id|><|start_header_id|>assistant<|end_header_id|>"
-
+    with JsonlReader(path) as reader:
+        for obj in reader.islice(0, limit):
             yield {
-                "input": header + make_question(obj) + header_end,
-                "output": obj["answer"] + "<|eot_id|>",
+                "input": LLAMA3_CHAT.render(prompt=make_question(obj)),
+                "output": LLAMA3_ANSWER.render(answer=obj["answer"]),
             }
 
 
@@ -83,11 +83,7 @@ def make_question(obj: Dict[str, Any]) -> str:
         Formatted new string
     """
 
-    question = (
-        f"Consider the following company: {obj['ticker']} and quarter: {obj['q']}. "
-    )
-    question += obj["question"]
-    return question
+    return TRAINING_QUESTION.render(ticker=obj["ticker"], q=obj["q"], question=obj["question"])
 
 if __name__ == "__main__":
     main()
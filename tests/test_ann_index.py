@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("faiss")
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.ann_index import IndexSpec
+
+
+def test_ivf_needs_nlist_training_vectors():
+    spec = IndexSpec("ivf-flat", nlist=64)
+    spec.check_training_size(64)
+    with pytest.raises(ValueError):
+        spec.check_training_size(63)
+
+
+def test_ivf_pq_needs_a_training_vector_per_pq_centroid():
+    spec = IndexSpec("ivf-pq", nlist=4, pq_m=8)
+    spec.check_training_size(256)
+    with pytest.raises(ValueError, match="pq_bits"):
+        spec.check_training_size(52)
+
+
+def test_untrained_types_need_no_training_vectors():
+    IndexSpec("hnsw").check_training_size(0)
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.async_jsonl_sink import AsyncJsonlSink
+
+
+class RecordingWriter:
+    def __init__(self, fail: bool = False) -> None:
+        self.batches = []
+        self.flushes = 0
+        self.closed = None
+        self.fail = fail
+
+    def write_batch(self, rows):
+        if self.fail:
+            raise OSError("disk full")
+        self.batches.append(list(rows))
+
+    def flush(self):
+        self.flushes += 1
+
+    def close(self, complete):
+        self.closed = complete
+
+
+def test_rows_are_written_after_flush_interval_without_new_rows():
+    writer = RecordingWriter()
+
+    async def run():
+        async with AsyncJsonlSink(writer, batch_size=32, flush_interval=0.05) as sink:
+            await sink.write({"id": 0})
+            await asyncio.sleep(0.2)
+            assert writer.batches == [[{"id": 0}]]
+            await sink.write({"id": 1})
+
+    asyncio.run(run())
+
+    assert writer.batches == [[{"id": 0}], [{"id": 1}]]
+    assert writer.closed is True
+
+
+def test_full_batches_keep_their_order():
+    writer = RecordingWriter()
+
+    async def run():
+        async with AsyncJsonlSink(writer, batch_size=3, flush_interval=0.01) as sink:
+            for i in range(10):
+                await sink.write(i)
+                if i % 4 == 0:
+                    await asyncio.sleep(0.02)
+
+    asyncio.run(run())
+
+    assert [row for batch in writer.batches for row in batch] == list(range(10))
+
+
+def test_timer_write_errors_are_raised():
+    writer = RecordingWriter(fail=True)
+
+    async def run():
+        async with AsyncJsonlSink(writer, flush_interval=0.01) as sink:
+            await sink.write(0)
+            await asyncio.sleep(0.1)
+
+    with pytest.raises(OSError):
+        asyncio.run(run())
+    assert writer.closed is False
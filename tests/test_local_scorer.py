@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "02_eval"))
+
+from local_scorer import prescore
+
+
+class Example:
+    def __init__(self, value, units):
+        self.reference = {"answer": "", "value": value, "units": units}
+
+    def is_exact_match(self, response):
+        return response == {"value": self.reference["value"], "units": self.reference["units"]}
+
+    def get_response_json(self):
+        return self.reference
+
+
+@pytest.mark.parametrize(
+    "reference, response, score",
+    [
+        ((12, "%"), (12, "%"), 5),
+        ((12, "%"), ("12.0", "percent"), 5),
+        ((1, "million"), (1, "million dollars"), 5),
+        ((1, "million"), (1000.0, "thousand"), 4),
+        ((50, "basis points"), (0.5, "percent"), 4),
+        ((1, "million"), (1.02, "million"), 4),
+    ],
+)
+def test_rubric_scores(reference, response, score):
+    result = prescore(Example(*reference), {"value": response[0], "units": response[1]})
+
+    assert result["score"] == score
+
+
+def test_other_values_go_to_the_judge():
+    assert prescore(Example(1, "million"), {"value": 2, "units": "million"}) is None
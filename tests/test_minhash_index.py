@@ -0,0 +1,68 @@
+import os
+import random
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.minhash_index import MinHashIndex, get_shingles
+
+WORDS = [f"word{i}" for i in range(500)]
+
+
+def jaccard(first, second):
+    first, second = set(get_shingles(first)), set(get_shingles(second))
+    return len(first & second) / len(first | second)
+
+
+def make_pairs(count, seed=0):
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=40)
+        edited = list(words)
+        for position in rng.sample(range(40), rng.randint(2, 5)):
+            edited[position] = rng.choice(WORDS)
+        pairs.append((" ".join(words), " ".join(edited)))
+    return pairs
+
+
+@pytest.mark.parametrize("threshold", [0.5, 0.7])
+def test_pairs_above_a_low_threshold_are_found(tmp_path, threshold):
+    index = MinHashIndex(str(tmp_path / "index.sqlite"), threshold=threshold)
+    pairs = [pair for pair in make_pairs(200) if jaccard(*pair) >= threshold + 0.1]
+
+    found = 0
+    for number, (first, second) in enumerate(pairs):
+        assert index.find_duplicate(first, str(number), "a") is None
+        found += index.find_duplicate(second, str(number), "b") == first
+    index.close()
+
+    assert found >= 0.95 * len(pairs)
+
+
+def test_banding_that_misses_the_threshold_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        MinHashIndex(str(tmp_path / "index.sqlite"), threshold=0.5, bands=16)
+
+
+def test_reopening_with_another_banding_recomputes_buckets(tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    first, second = next(pair for pair in make_pairs(50) if jaccard(*pair) >= 0.6)
+
+    index = MinHashIndex(path, threshold=0.9)
+    index.find_duplicate(first, "", "a")
+    index.close()
+
+    index = MinHashIndex(path, threshold=0.5)
+    assert index.bands != 16
+    assert index.find_duplicate(second, "", "b") == first
+    index.close()
+
+    layout = dict(sqlite3.connect(path).execute("SELECT name, value FROM layout").fetchall())
+    assert layout["bands"] == index.bands
+
+    with pytest.raises(ValueError):
+        MinHashIndex(path, num_perm=64)
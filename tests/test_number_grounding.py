@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.number_grounding import find_ungrounded
+
+SOURCE = "Revenue was $550 million, up 12% year over year, and margins grew 50 bps."
+
+
+def test_wrong_scale_is_ungrounded():
+    assert find_ungrounded("Revenue was $550 billion.", SOURCE) == ["550 billion"]
+    assert find_ungrounded("Revenue was $550 thousand.", SOURCE) == ["550 thousand"]
+
+
+def test_same_value_in_other_forms_is_grounded():
+    assert find_ungrounded("Revenue was $0.55 billion.", SOURCE) == []
+    assert find_ungrounded("Revenue was 550.", SOURCE) == []
+    assert find_ungrounded("Margins grew 0.5%, revenue 12%.", SOURCE) == []
+
+
+def test_basis_points_match_percentage_points():
+    source = "Gross margin improved 1.2 percentage points, and opex fell 30 bps."
+    assert find_ungrounded("Margin rose 120 basis points.", source) == []
+    assert find_ungrounded("Margin rose 1.2pp, opex fell 0.3 percentage points.", source) == []
+    assert find_ungrounded("Margin rose 12 percentage points.", source) == ["12 percentage points"]
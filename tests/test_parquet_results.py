@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "02_eval"))
+
+from parquet_results import read_parquet_results, write_parquet_results
+
+
+def make_rows(prompt_prefix):
+    return [
+        {
+            "id": i,
+            "ticker": "GDOT",
+            "q": "2020-Q3",
+            "prompt": f"{prompt_prefix} prompt {i}",
+            "response": {"answer": "1", "value": 1, "units": "million"},
+            "reference_response": {"answer": f"{prompt_prefix} {i}", "value": i, "units": "million"},
+            "is_exact_match": False,
+            "score": 3,
+            "explanation": "",
+        }
+        for i in range(3)
+    ]
+
+
+def test_runs_on_changed_examples_keep_their_own_prompts(tmp_path):
+    examples_path = str(tmp_path / "data_examples.parquet")
+    write_parquet_results(make_rows("OLD"), str(tmp_path / "old.parquet"), examples_path)
+    write_parquet_results(make_rows("NEW"), str(tmp_path / "new.parquet"), examples_path)
+
+    new = read_parquet_results(str(tmp_path / "new.parquet"), examples_path)
+    old = read_parquet_results(str(tmp_path / "old.parquet"), examples_path)
+
+    assert new["prompt"].to_pylist() == [f"NEW prompt {i}" for i in range(3)]
+    assert old["reference_answer"].to_pylist() == [f"OLD {i}" for i in range(3)]
+
+
+def test_examples_are_stored_once(tmp_path):
+    examples_path = str(tmp_path / "data_examples.parquet")
+    write_parquet_results(make_rows("A"), str(tmp_path / "a.parquet"), examples_path)
+    write_parquet_results(make_rows("A"), str(tmp_path / "b.parquet"), examples_path)
+
+    assert len(read_parquet_results(str(tmp_path / "b.parquet"), examples_path)) == 3
+    assert len(read_parquet_results(examples_path)) == 3
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.pipeline_dag import PipelineDAG
+
+
+async def identity(items):
+    async for item in items:
+        yield item
+
+
+async def collect(dag, items):
+    return [item async for item in dag.run(iter(items))]
+
+
+def run_dag(dag, items, timeout=5.0):
+    return asyncio.run(asyncio.wait_for(collect(dag, items), timeout))
+
+
+@pytest.mark.parametrize(
+    "workers, queue_size, count",
+    [(4, 1, 100), (3, 1, 0), (10, 64, 100), (16, 64, 100), (16, 2, 0)],
+)
+def test_multi_worker_stages_terminate(workers, queue_size, count):
+    dag = PipelineDAG()
+    dag.add_stage("first", identity, workers=workers, queue_size=queue_size)
+    dag.add_stage("second", identity, inputs=["first"], workers=workers, queue_size=queue_size)
+
+    assert sorted(run_dag(dag, range(count))) == list(range(count))
+
+
+def test_fan_in_with_many_workers_terminates():
+    dag = PipelineDAG()
+    dag.add_stage("source", identity, workers=3, queue_size=1)
+    dag.add_stage("even", identity, inputs=["source"], workers=5, queue_size=1, when=lambda x: x % 2 == 0)
+    dag.add_stage("odd", identity, inputs=["source"], workers=5, queue_size=1, when=lambda x: x % 2 == 1)
+    dag.add_stage("merge", identity, inputs=["even", "odd"], workers=8, queue_size=1)
+
+    assert sorted(run_dag(dag, range(50))) == list(range(50))
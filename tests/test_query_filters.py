@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.prompt_templates import EARNINGS_QUERY
+from utils.query_filters import parse_query_filter, parse_question_filter
+
+TICKERS = {"TRV", "ZBRA", "MYOV"}
+
+
+def test_earnings_query_lines():
+    query = EARNINGS_QUERY.render(
+        date="Aug 4, 2021, 4:35 p.m. ET", ticker="ZBRA", q="2021-Q1", question="What is the EBITDA guide for Q2 2021?"
+    )
+    query_filter = parse_query_filter(query, TICKERS)
+
+    assert query_filter.tickers == {"ZBRA"}
+    assert query_filter.quarters == {"2021-Q1"}
+    assert query_filter.date_from == query_filter.date_to == 20210804
+
+
+def test_acronyms_are_not_tickers():
+    query_filter = parse_question_filter("What was the rate increase in Business Insurance (BI) in 2021-Q1", TICKERS)
+
+    assert not query_filter
+
+
+def test_marked_tickers_without_known_tickers():
+    assert parse_question_filter("Revenue of $TRV in Q1 2021").tickers == {"TRV"}
+
+
+def test_quarters_need_a_ticker():
+    assert not parse_question_filter("What is the estimated EBITDA for the first quarter of 2021", TICKERS)
+
+    query_filter = parse_question_filter("What was ZBRA's print growth in Q1 2021?", TICKERS)
+    assert query_filter.tickers == {"ZBRA"}
+    assert query_filter.quarters == {"2021-Q1"}
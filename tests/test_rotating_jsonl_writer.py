@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.jsonl_reader import stream_jsonl
+from utils.rotating_jsonl_writer import RotatingJsonlWriter
+
+
+def write_run(directory, count):
+    with RotatingJsonlWriter(str(directory), "rows", max_bytes=40) as writer:
+        writer.write_batch({"id": i, "text": "x" * 10} for i in range(count))
+    return writer.paths
+
+
+def test_rerun_removes_shards_of_the_earlier_run(tmp_path):
+    (tmp_path / "other-00000.jsonl").write_text("{}\n")
+    (tmp_path / "rows-00009.jsonl.partial").write_text("{}\n")
+
+    assert len(write_run(tmp_path, 10)) == 10
+    paths = write_run(tmp_path, 3)
+
+    assert [os.path.basename(path) for path in paths] == ["rows-00000.jsonl", "rows-00001.jsonl", "rows-00002.jsonl"]
+    assert sorted(os.listdir(tmp_path)) == ["other-00000.jsonl"] + [os.path.basename(path) for path in paths]
+    assert [row["id"] for path in paths for row in stream_jsonl(path)] == [0, 1, 2]
@@ -0,0 +1,301 @@
+from typing import Deque, Dict, Optional
+
+import asyncio
+import collections
+import time
+
+
+class AIMDLimiter:
+    """
+    Adaptive limit on the number of in-flight generate requests, using
+    additive increase and multiplicative decrease. Every healthy request
+    grows the limit by increase / limit, so about one slot per round of
+    requests, and a failed request or a latency spike cuts it by
+    decrease_factor. Cuts are spaced by the median latency, so a burst of
+    failures from one overloaded round only backs off once.
+
+    Parameters
+    ----------
+    initial_limit: int = 4
+        Number of in-flight requests allowed at the start
+
+    min_limit: int = 1
+        Lowest the limit is cut to
+
+    max_limit: int = 64
+        Highest the limit grows to
+
+    increase: float = 1.0
+        Slots added per round of healthy requests
+
+    decrease_factor: float = 0.5
+        Multiplier of the limit on a failure or latency spike
+
+    spike_factor: float = 3.0
+        A request slower than spike_factor times the median latency
+        counts as a spike
+
+    window_size: int = 200
+        Number of recent latencies kept for the percentiles
+
+    min_samples: int = 20
+        Latencies needed before spikes are detected
+
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        spike_factor: float = 3.0,
+        window_size: int = 200,
+        min_samples: int = 20,
+    ) -> None:
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError(
+                f"Expected 1 <= min_limit <= initial_limit <= max_limit, got "
+                f"{min_limit}, {initial_limit}, {max_limit}"
+            )
+
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.spike_factor = spike_factor
+        self.min_samples = min_samples
+
+        self.latencies: Deque[float] = collections.deque(maxlen=window_size)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+
+        self.successes = 0
+        self.failures = 0
+        self.spikes = 0
+        self.decreases = 0
+
+        # Created lazily so the limiter can be built outside the event loop
+        self.condition: Optional[asyncio.Condition] = None
+
+    def get_condition(self) -> asyncio.Condition:
+        """ Condition waiters block on until a slot frees up
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        asyncio.Condition
+            Condition of the running event loop
+        """
+
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+
+        return self.condition
+
+    async def acquire(self) -> None:
+        """ Wait until fewer than limit requests are in flight, then
+        take a slot. Every acquire must be followed by a release.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        condition = self.get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float, failed: bool = False) -> None:
+        """ Free a slot and adjust the limit from the outcome of the request
+
+        Parameters
+        ----------
+        latency: float
+            Seconds the request took
+
+        failed: bool = False
+            Whether the request errored
+
+        Returns
+        -------
+        None
+        """
+
+        is_spike = self.is_spike(latency)
+        if not failed:
+            self.latencies.append(latency)
+
+        if failed or is_spike:
+            self.failures += failed
+            self.spikes += is_spike
+            self.decrease()
+        else:
+            self.successes += 1
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+        condition = self.get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def is_spike(self, latency: float) -> bool:
+        """ Whether a latency is far above the recent median
+
+        Parameters
+        ----------
+        latency: float
+            Seconds the request took
+
+        Returns
+        -------
+        bool
+            True once enough latencies are known and this one is
+            more than spike_factor times their median
+        """
+
+        if len(self.latencies) < self.min_samples:
+            return False
+
+        return latency > self.spike_factor * self.p50()
+
+    def decrease(self) -> None:
+        """ Cut the limit, at most once per median latency
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        now = time.monotonic()
+        if now - self.last_decrease < self.p50():
+            return
+
+        self.last_decrease = now
+        self.decreases += 1
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    def percentile(self, q: float) -> float:
+        """ Percentile of the recent latencies, nearest rank
+
+        Parameters
+        ----------
+        q: float
+            Percentile between 0 and 100
+
+        Returns
+        -------
+        float
+            Latency in seconds, 0.0 before any request finished
+        """
+
+        if not self.latencies:
+            return 0.0
+
+        ordered = sorted(self.latencies)
+        rank = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+
+        return ordered[rank]
+
+    def p50(self) -> float:
+        """ Median latency of the recent requests
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Latency in seconds
+        """
+
+        return self.percentile(50)
+
+    def p99(self) -> float:
+        """ 99th percentile latency of the recent requests
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Latency in seconds
+        """
+
+        return self.percentile(99)
+
+    def get_stats(self) -> Dict[str, float]:
+        """ Current limit and latencies, e.g. for a progress bar postfix
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Dict[str, float]
+            Limit, in-flight requests and p50/p99 latency
+        """
+
+        return {
+            "limit": round(self.limit, 1),
+            "in_flight": self.in_flight,
+            "p50": round(self.p50(), 3),
+            "p99": round(self.p99(), 3),
+        }
+
+    def report(self, name: str = "Limiter") -> None:
+        """ Print the limit, latencies and request outcomes
+
+        Parameters
+        ----------
+        name: str = "Limiter"
+            Label of the limiter, e.g. the stage it throttles
+
+        Returns
+        -------
+        None
+        """
+
+        print(
+            f"{name}: limit {self.limit:.1f}, p50 {self.p50():.3f}s, p99 {self.p99():.3f}s, "
+            f"ok {self.successes}, failed {self.failures}, spikes {self.spikes}, "
+            f"backoffs {self.decreases}"
+        )
+
+
+def make_limiter(max_concurrency: Optional[int]) -> Optional[AIMDLimiter]:
+    """ Adaptive concurrency limiter for a generation stage
+
+    Parameters
+    ----------
+    max_concurrency: Optional[int]
+        Upper bound of the in-flight request limit
+
+    Returns
+    -------
+    Optional[AIMDLimiter]
+        Limiter starting at a few requests, None when max_concurrency is None
+    """
+
+    if max_concurrency is None:
+        return None
+
+    return AIMDLimiter(initial_limit=min(4, max_concurrency), max_limit=max_concurrency)
@@ -0,0 +1,267 @@
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+
+INDEX_TYPES = ("flat", "ivf-flat", "ivf-pq", "hnsw")
+
+# faiss warns below 39 training points per IVF centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+class IndexSpec:
+    """
+    Type and parameters of a faiss index, built with index_factory so
+    that vectors keep the ids of their chunks. IVF indexes store ids in
+    their lists, flat and HNSW ones are wrapped in an IDMap2, which
+    IVF must not be, since it does not shift ids on removal.
+
+    - flat: exact brute force scan, memory of 4 bytes per dimension
+    - ivf-flat: vectors clustered into nlist lists, queries scan the
+      nprobe nearest lists
+    - ivf-pq: ivf-flat with vectors compressed to pq_m codes of pq_bits
+      bits, e.g. 16 bytes per vector instead of 1536
+    - hnsw: graph of hnsw_m neighbors per vector, queries explore
+      ef_search candidates, no training, vectors cannot be removed in
+      place
+
+    The structure, i.e. type, nlist, pq_m, pq_bits and hnsw_m, is fixed
+    once the index is built. nprobe and ef_search only affect searches
+    and can be changed when an index is loaded.
+
+    Parameters
+    ----------
+    kind: str = "flat"
+        One of INDEX_TYPES
+
+    nlist: int = 1024
+        Number of IVF lists
+
+    pq_m: int = 16
+        Number of PQ sub-quantizers, must divide the embedding size
+
+    pq_bits: int = 8
+        Bits per PQ code
+
+    hnsw_m: int = 32
+        Neighbors per HNSW node
+
+    nprobe: int = 16
+        IVF lists scanned per query
+
+    ef_search: int = 64
+        HNSW candidates explored per query
+
+    train_size: int = 32768
+        Number of vectors IVF indexes are trained on, the first ones
+        added
+
+    """
+
+    __slots__ = ("kind", "nlist", "pq_m", "pq_bits", "hnsw_m", "nprobe", "ef_search", "train_size")
+
+    def __init__(
+        self,
+        kind: str = "flat",
+        nlist: int = 1024,
+        pq_m: int = 16,
+        pq_bits: int = 8,
+        hnsw_m: int = 32,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        train_size: int = 32768,
+    ) -> None:
+        if kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {kind}, expected one of {INDEX_TYPES}")
+
+        self.kind = kind
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_bits = pq_bits
+        self.hnsw_m = hnsw_m
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_size = train_size
+
+    def __repr__(self) -> str:
+        return f"{self.get_factory_string()} {self.get_search_parameters()}"
+
+    @property
+    def needs_training(self) -> bool:
+        return self.kind.startswith("ivf")
+
+    def get_factory_string(self) -> str:
+        """ faiss.index_factory description of the index
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            e.g. "IVF1024,PQ16x8" or "IDMap2,HNSW32"
+        """
+
+        if self.kind == "flat":
+            return "IDMap2,Flat"
+        if self.kind == "ivf-flat":
+            return f"IVF{self.nlist},Flat"
+        if self.kind == "ivf-pq":
+            return f"IVF{self.nlist},PQ{self.pq_m}x{self.pq_bits}"
+        return f"IDMap2,HNSW{self.hnsw_m}"
+
+    def get_structure(self) -> Tuple:
+        """ Parameters fixed once the index is built
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Tuple
+            Values an index built from this spec must match
+        """
+
+        return (self.kind, self.nlist, self.pq_m, self.pq_bits, self.hnsw_m)
+
+    def get_search_parameters(self) -> Dict[str, int]:
+        """ faiss.ParameterSpace parameters of the index type
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Dict[str, int]
+            nprobe for IVF, efSearch for HNSW, nothing for flat
+        """
+
+        if self.needs_training:
+            return {"nprobe": self.nprobe}
+        if self.kind == "hnsw":
+            return {"efSearch": self.ef_search}
+        return {}
+
+    def build(self, dimension: int) -> Any:
+        """ Make an empty index, untrained for IVF types
+
+        Parameters
+        ----------
+        dimension: int
+            Embedding size
+
+        Returns
+        -------
+        faiss.Index
+            Index configured with the search parameters
+        """
+
+        if self.kind == "ivf-pq" and dimension % self.pq_m:
+            raise ValueError(f"pq_m {self.pq_m} does not divide the embedding size {dimension}")
+
+        index = faiss.index_factory(dimension, self.get_factory_string())
+        self.configure(index)
+
+        return index
+
+    def configure(self, index: Any) -> None:
+        """ Set the search parameters of a built or loaded index
+
+        Parameters
+        ----------
+        index: faiss.Index
+            Index of this spec's type
+
+        Returns
+        -------
+        None
+        """
+
+        parameters = faiss.ParameterSpace()
+        for name, value in self.get_search_parameters().items():
+            parameters.set_index_parameter(index, name, value)
+
+    def check_training_size(self, count: int) -> None:
+        """ Check that enough vectors are available to train the index
+
+        Parameters
+        ----------
+        count: int
+            Number of training vectors
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError
+            If there are fewer vectors than IVF lists, or than PQ
+            centroids per sub-quantizer for ivf-pq
+        """
+
+        if not self.needs_training:
+            return
+
+        # k-means of the IVF lists, and of every PQ sub-quantizer
+        required, parameter = self.nlist, "nlist"
+        if self.kind == "ivf-pq" and 2 ** self.pq_bits > required:
+            required, parameter = 2 ** self.pq_bits, "pq_bits"
+
+        if count < required:
+            raise ValueError(
+                f"{self.get_factory_string()} needs at least {required} training vectors, "
+                f"ideally {required * MIN_POINTS_PER_CENTROID}, got {count}. "
+                f"Lower {parameter} or use a flat or hnsw index."
+            )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values: Optional[Dict[str, Any]]) -> "IndexSpec":
+        return cls(**(values or {}))
+
+    @classmethod
+    def parse(cls, text: str) -> "IndexSpec":
+        """ Spec from a "kind:name=value,..." description
+
+        Parameters
+        ----------
+        text: str
+            e.g. "ivf-pq:nlist=1024,pq_m=16,nprobe=32" or "flat"
+
+        Returns
+        -------
+        IndexSpec
+            Spec with the given parameters, defaults for the others
+        """
+
+        kind, _, parameters = text.partition(":")
+        values = {}
+        for parameter in filter(None, parameters.split(",")):
+            name, _, value = parameter.partition("=")
+            if name not in cls.__slots__ or name == "kind":
+                raise ValueError(f"Unknown index parameter {name} in {text}")
+            values[name] = int(value)
+
+        return cls(kind, **values)
+
+
+def get_index_bytes(index: Any) -> int:
+    """ Size of an index, serialized, as a measure of its memory
+
+    Parameters
+    ----------
+    index: faiss.Index
+        Index to measure
+
+    Returns
+    -------
+    int
+        Number of bytes
+    """
+
+    return int(faiss.serialize_index(index).size)
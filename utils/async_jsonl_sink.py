@@ -0,0 +1,185 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+import asyncio
+
+
+class AsyncJsonlSink:
+    """
+    Asynchronous front of a jsonlines writer. Rows are buffered on the
+    event loop and handed over in batches to a single background
+    thread, which encodes, writes and flushes them, so the event loop
+    never waits on disk or JSON encoding. At most one batch is written
+    while the next one fills, which bounds the memory held by the sink
+    and slows producers down when the disk falls behind.
+
+    The writer must provide write_batch(rows), flush() and
+    close(complete), e.g. AtomicJsonlWriter or RotatingJsonlWriter.
+    Leaving the sink with an exception closes the writer as incomplete,
+    after writing every row received so far.
+
+    Parameters
+    ----------
+    writer: Any
+        Synchronous writer, only used from the background thread
+
+    batch_size: int = 256
+        Number of buffered rows that triggers a write
+
+    flush_interval: float = 1.0
+        Seconds after the first buffered row after which the buffer is
+        written even if the batch is not full and no other row comes
+
+    """
+
+    def __init__(self, writer: Any, batch_size: int = 256, flush_interval: float = 1.0) -> None:
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.buffer: List[Any] = []
+        self.pending: Optional[asyncio.Future] = None
+        # Submits the buffer after flush_interval, set while it sleeps
+        self.timer: Optional[asyncio.Future] = None
+        # Error of a batch submitted by the timer, raised by the next wait
+        self.error: Optional[BaseException] = None
+        self.lock = asyncio.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jsonl-sink")
+
+    async def __aenter__(self) -> "AsyncJsonlSink":
+        return self
+
+    async def __aexit__(self, exc_type, *exc_info) -> None:
+        await self.close(complete=exc_type is None)
+
+    async def write(self, row: Any) -> None:
+        """ Buffer a row, writing the buffer once the batch is full, or
+        flush_interval after its first row
+
+        Parameters
+        ----------
+        row: Any
+            JSON serializable row
+
+        Returns
+        -------
+        None
+        """
+
+        self.buffer.append(row)
+
+        if len(self.buffer) >= self.batch_size:
+            await self.submit()
+        elif self.timer is None:
+            self.timer = asyncio.ensure_future(self.submit_later())
+
+    async def submit_later(self) -> None:
+        """ Submit the buffer after flush_interval, so rows do not wait
+        in memory for the next row when the producer stalls
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        await asyncio.sleep(self.flush_interval)
+        self.timer = None
+
+        try:
+            await self.submit()
+        except Exception as e:
+            self.error = e
+
+    async def submit(self) -> None:
+        """ Hand the buffered rows to the background thread, after the
+        previous batch is written
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        async with self.lock:
+            await self.wait()
+
+            if not self.buffer:
+                return
+
+            batch, self.buffer = self.buffer, []
+            self.pending = asyncio.get_running_loop().run_in_executor(
+                self.executor, self.write_batch, batch
+            )
+
+    async def wait(self) -> None:
+        """ Wait for the batch being written, re-raising its error, or
+        that of a batch submitted by the timer
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            await pending
+
+    def write_batch(self, batch: List[Any]) -> None:
+        """ Write and flush a batch, run in the background thread
+
+        Parameters
+        ----------
+        batch: List[Any]
+            Rows to write
+
+        Returns
+        -------
+        None
+        """
+
+        self.writer.write_batch(batch)
+        self.writer.flush()
+
+    async def close(self, complete: bool = True) -> None:
+        """ Write the remaining rows and close the writer
+
+        Parameters
+        ----------
+        complete: bool = True
+            Whether every row was received, passed on to the writer
+
+        Returns
+        -------
+        None
+        """
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            await self.submit()
+            await self.wait()
+        except BaseException:
+            complete = False
+            raise
+        finally:
+            await loop.run_in_executor(self.executor, self.writer.close, complete)
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,242 @@
+from typing import Any, Callable, Iterable, List, Optional
+
+import gzip
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+PARTIAL_SUFFIX = ".partial"
+
+
+def default_encoder() -> Callable[[Any], bytes]:
+    """ Pick the fastest available JSON encoder. orjson is used
+    when installed, otherwise the standard library json module.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    Callable[[Any], bytes]
+        Function encoding a single JSON document to bytes
+    """
+
+    if orjson is not None:
+        return orjson.dumps
+    return lambda row: json.dumps(row).encode("utf-8")
+
+
+def get_partial_path(path: str) -> str:
+    """ Location a file is written to until it is complete
+
+    Parameters
+    ----------
+    path: str
+        Final file location
+
+    Returns
+    -------
+    str
+        path with the partial suffix
+    """
+
+    return path + PARTIAL_SUFFIX
+
+
+class AtomicJsonlWriter:
+    """
+    Jsonlines writer that writes to path + ".partial" and renames the
+    file to path only when closed after a complete run, so a file under
+    its final name is always whole. A run that fails leaves the
+    partial file, which a resumed run can append to.
+
+    Parameters
+    ----------
+    path: str
+        Final file location, its directory is created if missing
+
+    compression: str = "none"
+        One of "none", "gzip" or "zstd", zstd needs the zstandard package
+
+    append: bool = False
+        Append to the partial file, or to the complete file at path,
+        which is moved back to the partial name until the next close
+
+    fsync: bool = False
+        fsync the file on every flush, so flushed rows survive a crash
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compression: str = "none",
+        append: bool = False,
+        fsync: bool = False,
+    ) -> None:
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, expected one of {COMPRESSIONS}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+
+        self.path = path
+        self.partial_path = get_partial_path(path)
+        self.compression = compression
+        self.fsync = fsync
+        self.encode = default_encoder()
+        self.count = 0
+        self.bytes_written = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if append and not os.path.exists(self.partial_path) and os.path.exists(path):
+            os.replace(path, self.partial_path)
+
+        self.raw = open(self.partial_path, "ab" if append else "wb")
+        self.file = self.open_stream(self.raw)
+
+    def __enter__(self) -> "AtomicJsonlWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        self.close(complete=exc_type is None)
+
+    def open_stream(self, raw: Any) -> Any:
+        """ Wrap the raw file in the compressor, appended gzip members
+        and zstd frames decompress as one stream
+
+        Parameters
+        ----------
+        raw: Any
+            Binary file open on the partial path
+
+        Returns
+        -------
+        Any
+            Writable binary stream
+        """
+
+        if self.compression == "gzip":
+            return gzip.GzipFile(fileobj=raw, mode="ab", compresslevel=6)
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+        return raw
+
+    def write(self, row: Any) -> None:
+        """ Append a row
+
+        Parameters
+        ----------
+        row: Any
+            JSON serializable row
+
+        Returns
+        -------
+        None
+        """
+
+        self.write_batch([row])
+
+    def write_batch(self, rows: Iterable[Any]) -> int:
+        """ Encode rows and append them with a single write
+
+        Parameters
+        ----------
+        rows: Iterable[Any]
+            JSON serializable rows
+
+        Returns
+        -------
+        int
+            Number of uncompressed bytes written
+        """
+
+        return self.write_lines([self.encode(row) + b"\n" for row in rows])
+
+    def write_lines(self, lines: List[bytes]) -> int:
+        """ Append encoded lines with a single write
+
+        Parameters
+        ----------
+        lines: List[bytes]
+            JSON documents ending in a newline
+
+        Returns
+        -------
+        int
+            Number of uncompressed bytes written
+        """
+
+        data = b"".join(lines)
+
+        self.file.write(data)
+        self.count += len(lines)
+        self.bytes_written += len(data)
+
+        return len(data)
+
+    def flush(self) -> None:
+        """ Push buffered data to the operating system, and to disk when
+        fsync is set. Compressed streams are flushed to a block boundary,
+        so the flushed rows can be decompressed after a crash.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.file is not self.raw:
+            self.file.flush()
+        self.raw.flush()
+        if self.fsync:
+            os.fsync(self.raw.fileno())
+
+    def close(self, complete: bool = True) -> Optional[str]:
+        """ Close the file, and rename it to its final name if complete
+
+        Parameters
+        ----------
+        complete: bool = True
+            Whether every row was written, False keeps the partial name
+
+        Returns
+        -------
+        Optional[str]
+            Location of the closed file, None if already closed
+        """
+
+        if self.raw.closed:
+            return None
+
+        if self.file is not self.raw:
+            self.file.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+
+        if not complete:
+            return self.partial_path
+
+        os.replace(self.partial_path, self.path)
+
+        return self.path
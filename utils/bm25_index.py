@@ -0,0 +1,321 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import os
+import re
+
+import numpy as np
+
+# Lower case words and numbers, keeping decimal and thousands separators
+# so that figures like 3.5 or 1,250 are single terms
+TERM_PATTERN = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+
+# Longer terms are truncated, they are ids, urls or run together words
+MAX_TERM_BYTES = 24
+TERM_DTYPE = np.dtype(f"S{MAX_TERM_BYTES}")
+
+# Terms of most chunks, whose posting lists would be the longest and
+# score the least
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its of on or our so that the their this to "
+    "was we were what which will with you".split()
+)
+
+# Arrays of a saved index, by attribute, memory mapped when serving
+FILES = {
+    "terms": "bm25_terms.npy",
+    "offsets": "bm25_offsets.npy",
+    "rows": "bm25_rows.npy",
+    "freqs": "bm25_freqs.npy",
+    "lengths": "bm25_lengths.npy",
+    "ids": "bm25_ids.npy",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """ Terms of a text, as indexed and searched
+
+    Parameters
+    ----------
+    text: str
+        Chunk or query text
+
+    Returns
+    -------
+    List[str]
+        Terms in order of appearance, stop words left out
+    """
+
+    return [term[:MAX_TERM_BYTES] for term in TERM_PATTERN.findall(text.lower()) if term not in STOP_WORDS]
+
+
+class Bm25Index:
+    """
+    Okapi BM25 inverted index over the chunks of a RagIndex, documents
+    being its record positions. Posting lists are stored as flat arrays
+    instead of per term objects, a few bytes per posting:
+
+    - terms: sorted vocabulary, looked up by binary search
+    - offsets: start of the posting list of each term in rows and
+      freqs, and their end as the last value
+    - rows: record positions, ascending within a posting list
+    - freqs: number of occurrences of the term in the chunk
+    - lengths: number of terms of every chunk
+    - ids: chunk ids the index was built from, to detect that the
+      RagIndex changed since
+
+    Parameters
+    ----------
+    arrays: Dict[str, np.ndarray]
+        Arrays by name, see FILES
+
+    k1: float = 1.2
+        Term frequency saturation
+
+    b: float = 0.75
+        Strength of the chunk length normalization
+
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], k1: float = 1.2, b: float = 0.75) -> None:
+        self.terms = arrays["terms"]
+        self.offsets = arrays["offsets"]
+        self.rows = arrays["rows"]
+        self.freqs = arrays["freqs"]
+        self.lengths = arrays["lengths"]
+        self.ids = arrays["ids"]
+        self.k1 = k1
+        self.b = b
+
+        # Denominator term of every chunk, computed once instead of per posting
+        average = float(self.lengths.mean()) if len(self.lengths) else 1.0
+        self.norms = (k1 * (1 - b + b * self.lengths / max(average, 1.0))).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], ids: np.ndarray, k1: float = 1.2, b: float = 0.75) -> "Bm25Index":
+        """ Index chunk texts
+
+        Parameters
+        ----------
+        texts: Iterable[str]
+            Text of every chunk, in record order
+
+        ids: np.ndarray
+            Chunk id of every record
+
+        k1: float = 1.2
+            Term frequency saturation
+
+        b: float = 0.75
+            Strength of the chunk length normalization
+
+        Returns
+        -------
+        Bm25Index
+            Index of the texts
+        """
+
+        vocabulary: Dict[str, int] = {}
+        term_ids: List[np.ndarray] = []
+        lengths = np.zeros(len(ids), dtype=np.int32)
+
+        for row, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths[row] = len(terms)
+            term_ids.append(np.array([vocabulary.setdefault(term, len(vocabulary)) for term in terms], dtype=np.int64))
+
+        # Rank of every term in the sorted vocabulary
+        terms = np.array(list(vocabulary), dtype=TERM_DTYPE)
+        order = np.argsort(terms)
+        ranks = np.empty(len(terms), dtype=np.int64)
+        ranks[order] = np.arange(len(terms))
+
+        # One (term, row) key per occurrence, counted into postings sorted by
+        # term, then row
+        occurrences = np.concatenate(term_ids) if term_ids else np.zeros(0, dtype=np.int64)
+        rows = np.repeat(np.arange(len(ids), dtype=np.int64), lengths)
+        keys, freqs = np.unique(ranks[occurrences] * max(len(ids), 1) + rows, return_counts=True)
+        posting_terms, posting_rows = np.divmod(keys, max(len(ids), 1))
+
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=offsets[1:])
+
+        arrays = {
+            "terms": terms[order],
+            "offsets": offsets,
+            "rows": posting_rows.astype(np.int32),
+            "freqs": np.minimum(freqs, np.iinfo(np.uint16).max).astype(np.uint16),
+            "lengths": lengths,
+            "ids": np.ascontiguousarray(ids, dtype=np.int64),
+        }
+
+        return cls(arrays, k1, b)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False, k1: float = 1.2, b: float = 0.75) -> Optional["Bm25Index"]:
+        """ Open a saved index
+
+        Parameters
+        ----------
+        path: str
+            Directory of the index files
+
+        mmap: bool = False
+            Memory map the arrays instead of reading them
+
+        k1: float = 1.2
+            Term frequency saturation
+
+        b: float = 0.75
+            Strength of the chunk length normalization
+
+        Returns
+        -------
+        Optional[Bm25Index]
+            Saved index, None if there is none
+        """
+
+        if not all(os.path.exists(os.path.join(path, name)) for name in FILES.values()):
+            return None
+
+        arrays = {
+            attribute: np.load(os.path.join(path, name), mmap_mode="r" if mmap else None)
+            for attribute, name in FILES.items()
+        }
+
+        return cls(arrays, k1, b)
+
+    @classmethod
+    def open(cls, rag_index: Any, k1: float = 1.2, b: float = 0.75) -> "Bm25Index":
+        """ Index of the chunks of a RagIndex, loaded from its directory,
+        or rebuilt from its text store and saved there if the chunks
+        changed since it was built
+
+        Parameters
+        ----------
+        rag_index: RagIndex
+            Index whose chunks are indexed, a read only one gets an in
+            memory index if the saved one is outdated
+
+        k1: float = 1.2
+            Term frequency saturation
+
+        b: float = 0.75
+            Strength of the chunk length normalization
+
+        Returns
+        -------
+        Bm25Index
+            Index whose rows are the record positions of rag_index
+        """
+
+        ids = rag_index.chunks["id"]
+        index = cls.load(rag_index.path, rag_index.readonly, k1, b)
+        if index is not None and np.array_equal(index.ids, ids):
+            return index
+
+        index = cls.build((rag_index.get_text(row) for row in range(len(ids))), ids, k1, b)
+        if not rag_index.readonly and len(ids):
+            index.save(rag_index.path)
+
+        return index
+
+    def save(self, path: str) -> None:
+        """ Write the arrays, each to a temporary file renamed over the
+        previous one, the ids last, so that an interrupted save leaves
+        an index that is detected as outdated
+
+        Parameters
+        ----------
+        path: str
+            Directory of the index files
+
+        Returns
+        -------
+        None
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        for attribute, name in FILES.items():
+            file = os.path.join(path, name)
+            with open(file + ".partial", "wb") as f:
+                np.save(f, getattr(self, attribute))
+            os.replace(file + ".partial", file)
+
+    def get_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """ Posting list of a term
+
+        Parameters
+        ----------
+        term: str
+            Term, as returned by tokenize
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Rows of the chunks with the term and its frequency in them,
+            empty if the term is not indexed
+        """
+
+        key = np.array(term, dtype=TERM_DTYPE)
+        position = int(np.searchsorted(self.terms, key))
+        if position == len(self.terms) or self.terms[position] != key:
+            return self.rows[:0], self.freqs[:0]
+
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.rows[start:end], self.freqs[start:end]
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """ Chunks of the highest BM25 score for a query
+
+        Parameters
+        ----------
+        query: str
+            Query text
+
+        k: int
+            Number of chunks to return
+
+        mask: Optional[np.ndarray] = None
+            Boolean mask over the rows, chunks outside of it are left
+            out, e.g. from QueryFilter.get_mask
+
+        Returns
+        -------
+        List[Tuple[int, float]]
+            Record position and score of the hits, highest score first,
+            only chunks with at least one query term
+        """
+
+        matched_rows = []
+        scores = []
+        for term in set(tokenize(query)):
+            rows, freqs = self.get_postings(term)
+            if len(rows) == 0:
+                continue
+
+            # Inverse document frequency over all chunks, filtered or not
+            idf = np.log(1 + (len(self) - len(rows) + 0.5) / (len(rows) + 0.5))
+            if mask is not None:
+                kept = mask[rows]
+                rows, freqs = rows[kept], freqs[kept]
+
+            freqs = freqs.astype(np.float32)
+            matched_rows.append(rows)
+            scores.append(idf * freqs * (self.k1 + 1) / (freqs + self.norms[rows]))
+
+        if not matched_rows:
+            return []
+
+        rows, positions = np.unique(np.concatenate(matched_rows), return_inverse=True)
+        totals = np.bincount(positions, weights=np.concatenate(scores))
+        if len(rows) == 0:
+            return []
+
+        top = np.argpartition(-totals, min(k, len(rows)) - 1)[:k]
+        top = top[np.argsort(-totals[top], kind="stable")]
+
+        return list(zip(rows[top].tolist(), totals[top].tolist()))
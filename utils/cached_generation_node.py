@@ -0,0 +1,342 @@
+from lamini.generation.generation_node import GenerationNode
+from lamini.generation.base_prompt_object import PromptObject
+
+from typing import Any, AsyncIterator, Optional
+
+import asyncio
+import logging
+import time
+
+from utils.adaptive_concurrency import AIMDLimiter
+from utils.response_cache import ResponseCache, make_cache_key
+from utils.token_budget import CONTEXT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+
+class CachedGenerationNode(GenerationNode):
+    """
+    GenerationNode that answers prompts locally whenever it can, and only
+    sends the rest to the Lamini inference queue. A GenerationNode
+    subclass opts in by extending this class instead. Prompts are
+    answered, in order of preference, by:
+    1. get_local_response(), which subclasses may implement to compute
+       a response without a model call. It returns None by default.
+    2. The ResponseCache, when one is given. Responses of the calls
+       that are sent are stored for the next run.
+    Without a cache and without local responses it behaves exactly
+    like a GenerationNode.
+
+    When a limiter is given, the prompts that are sent go through the
+    inference queue one per request, with the number in flight set by
+    the limiter from their latencies and errors.
+
+    Parameters
+    ----------
+    model_name: str
+        LLM hugging face ID
+
+    max_new_tokens: Optional[int] = None
+        Generation budget of the calls
+
+    cache: Optional[ResponseCache] = None
+        Cache of responses, None disables caching
+
+    limiter: Optional[AIMDLimiter] = None
+        Adaptive limit on in-flight requests, None leaves concurrency
+        to the inference queue
+
+    """
+
+    # Max responses held between the producers and the consumer of
+    # this node, so a run of cache hits cannot read ahead of the
+    # pipeline without bound
+    buffer_size = 256
+
+    def __init__(
+        self,
+        model_name: str,
+        max_new_tokens: Optional[int] = None,
+        cache: Optional[ResponseCache] = None,
+        limiter: Optional[AIMDLimiter] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(model_name=model_name, max_new_tokens=max_new_tokens, **kwargs)
+        self.cache = cache
+        self.limiter = limiter
+
+        self.local_count = 0
+        self.cached_count = 0
+        self.sent_count = 0
+
+    def get_prompt_budget(self) -> int:
+        """ Token budget of the prompts of this node, the context window
+        less the generation budget, for render_within_budget
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            Max number of prompt tokens
+        """
+
+        return CONTEXT_TOKENS - (self.max_new_tokens or 0)
+
+    def generate(
+        self,
+        prompt: AsyncIterator[PromptObject],
+        output_type: Optional[dict] = None,
+    ) -> AsyncIterator[PromptObject]:
+        """ Generate responses for the prompts, answering locally or
+        from the cache where possible
+
+        Parameters
+        ----------
+        prompt: AsyncIterator[PromptObject]
+            Preprocessed prompts of this node
+
+        output_type: Optional[dict] = None
+            Structured output format of the calls
+
+        Returns
+        -------
+        AsyncIterator[PromptObject]
+            Prompts with their responses set, in completion order
+        """
+
+        return self.generate_with_cache(prompt, output_type)
+
+    def get_local_response(self, prompt: PromptObject) -> Optional[Any]:
+        """ Compute the response of a prompt without a model call.
+        Override in subclasses that can decide some prompts locally.
+
+        Parameters
+        ----------
+        prompt: PromptObject
+            Preprocessed prompt
+
+        Returns
+        -------
+        Optional[Any]
+            Response of the prompt, None to generate it
+        """
+
+        return None
+
+    def get_cache_key(self, prompt: PromptObject, output_type: Optional[dict]) -> str:
+        """ Cache key of a preprocessed prompt for this node
+
+        Parameters
+        ----------
+        prompt: PromptObject
+            Preprocessed prompt
+
+        output_type: Optional[dict]
+            Structured output format of the call
+
+        Returns
+        -------
+        str
+            Key from make_cache_key
+        """
+
+        return make_cache_key(self.model_name, prompt.prompt, output_type, self.max_new_tokens)
+
+    def get_cached_response(self, prompt: PromptObject, output_type: Optional[dict]) -> Optional[Any]:
+        """ Answer a prompt locally, or from the cache, counting
+        which one answered it
+
+        Parameters
+        ----------
+        prompt: PromptObject
+            Preprocessed prompt
+
+        output_type: Optional[dict]
+            Structured output format of the call
+
+        Returns
+        -------
+        Optional[Any]
+            Response of the prompt, None if it has to be sent
+        """
+
+        response = self.get_local_response(prompt)
+        if response is not None:
+            self.local_count += 1
+            return response
+
+        if self.cache is not None:
+            response = self.cache.get(self.get_cache_key(prompt, output_type))
+            if response is not None:
+                self.cached_count += 1
+                return response
+
+        self.sent_count += 1
+        return None
+
+    async def generate_with_cache(
+        self,
+        prompt: AsyncIterator[PromptObject],
+        output_type: Optional[dict],
+    ) -> AsyncIterator[PromptObject]:
+        """ Split the prompts into the ones answered without a model
+        call, which are yielded with their response, and the rest, which
+        go through the inference queue and are cached once answered
+
+        Parameters
+        ----------
+        prompt: AsyncIterator[PromptObject]
+            Preprocessed prompts of this node
+
+        output_type: Optional[dict]
+            Structured output format of the calls
+
+        Yields
+        ------
+        PromptObject
+            Prompt with its response set
+        """
+
+        hits = asyncio.Queue(maxsize=self.buffer_size)
+        end_of_hits = None
+
+        async def misses():
+            async for item in prompt:
+                response = self.get_cached_response(item, output_type)
+                if response is None:
+                    yield item
+                else:
+                    item.response = response
+                    await hits.put(item)
+            await hits.put(end_of_hits)
+
+        async def cached():
+            while True:
+                item = await hits.get()
+                if item is end_of_hits:
+                    return
+                yield item
+
+        if self.limiter is None:
+            generated = super().generate(misses(), output_type=output_type)
+        else:
+            generated = self.generate_limited(misses(), output_type)
+
+        async for source, item in merge_iterators(generated, cached()):
+            if source == 0 and item.response is not None and self.cache is not None:
+                self.cache.put(self.get_cache_key(item, output_type), item.response)
+            yield item
+
+    async def generate_limited(
+        self,
+        prompt: AsyncIterator[PromptObject],
+        output_type: Optional[dict],
+    ) -> AsyncIterator[PromptObject]:
+        """ Send the prompts one per request, starting a new request
+        whenever the limiter has a free slot. Prompts that needed a
+        retry or failed count as errors for the limiter.
+
+        Sending prompts one at a time, instead of limiting the prompts
+        fed to the inference queue, matters: the queue waits for a full
+        batch before sending, so a limit below the batch size would
+        never release a slot.
+
+        Parameters
+        ----------
+        prompt: AsyncIterator[PromptObject]
+            Prompts to send
+
+        output_type: Optional[dict]
+            Structured output format of the calls
+
+        Yields
+        ------
+        PromptObject
+            Prompt with its response set, in completion order
+        """
+
+        done = asyncio.Queue(maxsize=self.buffer_size)
+        end_of_prompts = None
+        tasks = set()
+        errors = []
+
+        async def single(item):
+            yield item
+
+        async def send(item):
+            start = time.monotonic()
+            result = item
+            try:
+                # Explicit base call, zero argument super() is not available here
+                async for result in GenerationNode.generate(self, single(item), output_type=output_type):
+                    pass
+            except Exception as e:
+                logger.debug(f"Error sending prompt: {e}")
+                item.error.append(e)
+            latency = time.monotonic() - start
+            failed = result.response is None or len(result.error) > 0
+            # The slot is held until the consumer has room for the result
+            await done.put(result)
+            await self.limiter.release(latency, failed=failed)
+
+        async def dispatch():
+            try:
+                async for item in prompt:
+                    await self.limiter.acquire()
+                    task = asyncio.ensure_future(send(item))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                await asyncio.gather(*tasks)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                await done.put(end_of_prompts)
+
+        dispatcher = asyncio.ensure_future(dispatch())
+
+        while True:
+            item = await done.get()
+            if item is end_of_prompts:
+                break
+            yield item
+
+        await dispatcher
+        if errors:
+            raise errors[0]
+
+
+async def merge_iterators(*iterators: AsyncIterator) -> AsyncIterator:
+    """ Interleave several async iterators, yielding items as soon
+    as any of them produces one. All iterators are advanced
+    concurrently, so one waiting on the network does not hold back
+    the others.
+
+    Parameters
+    ----------
+    iterators: AsyncIterator
+        Iterators to merge
+
+    Yields
+    ------
+    Tuple[int, Any]
+        Position of the source iterator and the item it produced
+    """
+
+    pending = {
+        asyncio.ensure_future(iterator.__anext__()): index
+        for index, iterator in enumerate(iterators)
+    }
+
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            index = pending.pop(task)
+            try:
+                item = task.result()
+            except StopAsyncIteration:
+                continue
+            pending[asyncio.ensure_future(iterators[index].__anext__())] = index
+            yield index, item
@@ -0,0 +1,371 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import asyncio
+import hashlib
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.text_chunker import TOKEN_PATTERN, chunk_bounds
+from utils.transcript_records import Transcript, TranscriptChunk
+
+
+class FakeEmbedder:
+    """
+    Deterministic local stand-in for lamini.Embedding, for tests and
+    benchmarks without API calls. Texts are embedded as L2 normalized
+    hashed bags of lowercased words, so texts sharing words are close,
+    and the same text always gets the same vector.
+
+    Parameters
+    ----------
+    dimension: int = 384
+        Size of the embeddings
+
+    latency: float = 0.0
+        Seconds every generate call sleeps, to simulate a round trip
+
+    """
+
+    def __init__(self, dimension: int = 384, latency: float = 0.0) -> None:
+        self.dimension = dimension
+        self.latency = latency
+        self.call_count = 0
+
+    def embed(self, text: str) -> np.ndarray:
+        """ Embedding of one text
+
+        Parameters
+        ----------
+        text: str
+            Text to embed
+
+        Returns
+        -------
+        np.ndarray
+            float32 vector of shape (1, dimension)
+        """
+
+        vector = np.zeros((1, self.dimension), dtype=np.float32)
+        for word in TOKEN_PATTERN.findall(text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            vector[0, digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def generate(self, prompt: Union[str, List[str]]) -> Union[np.ndarray, List[np.ndarray]]:
+        """ Embed a text, or a batch of texts in one call, with the
+        return shapes of lamini.Embedding.generate
+
+        Parameters
+        ----------
+        prompt: Union[str, List[str]]
+            Text or texts to embed
+
+        Returns
+        -------
+        Union[np.ndarray, List[np.ndarray]]
+            One (1, dimension) array, or one per text
+        """
+
+        self.call_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if isinstance(prompt, str):
+            return self.embed(prompt)
+        return [self.embed(text) for text in prompt]
+
+
+class IngestStats:
+    """
+    Counters of an index build
+
+    Parameters
+    ----------
+    None
+
+    """
+
+    __slots__ = ("chunks", "batches", "blocks", "started")
+
+    def __init__(self) -> None:
+        self.chunks = 0
+        self.batches = 0
+        self.blocks = 0
+        self.started = time.monotonic()
+
+    def get_throughput(self) -> float:
+        """ Chunks embedded and indexed per second
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Throughput since the build started
+        """
+
+        elapsed = time.monotonic() - self.started
+        return self.chunks / elapsed if elapsed > 0 else 0.0
+
+    def report(self) -> None:
+        """ Print the counters and the throughput
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        elapsed = time.monotonic() - self.started
+        print(
+            f"Indexed {self.chunks} chunks in {self.batches} embedding calls and "
+            f"{self.blocks} blocks, {elapsed:.1f}s, {self.get_throughput():.1f} chunks/s"
+        )
+
+
+def iter_chunks(
+    lines: Iterable[Dict[str, Any]], max_tokens: int = 256, overlap_tokens: int = 32
+) -> Iterator[TranscriptChunk]:
+    """ Split the transcript of every line into overlapping chunks
+
+    Parameters
+    ----------
+    lines: Iterable[Dict[str, Any]]
+        Decoded lines with ticker, q, transcript and optionally date
+        and exchange keys
+
+    max_tokens: int = 256
+        Token budget of a chunk
+
+    overlap_tokens: int = 32
+        Tokens repeated between consecutive chunks
+
+    Yields
+    ------
+    TranscriptChunk
+        Chunks, in line and position order
+    """
+
+    for line in lines:
+        transcript = Transcript(
+            sys.intern(line["ticker"]),
+            sys.intern(line.get("exchange", "")),
+            line.get("date", ""),
+            sys.intern(line["q"]),
+            line["transcript"],
+        )
+        bounds = chunk_bounds(transcript.text, max_tokens, overlap_tokens)
+        for index, (start, end) in enumerate(bounds):
+            yield TranscriptChunk(transcript, start, end, index, len(bounds))
+
+
+def batched(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """ Group items into lists of batch_size, the last one shorter
+
+    Parameters
+    ----------
+    items: Iterable[Any]
+        Items to group
+
+    batch_size: int
+        Number of items per list
+
+    Yields
+    ------
+    List[Any]
+        Next batch
+    """
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_batch(embedder: Any, texts: List[str]) -> np.ndarray:
+    """ Embed a batch of texts in one call
+
+    Parameters
+    ----------
+    embedder: Any
+        lamini.Embedding, FakeEmbedder or any object with the same
+        generate method
+
+    texts: List[str]
+        Texts to embed
+
+    Returns
+    -------
+    np.ndarray
+        Contiguous float32 array of shape (len(texts), dimension)
+    """
+
+    embeddings = embedder.generate(list(texts))
+    return np.ascontiguousarray(np.vstack(embeddings), dtype=np.float32)
+
+
+async def embed_batches(
+    embedder: Any, batches: Iterable[List[str]], concurrency: int = 4
+) -> AsyncIterator[np.ndarray]:
+    """ Embed batches of texts with at most concurrency calls in
+    flight. generate is blocking, so calls run in a thread pool. The
+    next batch is only read once a slot is free, so at most concurrency
+    batches are held in memory.
+
+    Parameters
+    ----------
+    embedder: Any
+        Object with the generate method of lamini.Embedding
+
+    batches: Iterable[List[str]]
+        Batches of texts
+
+    concurrency: int = 4
+        Max number of embedding calls in flight
+
+    Yields
+    ------
+    np.ndarray
+        Embeddings of every batch, in batch order
+    """
+
+    loop = asyncio.get_running_loop()
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embedding") as executor:
+        try:
+            for batch in batches:
+                pending.append(loop.run_in_executor(executor, embed_batch, embedder, batch))
+                if len(pending) >= concurrency:
+                    yield await pending.popleft()
+
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+async def ingest(
+    embedder: Any,
+    chunks: Iterable[TranscriptChunk],
+    index: Optional[Any] = None,
+    make_index: Callable[[int], Any] = faiss.IndexFlatL2,
+    batch_size: int = 32,
+    concurrency: int = 4,
+    block_size: int = 4096,
+    progress: bool = True,
+    first_id: Optional[int] = None,
+    train: Optional[Callable[[Any, np.ndarray], None]] = None,
+) -> Tuple[Any, List[TranscriptChunk], IngestStats]:
+    """ Embed chunks in batches and add them to a faiss index in
+    blocks. Embeddings are collected into one contiguous float32 array
+    per block_size rows, so faiss copies them in bulk instead of once
+    per vector. Vector ids follow the order of the chunks, from 0 or
+    from first_id. An index that needs training, e.g. IVF, is trained
+    on the first block, so block_size is also the training sample size.
+
+    Parameters
+    ----------
+    embedder: Any
+        Object with the generate method of lamini.Embedding
+
+    chunks: Iterable[TranscriptChunk]
+        Chunks to index, e.g. from iter_chunks
+
+    index: Optional[Any] = None
+        Index to add to, None makes one with make_index
+
+    make_index: Callable[[int], Any] = faiss.IndexFlatL2
+        Index constructor taking the embedding size
+
+    batch_size: int = 32
+        Number of texts per embedding call
+
+    concurrency: int = 4
+        Max number of embedding calls in flight
+
+    block_size: int = 4096
+        Number of vectors added to the index at once
+
+    progress: bool = True
+        Whether to show a progress bar
+
+    first_id: Optional[int] = None
+        Id of the first vector, added with add_with_ids, e.g. to an
+        IndexIDMap. None adds with add, ids following index.ntotal.
+
+    train: Optional[Callable[[Any, np.ndarray], None]] = None
+        Function training the index on a sample, None uses index.train
+
+    Returns
+    -------
+    Tuple[Any, List[TranscriptChunk], IngestStats]
+        The index, the indexed chunks in vector id order, and the
+        build counters
+    """
+
+    stats = IngestStats()
+    indexed: List[TranscriptChunk] = []
+    blocks: List[np.ndarray] = []
+    rows = 0
+
+    def add_blocks() -> None:
+        nonlocal index, rows
+        block = np.vstack(blocks) if len(blocks) > 1 else blocks[0]
+        if index is None:
+            index = make_index(block.shape[1])
+        if not index.is_trained:
+            if train is None:
+                index.train(block)
+            else:
+                train(index, block)
+        if first_id is None:
+            index.add(block)
+        else:
+            start = first_id + stats.chunks - len(block)
+            index.add_with_ids(block, np.arange(start, start + len(block), dtype=np.int64))
+        stats.blocks += 1
+        blocks.clear()
+        rows = 0
+
+    def texts() -> Iterator[List[str]]:
+        for batch in batched(chunks, batch_size):
+            indexed.extend(batch)
+            yield [chunk.text for chunk in batch]
+
+    with tqdm(unit="chunk", disable=not progress) as pbar:
+        async for embeddings in embed_batches(embedder, texts(), concurrency):
+            blocks.append(embeddings)
+            rows += len(embeddings)
+            stats.batches += 1
+            stats.chunks += len(embeddings)
+            pbar.update(len(embeddings))
+
+            if rows >= block_size:
+                add_blocks()
+
+        if blocks:
+            add_blocks()
+
+    return index, indexed, stats
@@ -0,0 +1,295 @@
+from typing import Any, Dict, Optional
+
+import asyncio
+import datetime
+import random
+import uuid
+
+from argparse import ArgumentParser, Namespace
+
+from aiohttp import web
+
+# Placeholder value returned for each type of an output_type field
+DEFAULT_VALUES = {
+    "str": "fake response",
+    "int": 3,
+    "float": 1.0,
+    "bool": False,
+}
+
+
+class FakeCompletionServer:
+    """
+    Local stand-in for the Lamini completions API, for exercising
+    concurrency and retry behavior without a model. Every request is
+    delayed by a random latency, and fails with a 429 or 500 at the
+    given rates. Latency grows with the number of concurrent requests
+    past the capacity, like an overloaded server.
+
+    Point the pipelines at it with:
+        LAMINI_API_URL=http://localhost:8123 LAMINI_API_KEY=fake
+
+    Parameters
+    ----------
+    latency: float = 0.5
+        Mean seconds per request
+
+    jitter: float = 0.2
+        Fraction of the latency added or removed at random
+
+    rate_limit_rate: float = 0.0
+        Fraction of requests answered with a 429
+
+    error_rate: float = 0.0
+        Fraction of requests answered with a 500
+
+    capacity: int = 16
+        Concurrent requests served at full speed
+
+    seed: Optional[int] = None
+        Seed of the injected latencies and errors
+
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.2,
+        rate_limit_rate: float = 0.0,
+        error_rate: float = 0.0,
+        capacity: int = 16,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.random = random.Random(seed)
+
+        self.in_flight = 0
+        self.requests = 0
+
+    def make_app(self) -> web.Application:
+        """ Build the aiohttp application with the API routes
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        web.Application
+            Application serving /v1/completions and /v1/reservation
+        """
+
+        app = web.Application()
+        app.router.add_post("/v1/completions", self.completions)
+        app.router.add_post("/v1/reservation", self.reservation)
+
+        return app
+
+    def get_latency(self) -> float:
+        """ Latency of the next request, slowed down past capacity
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Seconds to wait before answering
+        """
+
+        latency = self.latency * (1 + self.jitter * self.random.uniform(-1, 1))
+        overload = max(1.0, self.in_flight / self.capacity)
+
+        return latency * overload
+
+    async def completions(self, request: web.Request) -> web.Response:
+        """ Answer a batch of prompts with placeholder responses
+
+        Parameters
+        ----------
+        request: web.Request
+            Completions request from the Lamini client
+
+        Returns
+        -------
+        web.Response
+            One response per prompt, or an injected error
+        """
+
+        body = await request.json()
+
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.get_latency())
+        finally:
+            self.in_flight -= 1
+
+        draw = self.random.random()
+        if draw < self.rate_limit_rate:
+            return web.json_response({"detail": "Injected rate limit"}, status=429)
+        if draw < self.rate_limit_rate + self.error_rate:
+            return web.json_response({"detail": "Injected server error"}, status=500)
+
+        prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+
+        return web.json_response(
+            [make_response(body.get("output_type")) for _ in prompts]
+        )
+
+    async def reservation(self, request: web.Request) -> web.Response:
+        """ Grant every reservation with the requested capacity
+
+        Parameters
+        ----------
+        request: web.Request
+            Reservation request from the Lamini client
+
+        Returns
+        -------
+        web.Response
+            Reservation valid for the next hour
+        """
+
+        body = await request.json()
+        now = datetime.datetime.utcnow()
+        capacity = max(body.get("capacity") or 0, body.get("batch_size") or 0, 1)
+
+        return web.json_response(
+            {
+                "reservation_id": str(uuid.uuid4()),
+                "capacity_remaining": capacity,
+                "dynamic_max_batch_size": body.get("batch_size") or 1,
+                "start_time": now.isoformat(),
+                "end_time": (now + datetime.timedelta(hours=1)).isoformat(),
+            }
+        )
+
+
+def make_response(output_type: Optional[Dict[str, str]]) -> Dict[str, Any]:
+    """ Placeholder response matching the requested output type
+
+    Parameters
+    ----------
+    output_type: Optional[Dict[str, str]]
+        Structured output format of the call
+
+    Returns
+    -------
+    Dict[str, Any]
+        A default value per field, or {"output": ...} without an output type
+    """
+
+    if not output_type:
+        return {"output": DEFAULT_VALUES["str"]}
+
+    return {key: DEFAULT_VALUES.get(kind, DEFAULT_VALUES["str"]) for key, kind in output_type.items()}
+
+
+def main() -> None:
+    """ Main script running the fake completion server
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+
+    args = parse_arguments()
+
+    server = FakeCompletionServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        capacity=args.capacity,
+        seed=args.seed,
+    )
+
+    web.run_app(server.make_app(), port=args.port)
+
+
+def parse_arguments() -> Namespace:
+    """ Argument Parser setup
+    The following arguments are used in this script:
+        --port
+            Port to listen on
+            default 8123
+
+        --latency
+            Mean seconds per request
+            default 0.5
+
+        --jitter
+            Fraction of the latency added or removed at random
+            default 0.2
+
+        --rate-limit-rate
+            Fraction of requests answered with a 429
+            default 0.0
+
+        --error-rate
+            Fraction of requests answered with a 500
+            default 0.0
+
+        --capacity
+            Concurrent requests served at full speed
+            default 16
+
+        --seed
+            Seed of the injected latencies and errors
+            default None
+
+    Returns
+    -------
+    argparse.Namespace
+        Namespace object storing the given args as attributes
+    """
+
+    parser = ArgumentParser()
+
+    parser.add_argument("--port", type=int, default=8123, help="Port to listen on")
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="Mean seconds per request"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.2,
+        help="Fraction of the latency added or removed at random",
+    )
+    parser.add_argument(
+        "--rate-limit-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with a 429",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with a 500",
+    )
+    parser.add_argument(
+        "--capacity",
+        type=int,
+        default=16,
+        help="Concurrent requests served at full speed",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="Seed of the injected latencies and errors"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
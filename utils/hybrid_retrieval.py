@@ -0,0 +1,253 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.bm25_index import Bm25Index
+from utils.embedding_ingest import embed_batch
+from utils.query_filters import QueryFilter
+from utils.rag_index import RagIndex
+
+RETRIEVAL_MODES = ("vector", "bm25", "hybrid")
+
+# Stages timed by HybridRetriever.retrieve, in report order
+RETRIEVAL_STAGES = ("embed", "vector", "bm25", "fusion", "total")
+
+# Rank offset of reciprocal rank fusion, from Cormack et al. 2009, which
+# keeps the first few ranks of one retriever from outweighing the other
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[int]], weights: Sequence[float], k: int, rrf_k: int = RRF_K
+) -> List[Tuple[int, float]]:
+    """ Merge rankings by the sum of weight / (rrf_k + rank) of every
+    item, which only uses ranks, so that scores of different scales,
+    e.g. L2 distances and BM25 scores, need no normalization
+
+    Parameters
+    ----------
+    rankings: Sequence[Sequence[int]]
+        Items of every retriever, best first
+
+    weights: Sequence[float]
+        Weight of every retriever
+
+    k: int
+        Number of items to return
+
+    rrf_k: int = RRF_K
+        Rank offset, higher values flatten the weight of the top ranks
+
+    Returns
+    -------
+    List[Tuple[int, float]]
+        Items and fused scores, highest first, ties in order of the
+        first ranking they appear in
+    """
+
+    scores: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + weight / (rrf_k + rank)
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class HybridRetriever:
+    """
+    Retrieval of the chunks of a RagIndex by faiss vector search, BM25
+    keyword search, or both fused by reciprocal rank fusion. In hybrid
+    mode the question is embedded and searched by faiss in one thread
+    while BM25 scores it in another, so the keyword search runs during
+    the embedding call. Each retriever returns its best candidates
+    chunks, which are fused into the k returned.
+
+    Parameters
+    ----------
+    rag_index: RagIndex
+        Chunks, their vectors and their texts
+
+    bm25: Bm25Index
+        Keyword index of the same chunks
+
+    embedder: Any
+        Object with the generate method of lamini.Embedding
+
+    candidates: int = 20
+        Number of chunks each retriever contributes to the fusion
+
+    vector_weight: float = 1.0
+        Weight of the faiss ranking in the fusion
+
+    bm25_weight: float = 1.0
+        Weight of the BM25 ranking in the fusion
+
+    rrf_k: int = RRF_K
+        Rank offset of the fusion
+
+    """
+
+    def __init__(
+        self,
+        rag_index: RagIndex,
+        bm25: Bm25Index,
+        embedder: Any,
+        candidates: int = 20,
+        vector_weight: float = 1.0,
+        bm25_weight: float = 1.0,
+        rrf_k: int = RRF_K,
+    ) -> None:
+        self.rag_index = rag_index
+        self.bm25 = bm25
+        self.embedder = embedder
+        self.candidates = candidates
+        self.vector_weight = vector_weight
+        self.bm25_weight = bm25_weight
+        self.rrf_k = rrf_k
+
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def __enter__(self) -> "HybridRetriever":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    async def retrieve(
+        self, question: str, k: int, query_filter: Optional[QueryFilter] = None, mode: str = "hybrid"
+    ) -> Tuple[List[Tuple[int, float]], Dict[str, float]]:
+        """ Chunks of a question
+
+        Parameters
+        ----------
+        question: str
+            Question text, embedded and scored by BM25
+
+        k: int
+            Number of chunks to return
+
+        query_filter: Optional[QueryFilter] = None
+            Metadata the chunks must match, for both retrievers
+
+        mode: str = "hybrid"
+            One of RETRIEVAL_MODES
+
+        Returns
+        -------
+        Tuple[List[Tuple[int, float]], Dict[str, float]]
+            Record position and score of the hits, best first, and the
+            seconds spent in each of the RETRIEVAL_STAGES that ran.
+            Scores are L2 distances in vector mode, BM25 scores in bm25
+            mode and fused scores in hybrid mode.
+        """
+
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode}, expected one of {RETRIEVAL_MODES}")
+
+        loop = asyncio.get_running_loop()
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        limit = k if mode != "hybrid" else max(k, self.candidates)
+
+        searches = []
+        if mode != "bm25":
+            searches.append(
+                loop.run_in_executor(self.executor, self.search_vectors, question, limit, query_filter, timings)
+            )
+        if mode != "vector":
+            searches.append(
+                loop.run_in_executor(self.executor, self.search_keywords, question, limit, query_filter, timings)
+            )
+        results = await asyncio.gather(*searches)
+
+        if mode == "hybrid":
+            fusion_start = time.perf_counter()
+            hits = reciprocal_rank_fusion(
+                [[row for row, _ in result] for result in results],
+                [self.vector_weight, self.bm25_weight],
+                k,
+                self.rrf_k,
+            )
+            timings["fusion"] = time.perf_counter() - fusion_start
+        else:
+            hits = results[0]
+
+        timings["total"] = time.perf_counter() - start
+
+        return hits, timings
+
+    def search_vectors(
+        self, question: str, k: int, query_filter: Optional[QueryFilter], timings: Dict[str, float]
+    ) -> List[Tuple[int, float]]:
+        """ Embed the question and search faiss, run in a thread
+
+        Parameters
+        ----------
+        question: str
+            Question text
+
+        k: int
+            Number of chunks
+
+        query_filter: Optional[QueryFilter]
+            Metadata the chunks must match
+
+        timings: Dict[str, float]
+            Receives the seconds of the embed and vector stages
+
+        Returns
+        -------
+        List[Tuple[int, float]]
+            Record position and distance of the hits, nearest first
+        """
+
+        start = time.perf_counter()
+        embedding = embed_batch(self.embedder, [question])
+        timings["embed"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        hits = self.rag_index.search(embedding, k, query_filter)[0]
+        timings["vector"] = time.perf_counter() - start
+
+        return hits
+
+    def search_keywords(
+        self, question: str, k: int, query_filter: Optional[QueryFilter], timings: Dict[str, float]
+    ) -> List[Tuple[int, float]]:
+        """ Score the question with BM25, run in a thread
+
+        Parameters
+        ----------
+        question: str
+            Question text
+
+        k: int
+            Number of chunks
+
+        query_filter: Optional[QueryFilter]
+            Metadata the chunks must match
+
+        timings: Dict[str, float]
+            Receives the seconds of the bm25 stage
+
+        Returns
+        -------
+        List[Tuple[int, float]]
+            Record position and score of the hits, best first
+        """
+
+        start = time.perf_counter()
+        mask = query_filter.get_mask(self.rag_index.chunks) if query_filter else None
+        hits = self.bm25.search(question, k, mask)
+        timings["bm25"] = time.perf_counter() - start
+
+        return hits
@@ -0,0 +1,381 @@
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+import json
+import mmap
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default_decoder() -> Callable[[bytes], Any]:
+    """ Pick the fastest available JSON decoder. orjson is used
+    when installed, otherwise the standard library json module.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    Callable[[bytes], Any]
+        Function decoding a single JSON document from bytes
+    """
+
+    if orjson is not None:
+        return orjson.loads
+    return json.loads
+
+
+class JsonlReader:
+    """
+    Random access reader for jsonlines files. The file is memory mapped
+    and a newline offset index is built once and persisted next to the
+    data file (``<path>.idx``). Later readers reuse the index as long as
+    the data file's size and modification time are unchanged, so opening
+    a large file, taking its length, slicing it or reading one shard of it
+    never scans or decodes the lines that are not requested.
+
+    Parameters
+    ----------
+    path: str
+        Jsonlines file location
+
+    decoder: Optional[Callable[[bytes], Any]] = None
+        Function used to decode each line, defaults to orjson.loads
+        when orjson is installed and json.loads otherwise
+
+    """
+
+    def __init__(
+        self, path: str, decoder: Optional[Callable[[bytes], Any]] = None
+    ) -> None:
+        self.path = path
+        self.index_path = path + ".idx"
+        self.decoder = decoder or default_decoder()
+
+        self.file = open(path, "rb")
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # Zero length files cannot be memory mapped
+            self.buffer = b""
+
+        self.offsets = self.load_offsets()
+
+    def __enter__(self) -> "JsonlReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        """ Number of non-empty lines in the file
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int:
+            Number of lines, as recorded in the offset index
+        """
+
+        return len(self.offsets)
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Any, Iterator[Any]]:
+        """ Decode a single line, or lazily decode a slice of lines
+
+        Parameters
+        ----------
+        key: Union[int, slice]
+            Line position or slice of line positions
+
+        Returns
+        -------
+        Union[Any, Iterator[Any]]
+            Decoded line for an int key, iterator of decoded lines
+            for a slice key
+        """
+
+        if isinstance(key, slice):
+            return (self.read_line(index) for index in range(*key.indices(len(self))))
+
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError(f"Line {key} out of range for {self.path}")
+
+        return self.read_line(key)
+
+    def __iter__(self) -> Iterator[Any]:
+        """ Decode every line in file order
+
+        Parameters
+        ----------
+        None
+
+        Yields
+        ------
+        Any
+            Decoded line
+        """
+
+        for index in range(len(self)):
+            yield self.read_line(index)
+
+    def read_line(self, index: int) -> Any:
+        """ Decode the line at the given position of the index
+
+        Parameters
+        ----------
+        index: int
+            Position of the line within the offset index
+
+        Returns
+        -------
+        Any
+            Decoded line
+        """
+
+        start = self.offsets[index]
+        end = self.buffer.find(b"\n", start)
+        if end < 0:
+            end = len(self.buffer)
+
+        return self.decoder(self.buffer[start:end])
+
+    def islice(self, start: int, stop: Optional[int] = None) -> Iterator[Any]:
+        """ Equivalent of itertools.islice over the reader that jumps
+        straight to the first requested line instead of decoding the
+        prefix
+
+        Parameters
+        ----------
+        start: int
+            First line to return
+
+        stop: Optional[int] = None
+            Line to stop before, None reads to the end of the file
+
+        Returns
+        -------
+        Iterator[Any]
+            Iterator of decoded lines
+        """
+
+        return self[start:stop]
+
+    def shard(self, num_shards: int, shard_index: int) -> Iterator[Any]:
+        """ Decode one contiguous shard of the file. Shards cover every
+        line exactly once and differ in size by at most one line.
+
+        Parameters
+        ----------
+        num_shards: int
+            Total number of shards the file is split into
+
+        shard_index: int
+            Shard to read, from 0 to num_shards - 1
+
+        Returns
+        -------
+        Iterator[Any]
+            Iterator of decoded lines within the shard
+
+        Raises
+        ------
+        ValueError
+            Raised if shard_index is not within [0, num_shards)
+        """
+
+        start, stop = shard_bounds(len(self), num_shards, shard_index)
+
+        return self[start:stop]
+
+    def load_offsets(self) -> array:
+        """ Load the line offset index from the sidecar file, building
+        and persisting it first if it is missing or stale
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        array:
+            Byte offsets of the start of every non-empty line
+        """
+
+        stat = os.stat(self.path)
+
+        if os.path.exists(self.index_path):
+            index = array("Q")
+            with open(self.index_path, "rb") as index_file:
+                index.frombytes(index_file.read())
+            if len(index) >= 2 and index[0] == stat.st_size and index[1] == stat.st_mtime_ns:
+                return index[2:]
+
+        offsets = self.build_offsets()
+
+        index = array("Q", [stat.st_size, stat.st_mtime_ns])
+        index.extend(offsets)
+        try:
+            with open(self.index_path, "wb") as index_file:
+                index.tofile(index_file)
+        except OSError:
+            # A read-only data directory only costs a rebuild next run
+            pass
+
+        return offsets
+
+    def build_offsets(self) -> array:
+        """ Scan the mapped file once and record the byte offset
+        of every non-empty line
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        array:
+            Byte offsets of the start of every non-empty line
+        """
+
+        offsets = array("Q")
+        size = len(self.buffer)
+        position = 0
+
+        while position < size:
+            end = self.buffer.find(b"\n", position)
+            if end < 0:
+                end = size
+            if self.buffer[position:end].strip():
+                offsets.append(position)
+            position = end + 1
+
+        return offsets
+
+    def close(self) -> None:
+        """ Release the memory map and the underlying file
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+
+def shard_bounds(length: int, num_shards: int, shard_index: int) -> tuple:
+    """ Compute the [start, stop) bounds of one contiguous shard
+
+    Parameters
+    ----------
+    length: int
+        Number of items being sharded
+
+    num_shards: int
+        Total number of shards
+
+    shard_index: int
+        Shard to compute the bounds of
+
+    Returns
+    -------
+    tuple:
+        start and stop positions of the shard
+
+    Raises
+    ------
+    ValueError
+        Raised if shard_index is not within [0, num_shards)
+    """
+
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError(
+            f"Invalid shard {shard_index} of {num_shards}, shard index must be in [0, num_shards)"
+        )
+
+    base, extra = divmod(length, num_shards)
+    start = shard_index * base + min(shard_index, extra)
+    stop = start + base + (1 if shard_index < extra else 0)
+
+    return start, stop
+
+
+def list_jsonl_files(path: str) -> List[str]:
+    """ Jsonlines files at a path, either a single file or a
+    directory of shards read in name order
+
+    Parameters
+    ----------
+    path: str
+        Jsonlines file, or directory holding .jsonl files
+
+    Returns
+    -------
+    List[str]
+        Paths of the files
+    """
+
+    if not os.path.isdir(path):
+        return [path]
+
+    return [
+        os.path.join(path, name)
+        for name in sorted(os.listdir(path))
+        if name.endswith(".jsonl")
+    ]
+
+
+def stream_jsonl(
+    path: str,
+    limit: Optional[int] = None,
+    decoder: Optional[Callable[[bytes], Any]] = None,
+) -> Iterator[Any]:
+    """ Decode the lines of a jsonlines file, or of a directory of
+    shards, one at a time. Unlike JsonlReader no offset index is
+    built, so memory does not grow with the number of lines, which
+    suits single pass reads of a whole corpus.
+
+    Parameters
+    ----------
+    path: str
+        Jsonlines file, or directory holding .jsonl files
+
+    limit: Optional[int] = None
+        Max number of lines to decode, None decodes every line
+
+    decoder: Optional[Callable[[bytes], Any]] = None
+        Function decoding a line, defaults to default_decoder()
+
+    Yields
+    ------
+    Any
+        Decoded line
+    """
+
+    decoder = decoder or default_decoder()
+    count = 0
+
+    for file_path in list_jsonl_files(path):
+        with open(file_path, "rb") as f:
+            for line in f:
+                if limit is not None and count >= limit:
+                    return
+                if not line.strip():
+                    continue
+                yield decoder(line)
+                count += 1
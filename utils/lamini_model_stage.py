@@ -3,6 +3,14 @@ from lamini.generation.base_prompt_object import PromptObject
 
 from typing import Union, Iterator, AsyncIterator
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.prompt_templates import LLAMA3_CHAT
+from utils.token_budget import CONTEXT_TOKENS, render_within_budget
+
 
 class LaminiModelStage(GenerationNode):
     def __init__(self, dataset, model_name="meta-llama/Meta-Llama-3.1-8B-Instruct",):
@@ -33,8 +41,12 @@ class LaminiModelStage(GenerationNode):
     async def add_template(self, prompts):
         async for prompt in prompts:
 
-            new_prompt = "<|begin_of_text|><|start_header_id|>user<|end_header_id|>"
-            new_prompt += prompt.data.get_prompt() + "<|eot_id|>"
-            new_prompt += "<|start_header_id|>assistant<|end_header_id|>"
+            new_prompt = render_within_budget(
+                LLAMA3_CHAT,
+                CONTEXT_TOKENS - self.max_new_tokens,
+                "prompt",
+                "middle",
+                prompt=prompt.data.get_prompt(),
+            )
 
             yield PromptObject(prompt=new_prompt, data=prompt.data)
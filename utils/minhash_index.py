@@ -0,0 +1,419 @@
+from typing import List, Optional
+
+import hashlib
+import os
+import re
+import sqlite3
+import zlib
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Share of the text pairs at the threshold similarity that must share a
+# band bucket, for the banding to be usable with that threshold
+MIN_CANDIDATE_PROBABILITY = 0.9
+
+
+def get_shingles(text: str, size: int = 3) -> List[str]:
+    """ Word shingles of a lowercased text
+
+    Parameters
+    ----------
+    text: str
+        Text to shingle
+
+    size: int = 3
+        Number of words per shingle
+
+    Returns
+    -------
+    List[str]
+        Distinct shingles, the whole text for texts shorter than size
+    """
+
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return [" ".join(words)]
+
+    return list({" ".join(words[i:i + size]) for i in range(len(words) - size + 1)})
+
+
+def get_candidate_probability(similarity: float, bands: int, rows: int) -> float:
+    """ Probability that two texts share at least one band bucket
+
+    Parameters
+    ----------
+    similarity: float
+        Jaccard similarity of the texts
+
+    bands: int
+        Number of LSH bands
+
+    rows: int
+        Signature values per band
+
+    Returns
+    -------
+    float
+        1 - (1 - similarity^rows)^bands
+    """
+
+    return 1.0 - (1.0 - similarity ** rows) ** bands
+
+
+def get_bands(threshold: float, num_perm: int) -> int:
+    """ Number of bands for a threshold, the one with the most rows per
+    band, so the fewest false candidates, that still finds nearly all
+    pairs at the threshold
+
+    Parameters
+    ----------
+    threshold: float
+        Jaccard similarity from which texts are duplicates
+
+    num_perm: int
+        Number of hash permutations of a signature
+
+    Returns
+    -------
+    int
+        Divisor of num_perm
+    """
+
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands == 0:
+            if get_candidate_probability(threshold, bands, num_perm // bands) >= MIN_CANDIDATE_PROBABILITY:
+                return bands
+
+    return num_perm
+
+
+class MinHashIndex:
+    """
+    Locality sensitive hashing index of MinHash signatures stored in
+    a SQLite file, used to find near-duplicate texts. Signatures are
+    split into bands, and texts sharing a band bucket are candidates
+    whose estimated Jaccard similarity is compared with the threshold.
+    Entries are added incrementally and kept across runs.
+
+    The band layout is derived from the threshold, and stored in the
+    file with the permutations. Opening a file with another layout
+    recomputes the buckets from the stored signatures.
+
+    Texts are only compared within a namespace, e.g. a ticker. Every
+    entry records its origin, so the same text from the same origin,
+    e.g. in a rerun over the same data, is not its own duplicate.
+
+    Parameters
+    ----------
+    path: str
+        SQLite file location, created if missing
+
+    threshold: float = 0.7
+        Estimated Jaccard similarity from which texts are duplicates
+
+    num_perm: int = 128
+        Number of hash permutations of a signature
+
+    bands: Optional[int] = None
+        Number of LSH bands, num_perm must be a multiple of it, None
+        picks it from the threshold with get_bands
+
+    seed: int = 1
+        Seed of the permutations, fixed so stored signatures stay valid
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        threshold: float = 0.7,
+        num_perm: int = 128,
+        bands: Optional[int] = None,
+        seed: int = 1,
+    ) -> None:
+        if bands is None:
+            bands = get_bands(threshold, num_perm)
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm {num_perm} is not a multiple of bands {bands}")
+
+        probability = get_candidate_probability(threshold, bands, num_perm // bands)
+        if probability < MIN_CANDIDATE_PROBABILITY:
+            raise ValueError(
+                f"{bands} bands of {num_perm // bands} rows only find {probability:.0%} of the texts at "
+                f"similarity {threshold}, use more bands or leave bands to None"
+            )
+
+        self.path = path
+        self.seed = seed
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        # Multiply-add-shift hashing, (a * x + b) >> 32 in wrapping 64-bit
+        # arithmetic is a 2-universal family over 32-bit shingle hashes
+        rng = np.random.default_rng(seed)
+        odd = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self.a = odd * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+
+        self.connection = self.connect()
+
+    def connect(self) -> sqlite3.Connection:
+        """ Open the SQLite file, creating the tables if needed
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        sqlite3.Connection
+            Open connection
+        """
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, origin TEXT NOT NULL, "
+            "text TEXT NOT NULL, signature BLOB NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "namespace TEXT NOT NULL, band INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+            "id INTEGER NOT NULL)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (namespace, band, bucket)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS layout (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        connection.commit()
+
+        self.check_layout(connection)
+
+        return connection
+
+    def check_layout(self, connection: sqlite3.Connection) -> None:
+        """ Compare the signature and band layout of the file with that
+        of the index. Signatures of other permutations cannot be
+        compared, the buckets of another banding are recomputed.
+
+        Parameters
+        ----------
+        connection: sqlite3.Connection
+            Open connection to the file
+
+        Returns
+        -------
+        None
+        """
+
+        layout = {"num_perm": self.num_perm, "seed": self.seed, "bands": self.bands}
+        stored = dict(connection.execute("SELECT name, value FROM layout").fetchall())
+        if stored == layout:
+            return
+
+        row = connection.execute("SELECT signature FROM signatures LIMIT 1").fetchone()
+        signature_size = stored.get("num_perm", len(row[0]) // 8 if row else self.num_perm)
+        if signature_size != self.num_perm or stored.get("seed", self.seed) != self.seed:
+            raise ValueError(
+                f"{self.path} has signatures of {signature_size} permutations with seed "
+                f"{stored.get('seed', 'unknown')}, not {self.num_perm} with seed {self.seed}, "
+                "delete it or open it with its layout"
+            )
+
+        # Files without a layout were written before it was stored, and
+        # their buckets are recomputed as well
+        connection.execute("DELETE FROM buckets")
+        for entry, namespace, signature in connection.execute(
+            "SELECT id, namespace, signature FROM signatures"
+        ).fetchall():
+            buckets = self.get_buckets(np.frombuffer(signature, dtype=np.uint64))
+            connection.executemany(
+                "INSERT INTO buckets (namespace, band, bucket, id) VALUES (?, ?, ?, ?)",
+                [(namespace, band, bucket, entry) for band, bucket in enumerate(buckets)],
+            )
+        connection.executemany(
+            "INSERT OR REPLACE INTO layout (name, value) VALUES (?, ?)", list(layout.items())
+        )
+        connection.commit()
+
+    def get_signature(self, text: str) -> np.ndarray:
+        """ MinHash signature of a text
+
+        Parameters
+        ----------
+        text: str
+            Text to sign
+
+        Returns
+        -------
+        np.ndarray
+            num_perm uint64 minimums of the hashed shingles
+        """
+
+        hashes = np.array(
+            [zlib.crc32(shingle.encode("utf-8")) for shingle in get_shingles(text)],
+            dtype=np.uint64,
+        )
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self.a) + self.b) >> np.uint64(32)
+
+        return permuted.min(axis=0)
+
+    def get_buckets(self, signature: np.ndarray) -> List[int]:
+        """ Bucket of every band of a signature
+
+        Parameters
+        ----------
+        signature: np.ndarray
+            MinHash signature
+
+        Returns
+        -------
+        List[int]
+            Signed 64-bit hash of each band
+        """
+
+        return [
+            int.from_bytes(
+                hashlib.blake2b(band.tobytes(), digest_size=8).digest(), "little", signed=True
+            )
+            for band in signature.reshape(self.bands, self.rows)
+        ]
+
+    def find_duplicate(
+        self, text: str, namespace: str = "", origin: str = ""
+    ) -> Optional[str]:
+        """ Look up a stored near-duplicate of a text, and store the
+        text when it has none
+
+        Parameters
+        ----------
+        text: str
+            Text to look up
+
+        namespace: str = ""
+            Namespace the text is compared within
+
+        origin: str = ""
+            Where the text comes from, entries of the same origin
+            never count as its duplicate
+
+        Returns
+        -------
+        Optional[str]
+            Stored near-duplicate text, None if the text is new
+        """
+
+        signature = self.get_signature(text)
+        buckets = self.get_buckets(signature)
+
+        candidates = set()
+        for band, bucket in enumerate(buckets):
+            rows = self.connection.execute(
+                "SELECT id FROM buckets WHERE namespace = ? AND band = ? AND bucket = ?",
+                (namespace, band, bucket),
+            ).fetchall()
+            candidates.update(row[0] for row in rows)
+
+        same_origin = False
+        for candidate in sorted(candidates):
+            stored_origin, stored_text, stored_signature = self.connection.execute(
+                "SELECT origin, text, signature FROM signatures WHERE id = ?", (candidate,)
+            ).fetchone()
+            similarity = np.mean(np.frombuffer(stored_signature, dtype=np.uint64) == signature)
+            if similarity < self.threshold:
+                continue
+            if stored_origin == origin:
+                same_origin = True
+                continue
+            return stored_text
+
+        if not same_origin:
+            self.add(text, signature, buckets, namespace, origin)
+
+        return None
+
+    def add(
+        self,
+        text: str,
+        signature: np.ndarray,
+        buckets: List[int],
+        namespace: str,
+        origin: str,
+    ) -> None:
+        """ Store a text with its signature and band buckets
+
+        Parameters
+        ----------
+        text: str
+            Text to store
+
+        signature: np.ndarray
+            MinHash signature of the text
+
+        buckets: List[int]
+            Band buckets of the signature
+
+        namespace: str
+            Namespace of the text
+
+        origin: str
+            Where the text comes from
+
+        Returns
+        -------
+        None
+        """
+
+        cursor = self.connection.execute(
+            "INSERT INTO signatures (namespace, origin, text, signature) VALUES (?, ?, ?, ?)",
+            (namespace, origin, text, signature.tobytes()),
+        )
+        self.connection.executemany(
+            "INSERT INTO buckets (namespace, band, bucket, id) VALUES (?, ?, ?, ?)",
+            [(namespace, band, bucket, cursor.lastrowid) for band, bucket in enumerate(buckets)],
+        )
+        self.connection.commit()
+
+    def count(self) -> int:
+        """ Number of texts stored in the index
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            Number of signatures
+        """
+
+        return self.connection.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def close(self) -> None:
+        """ Close the SQLite connection
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
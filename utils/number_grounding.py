@@ -0,0 +1,215 @@
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, List, NamedTuple
+
+import re
+
+# A number, optionally followed by a percent sign, percentage points,
+# basis points or a magnitude word, e.g. "$99.4 million", "1,250",
+# "16%", "1.2 percentage points" or "50 bps"
+NUMBER_PATTERN = re.compile(
+    r"(?<![\w.,])(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+    r"(?:\s*(?P<percent>%|percentage points?\b|pp\b|percent\b|per cent\b)"
+    r"|\s*(?P<basis_points>basis points?\b|bps\b)"
+    r"|\s*(?P<scale>thousand|million|billion|trillion|mn|bn|k|m|b)\b)?",
+    re.IGNORECASE,
+)
+
+SCALES = {
+    "thousand": 1e3,
+    "k": 1e3,
+    "million": 1e6,
+    "mn": 1e6,
+    "m": 1e6,
+    "billion": 1e9,
+    "bn": 1e9,
+    "b": 1e9,
+    "trillion": 1e12,
+}
+
+# Bare integers below this are mostly counts written out as words in
+# transcripts, e.g. "three segments", and are not checked
+MIN_CHECKED_INTEGER = 10
+
+# Relative tolerance for an answer value to match a transcript value,
+# answers round the figures they quote
+RELATIVE_TOLERANCE = 0.005
+
+
+class Quantity(NamedTuple):
+    """
+    Number mentioned in a text
+
+    Parameters
+    ----------
+    text: str
+        Matched text, e.g. "$99.4 million"
+
+    value: float
+        Value after scaling, basis points are converted to percent
+
+    mantissa: float
+        Value before magnitude scaling, e.g. 99.4 for "$99.4 million"
+
+    kind: str
+        "percent" for percentages, "" for everything else
+    """
+
+    text: str
+    value: float
+    mantissa: float
+    kind: str
+
+
+def extract_quantities(text: str) -> List[Quantity]:
+    """ Numbers mentioned in a text, normalized for scale and percent
+
+    Parameters
+    ----------
+    text: str
+        Text to search
+
+    Returns
+    -------
+    List[Quantity]
+        Quantities in order of appearance
+    """
+
+    quantities = []
+
+    for match in NUMBER_PATTERN.finditer(text):
+        mantissa = float(match.group("number").replace(",", ""))
+        value = mantissa
+        kind = ""
+
+        if match.group("percent"):
+            kind = "percent"
+        elif match.group("basis_points"):
+            value = mantissa = mantissa * 0.01
+            kind = "percent"
+        elif match.group("scale"):
+            value = mantissa * SCALES[match.group("scale").lower()]
+
+        quantities.append(Quantity(match.group().strip(), value, mantissa, kind))
+
+    return quantities
+
+
+class NumberIndex:
+    """
+    Sorted values of the numbers in a source text, both scaled and as
+    written, for tolerance lookups by bisection
+
+    Parameters
+    ----------
+    text: str
+        Source text, e.g. a transcript chunk
+
+    """
+
+    def __init__(self, text: str) -> None:
+        values: Dict[str, set] = {}
+        for quantity in extract_quantities(text):
+            values.setdefault(quantity.kind, set()).update((quantity.value, quantity.mantissa))
+
+        self.values = {kind: sorted(kind_values) for kind, kind_values in values.items()}
+
+    def contains(self, quantity: Quantity) -> bool:
+        """ Whether the source mentions a quantity, within rounding
+
+        Parameters
+        ----------
+        quantity: Quantity
+            Quantity of an answer
+
+        Returns
+        -------
+        bool
+            True if the source has a number of the same kind matching
+            the scaled value of the quantity. Source numbers are also
+            indexed as written, so an unscaled "550" matches "$550
+            million", but a scaled "$550 billion" does not.
+        """
+
+        return self.has_value(self.values.get(quantity.kind, []), quantity.value)
+
+    @staticmethod
+    def has_value(values: List[float], value: float) -> bool:
+        """ Whether a sorted list holds a value within the tolerance
+
+        Parameters
+        ----------
+        values: List[float]
+            Sorted values
+
+        value: float
+            Value to look up
+
+        Returns
+        -------
+        bool
+            Result of the lookup
+        """
+
+        tolerance = abs(value) * RELATIVE_TOLERANCE
+        position = bisect_left(values, value - tolerance)
+
+        return position < len(values) and values[position] <= value + tolerance
+
+
+@lru_cache(maxsize=256)
+def get_number_index(text: str) -> NumberIndex:
+    """ Number index of a source text, cached since every chunk is
+    checked once per question asked about it
+
+    Parameters
+    ----------
+    text: str
+        Source text
+
+    Returns
+    -------
+    NumberIndex
+        Index of the numbers in the text
+    """
+
+    return NumberIndex(text)
+
+
+def find_ungrounded(answer: str, source: str, question: str = "") -> List[str]:
+    """ Numbers of an answer that do not appear in its source. Numbers
+    that the question itself mentions are not checked.
+
+    Parameters
+    ----------
+    answer: str
+        Generated answer
+
+    source: str
+        Text the answer must be grounded in
+
+    question: str = ""
+        Question the answer replies to
+
+    Returns
+    -------
+    List[str]
+        Text of each ungrounded number, empty if the answer is grounded
+    """
+
+    index = get_number_index(source)
+    asked = NumberIndex(question)
+
+    ungrounded = []
+    for quantity in extract_quantities(answer):
+        is_small_count = (
+            quantity.kind == ""
+            and quantity.value == quantity.mantissa
+            and quantity.value.is_integer()
+            and quantity.value < MIN_CHECKED_INTEGER
+        )
+        if is_small_count or asked.contains(quantity) or index.contains(quantity):
+            continue
+        ungrounded.append(quantity.text)
+
+    return ungrounded
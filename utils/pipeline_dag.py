@@ -0,0 +1,397 @@
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+import asyncio
+import time
+
+# Markers passed through the stage queues
+END = object()
+FAILED = object()
+# Wakes the other workers of a stage once its last input ended
+STOP = object()
+
+
+class StageStats:
+    """
+    Counters of one stage of a PipelineDAG
+
+    Parameters
+    ----------
+    None
+
+    """
+
+    __slots__ = ("received", "emitted", "dropped", "max_depth", "started", "finished")
+
+    def __init__(self) -> None:
+        self.received = 0
+        self.emitted = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def get_throughput(self) -> float:
+        """ Items emitted per second since the first item was received
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        float
+            Throughput, 0 before any item
+        """
+
+        if self.started is None:
+            return 0.0
+
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.emitted / elapsed if elapsed > 0 else 0.0
+
+
+class Stage:
+    """
+    Node of a PipelineDAG, with its own bounded input queue and
+    workers. Every worker calls the node on an iterator over the
+    shared input queue, so a node that handles one item at a time runs
+    workers items at once, and a GenerationNode keeps workers request
+    streams open.
+
+    Parameters
+    ----------
+    name: str
+        Stage name, used by the inputs of other stages and in reports
+
+    node: Callable[..., AsyncIterator]
+        GenerationNode, BaseGenerationNode or any callable taking an
+        async iterator and returning one
+
+    inputs: Sequence[str]
+        Names of the upstream stages, empty for a stage fed with the
+        pipeline input
+
+    workers: int = 1
+        Number of concurrent consumers of the input queue
+
+    queue_size: int = 64
+        Max items waiting in the input queue, upstream stages block
+        when it is full
+
+    when: Optional[Callable[[Any], bool]] = None
+        Filter of the upstream items this stage receives, None receives
+        every item
+
+    call_kwargs: Optional[Dict[str, Any]] = None
+        Keyword arguments of the node call, e.g. output_type
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        node: Callable[..., AsyncIterator],
+        inputs: Sequence[str],
+        workers: int = 1,
+        queue_size: int = 64,
+        when: Optional[Callable[[Any], bool]] = None,
+        call_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker, got {workers}")
+
+        self.name = name
+        self.node = node
+        self.inputs = list(inputs)
+        self.workers = workers
+        self.queue_size = queue_size
+        self.when = when
+        self.call_kwargs = call_kwargs or {}
+
+        self.outputs: List["Stage"] = []
+        self.queue: Optional[asyncio.Queue] = None
+        self.open_inputs = 0
+        self.stats = StageStats()
+
+    def get_depth(self) -> int:
+        """ Number of items waiting in the input queue
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            Current queue depth, 0 when not running
+        """
+
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def put(self, item: Any) -> None:
+        """ Queue an upstream item, if it passes the filter
+
+        Parameters
+        ----------
+        item: Any
+            Upstream item, or the END marker
+
+        Returns
+        -------
+        None
+        """
+
+        if item is not END and self.when is not None and not self.when(item):
+            return
+
+        await self.queue.put(item)
+        self.stats.max_depth = max(self.stats.max_depth, self.queue.qsize())
+
+    async def iterate(self) -> AsyncIterator[Any]:
+        """ Iterate over the input queue until every input has ended
+
+        Parameters
+        ----------
+        None
+
+        Yields
+        ------
+        Any
+            Next queued item
+        """
+
+        while True:
+            item = await self.queue.get()
+            if item is STOP:
+                return
+            if item is END:
+                self.open_inputs -= 1
+                if self.open_inputs > 0:
+                    continue
+                # The last input ended, wake the other workers of this stage
+                # once each, they return without passing the marker on
+                for _ in range(self.workers - 1):
+                    await self.queue.put(STOP)
+                return
+
+            self.stats.received += 1
+            if self.stats.started is None:
+                self.stats.started = time.monotonic()
+            yield item
+
+
+class PipelineDAG:
+    """
+    Declarative graph of pipeline stages connected by bounded queues.
+    Every stage runs in its own tasks, so a slow stage only fills its
+    own queue while the others keep working, until backpressure from
+    the full queue reaches them. Items of a stage go to every stage
+    listing it as an input (fan-out), and a stage with several inputs
+    takes items from all of them (fan-in), ending once they all have.
+    Stages without downstream stages are the outputs of the graph.
+
+    Nodes must still be attributes of the GenerationPipeline running
+    the graph, so that it connects them to the inference queue.
+
+    Parameters
+    ----------
+    None
+
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, Stage] = {}
+
+    def add_stage(
+        self,
+        name: str,
+        node: Callable[..., AsyncIterator],
+        inputs: Sequence[str] = (),
+        workers: int = 1,
+        queue_size: int = 64,
+        when: Optional[Callable[[Any], bool]] = None,
+        **call_kwargs: Any,
+    ) -> "PipelineDAG":
+        """ Add a stage after the stages it takes its input from
+
+        Parameters
+        ----------
+        name: str
+            Unique stage name
+
+        node: Callable[..., AsyncIterator]
+            Node run by the stage
+
+        inputs: Sequence[str] = ()
+            Names of already added upstream stages, empty to take the
+            pipeline input
+
+        workers: int = 1
+            Number of concurrent consumers of the input queue
+
+        queue_size: int = 64
+            Max items waiting in the input queue
+
+        when: Optional[Callable[[Any], bool]] = None
+            Filter of the upstream items the stage receives
+
+        **call_kwargs: Any
+            Keyword arguments of the node call
+
+        Returns
+        -------
+        PipelineDAG
+            The graph, so stages can be chained
+        """
+
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage {name}")
+
+        stage = Stage(name, node, inputs, workers, queue_size, when, call_kwargs)
+        for input_name in inputs:
+            if input_name not in self.stages:
+                raise ValueError(f"Stage {name} takes input from unknown stage {input_name}")
+            self.stages[input_name].outputs.append(stage)
+
+        self.stages[name] = stage
+
+        return self
+
+    async def run(
+        self, x: Union[Iterator[Any], AsyncIterator[Any]], output_size: int = 64
+    ) -> AsyncIterator[Any]:
+        """ Run the graph over the input items
+
+        Parameters
+        ----------
+        x: Union[Iterator[Any], AsyncIterator[Any]]
+            Pipeline input
+
+        output_size: int = 64
+            Max output items waiting for the consumer
+
+        Yields
+        ------
+        Any
+            Items of the output stages, in completion order. None
+            items, i.e. failed prompts, are dropped.
+        """
+
+        if not self.stages:
+            raise ValueError("The pipeline has no stages")
+
+        output = asyncio.Queue(maxsize=output_size)
+        sources = [stage for stage in self.stages.values() if not stage.inputs]
+        sinks = [stage for stage in self.stages.values() if not stage.outputs]
+        errors: List[BaseException] = []
+
+        for stage in self.stages.values():
+            stage.queue = asyncio.Queue(maxsize=stage.queue_size)
+            stage.open_inputs = max(len(stage.inputs), 1)
+            stage.stats = StageStats()
+
+        async def emit(targets: List[Stage], item: Any) -> None:
+            if targets:
+                for target in targets:
+                    await target.put(item)
+            else:
+                await output.put(item)
+
+        async def feed() -> None:
+            if isinstance(x, AsyncIterator):
+                async for item in x:
+                    await emit(sources, item)
+            else:
+                for item in x:
+                    await emit(sources, item)
+            await emit(sources, END)
+
+        async def work(stage: Stage) -> None:
+            results = stage.node(stage.iterate(), **stage.call_kwargs)
+            async for item in results:
+                if item is None:
+                    stage.stats.dropped += 1
+                    continue
+                stage.stats.emitted += 1
+                await emit(stage.outputs, item)
+
+        async def run_stage(stage: Stage) -> None:
+            await asyncio.gather(*(work(stage) for _ in range(stage.workers)))
+            stage.stats.finished = time.monotonic()
+            await emit(stage.outputs, END)
+
+        async def guard(coroutine) -> None:
+            try:
+                await coroutine
+            except Exception as e:
+                errors.append(e)
+                await output.put(FAILED)
+
+        tasks = [asyncio.ensure_future(guard(feed()))] + [
+            asyncio.ensure_future(guard(run_stage(stage))) for stage in self.stages.values()
+        ]
+
+        open_sinks = len(sinks)
+        try:
+            while open_sinks > 0:
+                item = await output.get()
+                if item is FAILED:
+                    raise errors[0]
+                if item is END:
+                    open_sinks -= 1
+                    continue
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """ Throughput and queue depth of every stage
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        List[Dict[str, Any]]
+            One dict per stage, in the order they were added
+        """
+
+        return [
+            {
+                "stage": stage.name,
+                "workers": stage.workers,
+                "received": stage.stats.received,
+                "emitted": stage.stats.emitted,
+                "dropped": stage.stats.dropped,
+                "per_second": round(stage.stats.get_throughput(), 2),
+                "depth": stage.get_depth(),
+                "max_depth": stage.stats.max_depth,
+                "queue_size": stage.queue_size,
+            }
+            for stage in self.stages.values()
+        ]
+
+    def report(self) -> None:
+        """ Print the stats of every stage
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        print(
+            f"{'stage':<12}{'workers':>8}{'received':>10}{'emitted':>10}"
+            f"{'dropped':>9}{'items/s':>10}{'max queue':>11}"
+        )
+        for stats in self.get_stats():
+            print(
+                f"{stats['stage']:<12}{stats['workers']:>8}{stats['received']:>10}"
+                f"{stats['emitted']:>10}{stats['dropped']:>9}{stats['per_second']:>10}"
+                f"{stats['max_depth']:>6}/{stats['queue_size']:<4}"
+            )
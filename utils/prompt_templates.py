@@ -0,0 +1,278 @@
+from string import Formatter
+from typing import Any, Dict, List, Tuple
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.text_chunker import count_tokens
+
+
+class PromptTemplate:
+    """
+    Prompt template compiled once into its constant segments and the
+    positions of its fields. Rendering copies the segment list, fills
+    in the fields and joins it, so the constant text is never rebuilt
+    or re-parsed per prompt. Fields use str.format syntax, "{name}",
+    with "{{" and "}}" for literal braces, and are inserted as is.
+
+    Parameters
+    ----------
+    text: str
+        Template text
+
+    """
+
+    __slots__ = ("text", "segments", "fields", "constant_tokens")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.segments: List[str] = []
+        self.fields: List[Tuple[int, str]] = []
+
+        literal_end = False
+        for literal, field, format_spec, conversion in Formatter().parse(text):
+            if literal:
+                if literal_end:
+                    self.segments[-1] += literal
+                else:
+                    self.segments.append(literal)
+                literal_end = True
+            if field is None:
+                continue
+            if not field.isidentifier() or format_spec or conversion:
+                raise ValueError(f"Unsupported template field {{{field}}} in {text[:40]!r}")
+            self.fields.append((len(self.segments), field))
+            self.segments.append("")
+            literal_end = False
+
+        self.constant_tokens = count_tokens("".join(self.segments))
+
+    def get_field_names(self) -> List[str]:
+        """ Names of the fields, in order of appearance
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        List[str]
+            Field names, repeated if a field appears more than once
+        """
+
+        return [name for _, name in self.fields]
+
+    def render(self, **values: Any) -> str:
+        """ Fill in the fields
+
+        Parameters
+        ----------
+        **values: Any
+            Value of every field, converted with str
+
+        Returns
+        -------
+        str
+            Rendered prompt
+        """
+
+        parts = self.segments.copy()
+        for position, name in self.fields:
+            parts[position] = str(values[name])
+
+        return "".join(parts)
+
+    def estimate_tokens(self, **values: Any) -> int:
+        """ Approximate number of tokens of the rendered prompt, from the
+        precomputed count of the constant segments and the field values
+
+        Parameters
+        ----------
+        **values: Any
+            Value of every field
+
+        Returns
+        -------
+        int
+            Estimated tokens, see text_chunker.count_tokens
+        """
+
+        return self.constant_tokens + sum(
+            count_tokens(str(values[name])) for _, name in self.fields
+        )
+
+
+# Llama 3 chat turn around a user prompt
+LLAMA3_CHAT = PromptTemplate(
+    "<|begin_of_text|><|start_header_id|>user<|end_header_id|>"
+    "{prompt}<|eot_id|>"
+    "<|start_header_id|>assistant<|end_header_id|>"
+)
+
+# Training example output of a Llama 3 chat turn
+LLAMA3_ANSWER = PromptTemplate("{answer}<|eot_id|>")
+
+EARNINGS_QUESTION = PromptTemplate(
+    "You are a financial analyst with extensive experience at Goldman Sachs. "
+    "You are reading questions that you have heard from a client about a specific earnings call. "
+    "The question asks about specific numbers mentioned in the call. "
+    "Format your answer as a json object with the following fields: "
+    "{{ 'answer': str, 'value': float, 'units': str }}. "
+    "Limit value to 2 significant digits. "
+    "For example if the answer is 22%, the value should be 22.0 and the units should be 'percent'. "
+    "The question is about this earnings call:\n"
+    "====================\n"
+    "Date of the call: {date}\n"
+    "Ticker: {ticker}\n"
+    "Quarter: {q}\n"
+    "====================\n"
+    "The client asks\n"
+    "{question}"
+)
+
+EARNINGS_QUERY = PromptTemplate(
+    "Date of the call: {date}\n"
+    "Ticker: {ticker}\n"
+    "Quarter: {q}\n"
+    "{question}"
+)
+
+# Value, and answer, of a gold or model response, as shown to the judge
+VALUE = PromptTemplate("Value: {value} {units}\n")
+
+VALUE_ANSWER = PromptTemplate("Value: {value} {units}\nAnswer: {answer}\n")
+
+SCORE_RUBRIC = (
+    "Read this scoring rubric carefully and follow the instructions precisely:\n"
+    "A score of 5 means that model's value is the same as the gold answer's id.\n"
+    "A score of 4 means that the model's answer is the same or a paraphrase of the gold answer, "
+    "but the value may not be an exact match. For example, the values '1 million' and "
+    "'1000.0 thousand' are different ways of describing the same value\n"
+    "A score of 3 means that the model's answer is similar as the gold answer's description, "
+    "but the value may be wrong. Both answers may indicate that revenue is increased but the "
+    "gold says 12 percent and the model say 50 million USD.\n"
+    "A score of 2 means that the model's answer is not similar to the gold answer, "
+    "but the answer is plausible.\n"
+    "A score of 1 means that the model's answer is not similar to the gold answer, "
+    "and the answer doesn't make sense.\n"
+    "Assign a 5 for a correct value even if other fields are missing.\n"
+)
+
+SCORE = PromptTemplate(
+    "<s>[INSTR]A large language model (LLM) is going to answer a question. "
+    "Your job is to score the answer, comparing it to a golden reference. "
+    "You are an expert scorer.\n\n"
+    "Rate the answer using a score from 1 (lowest match) to 5 (highest match).\n"
+    "{rubric}"
+    "Use the full range. Read the gold answer carefully. "
+    "Explain your score in 2-3 sentences, then assign a score. "
+    'Output your score as a JSON object in the format {{"explanation" : str, "score" : int}}\n'
+    "Use single quotes within your explanation. End your explanation with a double quote.\n"
+    "Prefer answers that are most similar to the gold answer, "
+    "even if the gold answer refused to answer the question.\n\n"
+    "========== question =========\n{question}\n\n"
+    "========== gold answer =========\n{gold_answer}\n\n"
+    "========== model answer =========\n{model_answer}\n\n"
+    + "=" * 40 + "\n\n"
+    "How would you score the model's answer compared to the gold answer "
+    "(using the 1-5 scale defined above)?[/INSTR]"
+)
+
+COMPANY_INFO = PromptTemplate(
+    "Company: {exchange}\n"
+    "Ticker: {ticker}\n"
+    "Date: {date}\n"
+    "Quarter: {q}\n"
+)
+
+QUESTION_GENERATION = PromptTemplate(
+    "<s>[INSTR]You are a financial analyst with extensive experience at Goldman Sachs."
+    "You are reading the earnings call transcript for the following company:\n\n"
+    "====================\n\n"
+    "{company_info}\n"
+    "====================\n\n"
+    "You are reading the following section of the earnings call transcript:\n\n"
+    "====================\n\n"
+    "{transcript}"
+    "====================\n\n"
+    "Consider the numbers in the transcript. "
+    "Ask three questions about the numbers in the transcript that require precise answers. "
+    "Only ask questions that can be answered using the transcript."
+    "[/INSTR]"
+)
+
+ANSWER_GENERATION = PromptTemplate(
+    "<s>[INSTR] You are a financial analyst with extensive experience at Goldman Sachs."
+    "You are reading the earnings call transcript for the following company:\n\n"
+    "====================\n\n"
+    "{company_info}"
+    "====================\n\n"
+    "You are reading the following section of the earnings call transcript:\n\n"
+    "====================\n\n"
+    "{transcript}\n"
+    "====================\n\n"
+    "Consider the numbers in the transcript. "
+    "If the answer to a question cannot be found in the transcript, reply that you do not know. "
+    "Answer the following questions about the numbers in the transcript. "
+    "Answer each question separately, the answer to question 1 as answer_1 and so on.\n\n"
+    "{questions}"
+    "[/INSTR]"
+)
+
+ANSWER_QUESTION = PromptTemplate("Question {index}: {question}\n")
+
+ANSWER_UNUSED = PromptTemplate("Leave {fields} empty.\n")
+
+# Llama 3 chat turn answering a question from retrieved chunks
+RAG_QUESTION = PromptTemplate(
+    "<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n"
+    "{context}\n"
+    "{question}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n"
+)
+
+TRAINING_QUESTION = PromptTemplate(
+    "Consider the following company: {ticker} and quarter: {q}. {question}"
+)
+
+TEMPLATES: Dict[str, PromptTemplate] = {
+    "llama3_chat": LLAMA3_CHAT,
+    "llama3_answer": LLAMA3_ANSWER,
+    "earnings_question": EARNINGS_QUESTION,
+    "earnings_query": EARNINGS_QUERY,
+    "value": VALUE,
+    "value_answer": VALUE_ANSWER,
+    "score": SCORE,
+    "company_info": COMPANY_INFO,
+    "question_generation": QUESTION_GENERATION,
+    "answer_generation": ANSWER_GENERATION,
+    "answer_question": ANSWER_QUESTION,
+    "answer_unused": ANSWER_UNUSED,
+    "rag_question": RAG_QUESTION,
+    "training_question": TRAINING_QUESTION,
+}
+
+
+def report() -> None:
+    """ Print the fields and the estimated constant tokens of every
+    template, i.e. the prompt overhead before any field is filled in
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
+
+    print(f"{'template':<28}{'tokens':>8}  fields")
+    for name, template in TEMPLATES.items():
+        fields = ", ".join(template.get_field_names())
+        print(f"{name:<28}{template.constant_tokens:>8}  {fields}")
+    print(f"{'score_rubric':<28}{count_tokens(SCORE_RUBRIC):>8}")
+
+
+if __name__ == "__main__":
+    report()
@@ -0,0 +1,249 @@
+from datetime import datetime
+from typing import Iterable, Optional, Set
+
+import re
+
+import numpy as np
+
+# Lines of a query rendered with EARNINGS_QUERY
+QUERY_LINE = re.compile(r"^\s*(Date of the call|Ticker|Quarter):\s*(.*?)\s*$", re.MULTILINE)
+
+# Quarters written in the text of a question, e.g. 2021-Q3, Q3 2021,
+# Q3 of fiscal 2021 or third quarter of 2021
+QUARTER_PATTERNS = [
+    (re.compile(r"\b(\d{4})\s*-?\s*Q([1-4])\b", re.IGNORECASE), 1, 2),
+    (re.compile(r"\bQ([1-4])\s*(?:of\s+)?(?:fiscal\s+|FY\s*)?'?(\d{4}|\d{2})\b", re.IGNORECASE), 2, 1),
+    (
+        re.compile(
+            r"\b(first|second|third|fourth)\s+(?:fiscal\s+)?quarter\s+(?:of\s+)?(?:fiscal\s+|FY\s*)?(\d{4})\b",
+            re.IGNORECASE,
+        ),
+        2,
+        1,
+    ),
+]
+ORDINALS = {"first": "1", "second": "2", "third": "3", "fourth": "4"}
+
+# Tickers written in the text of a question: upper case words and
+# $TICKER or (TICKER) forms, which are also acronyms, e.g. "(ADT)", so
+# both are only kept if they are tickers of the index when it is known
+TICKER_WORD = re.compile(r"(?<![\w$])([A-Z][A-Z.]{1,5})(?!\w)")
+TICKER_MARKED = re.compile(r"\$([A-Z][A-Z.]{0,5})\b|\(([A-Z][A-Z.]{0,5})\)")
+
+
+def parse_call_date(date: str) -> int:
+    """ Day of an earnings call as an int, for range filters
+
+    Parameters
+    ----------
+    date: str
+        Date of the call, e.g. "Nov 4, 2020, 5:00 p.m. ET", or an ISO
+        date, e.g. "2020-11-04"
+
+    Returns
+    -------
+    int
+        Date as YYYYMMDD, 0 if it cannot be parsed
+    """
+
+    try:
+        day = datetime.strptime(", ".join(date.split(", ")[:2]), "%b %d, %Y")
+    except ValueError:
+        try:
+            day = datetime.strptime(date.strip(), "%Y-%m-%d")
+        except ValueError:
+            return 0
+
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def normalize_quarter(year: str, quarter: str) -> str:
+    """ Quarter in the "2021-Q3" form of the q field of the data
+
+    Parameters
+    ----------
+    year: str
+        Four or two digit year
+
+    quarter: str
+        Quarter number, or its ordinal, e.g. "third"
+
+    Returns
+    -------
+    str
+        e.g. "2021-Q3"
+    """
+
+    if len(year) == 2:
+        year = "20" + year
+
+    return f"{year}-Q{ORDINALS.get(quarter.lower(), quarter)}"
+
+
+class QueryFilter:
+    """
+    Structured metadata a retrieval is restricted to. Empty fields do
+    not filter, filled ones must all match, a chunk matches a field if
+    it has any of its values.
+
+    Parameters
+    ----------
+    tickers: Iterable[str] = ()
+        Tickers, e.g. "CENT"
+
+    quarters: Iterable[str] = ()
+        Quarters, as in the q field of the data, e.g. "2021-Q3"
+
+    date_from: int = 0
+        First call day, as YYYYMMDD, 0 for no lower bound
+
+    date_to: int = 0
+        Last call day, as YYYYMMDD, 0 for no upper bound. Chunks of
+        calls without a date never match a date range.
+
+    """
+
+    __slots__ = ("tickers", "quarters", "date_from", "date_to")
+
+    def __init__(
+        self,
+        tickers: Iterable[str] = (),
+        quarters: Iterable[str] = (),
+        date_from: int = 0,
+        date_to: int = 0,
+    ) -> None:
+        self.tickers: Set[str] = {ticker.upper() for ticker in tickers}
+        self.quarters: Set[str] = {quarter.upper() for quarter in quarters}
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def __bool__(self) -> bool:
+        return bool(self.tickers or self.quarters or self.date_from or self.date_to)
+
+    def __repr__(self) -> str:
+        fields = []
+        if self.tickers:
+            fields.append(f"ticker={','.join(sorted(self.tickers))}")
+        if self.quarters:
+            fields.append(f"q={','.join(sorted(self.quarters))}")
+        if self.date_from or self.date_to:
+            fields.append(f"date={self.date_from or ''}..{self.date_to or ''}")
+        return f"QueryFilter({' '.join(fields)})"
+
+    def update(self, other: "QueryFilter") -> "QueryFilter":
+        """ Fill the empty fields from another filter
+
+        Parameters
+        ----------
+        other: QueryFilter
+            Filter whose fields are used where this one has none
+
+        Returns
+        -------
+        QueryFilter
+            self
+        """
+
+        self.tickers = self.tickers or other.tickers
+        self.quarters = self.quarters or other.quarters
+        if not (self.date_from or self.date_to):
+            self.date_from, self.date_to = other.date_from, other.date_to
+
+        return self
+
+    def get_mask(self, chunks: np.ndarray) -> np.ndarray:
+        """ Which chunk records match the filter
+
+        Parameters
+        ----------
+        chunks: np.ndarray
+            Records with ticker, q and date fields, see
+            utils.rag_index.CHUNK_DTYPE
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask over the records
+        """
+
+        mask = np.ones(len(chunks), dtype=bool)
+        if self.tickers:
+            mask &= np.isin(chunks["ticker"], [ticker.encode() for ticker in self.tickers])
+        if self.quarters:
+            mask &= np.isin(chunks["q"], [quarter.encode() for quarter in self.quarters])
+        if self.date_from:
+            mask &= chunks["date"] >= self.date_from
+        if self.date_to:
+            mask &= (chunks["date"] <= self.date_to) & (chunks["date"] > 0)
+
+        return mask
+
+
+def parse_query_filter(query: str, tickers: Optional[Set[str]] = None) -> QueryFilter:
+    """ Pull the metadata filter out of a query, either rendered with
+    EARNINGS_QUERY, as EarningsCallsExample.get_query does, or from the
+    ticker and quarter mentioned in the question. The lines of the
+    template take precedence over the text.
+
+    Parameters
+    ----------
+    query: str
+        Query or question
+
+    tickers: Optional[Set[str]] = None
+        Tickers of the index, words of the question are only taken as
+        tickers if they are one of them. None only finds tickers
+        written as $TICKER or (TICKER).
+
+    Returns
+    -------
+    QueryFilter
+        Filter of the query, empty if nothing was found
+    """
+
+    fields = {name: value for name, value in QUERY_LINE.findall(query) if value}
+
+    query_filter = QueryFilter()
+    if "Ticker" in fields:
+        query_filter.tickers = {fields["Ticker"].upper()}
+    if "Quarter" in fields:
+        query_filter.quarters = {fields["Quarter"].upper()}
+    if "Date of the call" in fields:
+        day = parse_call_date(fields["Date of the call"])
+        query_filter.date_from = query_filter.date_to = day
+
+    return query_filter.update(parse_question_filter(QUERY_LINE.sub("", query), tickers))
+
+
+def parse_question_filter(question: str, tickers: Optional[Set[str]] = None) -> QueryFilter:
+    """ Tickers and quarters mentioned in the text of a question.
+    Quarters are only kept along with a ticker: questions that name no
+    company mostly name a quarter other than that of their call, e.g.
+    guidance for the next quarter or a year over year comparison.
+
+    Parameters
+    ----------
+    question: str
+        Question text, e.g. "What was ZBRA's print growth in Q1 2021?"
+
+    tickers: Optional[Set[str]] = None
+        Tickers of the index, see parse_query_filter
+
+    Returns
+    -------
+    QueryFilter
+        Filter with the tickers found, and the quarters found if
+        there are tickers
+    """
+
+    quarters = set()
+    for pattern, year_group, quarter_group in QUARTER_PATTERNS:
+        for match in pattern.finditer(question):
+            quarters.add(normalize_quarter(match.group(year_group), match.group(quarter_group)))
+
+    found = {dollar or parenthesized for dollar, parenthesized in TICKER_MARKED.findall(question)}
+    if tickers:
+        found = {ticker for ticker in found if ticker in tickers}
+        found.update(word for word in TICKER_WORD.findall(question) if word in tickers)
+
+    return QueryFilter(found, quarters if found else ())
@@ -0,0 +1,802 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.ann_index import IndexSpec
+from utils.embedding_ingest import IngestStats, ingest, iter_chunks
+from utils.query_filters import QueryFilter, parse_call_date
+from utils.transcript_records import TranscriptChunk
+
+FORMAT_VERSION = 1
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.npy"
+TEXTS_FILE = "texts.bin"
+META_FILE = "meta.json"
+
+# One fixed size record per indexed chunk. start and end are byte offsets
+# into the text store, which holds every source transcript once, so the
+# chunks of a transcript, and their overlaps, share its bytes. The source
+# hash is an integer, as bytes fields drop trailing zero bytes.
+CHUNK_DTYPE = np.dtype([
+    ("id", "<i8"),
+    ("start", "<i8"),
+    ("end", "<i8"),
+    ("date", "<i4"),
+    ("ticker", "S12"),
+    ("q", "S8"),
+    ("source_hash", "<u8"),
+])
+
+# Text store bytes no chunk refers to, as a share of the file, from
+# which the store is rewritten on save
+COMPACT_RATIO = 0.5
+
+# Vectors added to the index at once, for index types without training
+BLOCK_SIZE = 4096
+
+# Filtered HNSW searches over at most this many chunks scan their vectors
+# exactly, as the graph search finds too few neighbors among them
+EXACT_SEARCH_ROWS = 4096
+
+
+def get_source_hash(line: Dict[str, Any]) -> int:
+    """ Content hash of a source line, over the fields that end up in
+    the index
+
+    Parameters
+    ----------
+    line: Dict[str, Any]
+        Decoded line with ticker, q, transcript and optionally date
+
+    Returns
+    -------
+    int
+        64 bit digest
+    """
+
+    content = json.dumps([line["ticker"], line["q"], line.get("date", ""), line["transcript"]])
+    return int.from_bytes(hashlib.blake2b(content.encode(), digest_size=8).digest(), "little")
+
+
+class UpdateStats:
+    """
+    Counters of an incremental index update
+
+    Parameters
+    ----------
+    None
+
+    """
+
+    __slots__ = ("unchanged", "added", "changed", "removed", "removed_chunks", "ingest")
+
+    def __init__(self) -> None:
+        self.unchanged = 0
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.removed_chunks = 0
+        self.ingest: Optional[IngestStats] = None
+
+    def report(self) -> None:
+        """ Print the counters
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        print(
+            f"Sources: {self.added} new, {self.changed} changed, {self.unchanged} unchanged, "
+            f"{self.removed} removed, {self.removed_chunks} chunks removed"
+        )
+        if self.ingest is not None:
+            self.ingest.report()
+
+
+class RagIndex:
+    """
+    faiss index of transcript chunks persisted in a directory, with a
+    compact metadata store of one CHUNK_DTYPE record per vector and a
+    text store holding every source transcript once. Opening an index
+    reads the faiss file and memory maps the records and the texts, so
+    queries can be served without embedding anything.
+
+    Updates are incremental: sources are keyed by ticker and quarter,
+    and only lines that are new or whose content hash changed are
+    chunked and embedded, unless the chunk settings or the index
+    structure changed, which rebuilds the index. The vectors of a
+    changed source are removed by id before its new chunks are added.
+    Text of removed sources is left in the text store until it makes
+    up COMPACT_RATIO of it.
+
+    Parameters
+    ----------
+    path: str
+        Index directory, created on save if missing
+
+    readonly: bool = False
+        Open for queries only, the faiss index is then memory mapped
+        where its type supports it
+
+    spec: Optional[IndexSpec] = None
+        Index type and parameters, None uses the saved ones, or a flat
+        index for a new directory. Search parameters of a saved index
+        of the same structure are replaced.
+
+    """
+
+    def __init__(self, path: str, readonly: bool = False, spec: Optional[IndexSpec] = None) -> None:
+        self.path = path
+        self.readonly = readonly
+        self.spec = spec
+
+        self.index: Optional[Any] = None
+        self.chunks = np.zeros(0, dtype=CHUNK_DTYPE)
+        self.meta: Dict[str, Any] = {"version": FORMAT_VERSION, "next_id": 0, "dimension": None}
+        self.texts: Optional[mmap.mmap] = None
+        self.texts_file = None
+
+        if os.path.exists(os.path.join(path, META_FILE)):
+            self.load()
+        elif self.spec is None:
+            self.spec = IndexSpec()
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def __enter__(self) -> "RagIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def get_file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def load(self) -> None:
+        """ Open the index files of the directory
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        with open(self.get_file(META_FILE)) as f:
+            self.meta = json.load(f)
+
+        if self.meta["version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Index {self.path} has format {self.meta['version']}, expected {FORMAT_VERSION}, rebuild it"
+            )
+
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if self.readonly else 0
+        self.index = faiss.read_index(self.get_file(INDEX_FILE), flags)
+        self.chunks = np.load(self.get_file(CHUNKS_FILE), mmap_mode="r" if self.readonly else None)
+
+        if self.index.ntotal != len(self.chunks):
+            raise ValueError(
+                f"Index {self.path} has {self.index.ntotal} vectors for {len(self.chunks)} chunks, rebuild it"
+            )
+
+        saved = IndexSpec.from_dict(self.meta.get("index"))
+        if self.spec is None:
+            self.spec = saved
+        elif not self.is_built_from(saved) and self.readonly:
+            raise ValueError(f"Index {self.path} is a {saved}, not a {self.spec}, update it first")
+
+        if self.is_built_from(saved):
+            self.spec.configure(self.index)
+
+        self.open_texts()
+
+    def is_built_from(self, spec: IndexSpec) -> bool:
+        """ Whether the index has the structure of the spec, else the
+        next update rebuilds it
+
+        Parameters
+        ----------
+        spec: IndexSpec
+            Spec of the saved index
+
+        Returns
+        -------
+        bool
+            True if the structures match
+        """
+
+        return self.spec.get_structure() == spec.get_structure()
+
+    def set_search_parameters(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+        """ Change the search parameters of the loaded index
+
+        Parameters
+        ----------
+        nprobe: Optional[int] = None
+            IVF lists scanned per query, None keeps the current value
+
+        ef_search: Optional[int] = None
+            HNSW candidates explored per query, None keeps the current
+            value
+
+        Returns
+        -------
+        None
+        """
+
+        if nprobe is not None:
+            self.spec.nprobe = nprobe
+        if ef_search is not None:
+            self.spec.ef_search = ef_search
+        saved = IndexSpec.from_dict(self.meta.get("index", self.spec.to_dict()))
+        if self.index is not None and self.is_built_from(saved):
+            self.spec.configure(self.index)
+
+    def open_texts(self) -> None:
+        """ Memory map the text store
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.close_texts()
+
+        path = self.get_file(TEXTS_FILE)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.texts_file = open(path, "rb")
+            self.texts = mmap.mmap(self.texts_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close_texts(self) -> None:
+        if self.texts is not None:
+            self.texts.close()
+            self.texts = None
+        if self.texts_file is not None:
+            self.texts_file.close()
+            self.texts_file = None
+
+    def close(self) -> None:
+        """ Release the memory maps
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.close_texts()
+
+    def get_rows(self, ids: np.ndarray) -> np.ndarray:
+        """ Positions of chunk ids in the records, which are kept in
+        ascending id order
+
+        Parameters
+        ----------
+        ids: np.ndarray
+            Vector ids, e.g. returned by search
+
+        Returns
+        -------
+        np.ndarray
+            Record positions
+        """
+
+        return np.searchsorted(self.chunks["id"], ids)
+
+    def get_text(self, row: int) -> str:
+        """ Text of a chunk
+
+        Parameters
+        ----------
+        row: int
+            Record position
+
+        Returns
+        -------
+        str
+            Chunk text, read from the memory mapped text store
+        """
+
+        record = self.chunks[row]
+        return self.texts[record["start"]:record["end"]].decode("utf-8")
+
+    def get_tickers(self) -> Set[str]:
+        """ Tickers of the indexed sources
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Set[str]
+            Upper case tickers
+        """
+
+        return {ticker.decode() for ticker in np.unique(self.chunks["ticker"])}
+
+    def search(
+        self, embeddings: np.ndarray, k: int, query_filter: Optional[QueryFilter] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """ Nearest chunks of query embeddings, among the chunks that
+        match a metadata filter if one is given
+
+        Filtered searches pass faiss a bitmap of the matching ids, so
+        vectors of other chunks are skipped before distances are
+        computed. IVF indexes scan more lists, and HNSW ones explore
+        more candidates, the fewer chunks match, so that about as many
+        matching vectors are seen as by an unfiltered search. HNSW
+        searches over at most EXACT_SEARCH_ROWS chunks compare the query
+        to each of their vectors instead.
+
+        Parameters
+        ----------
+        embeddings: np.ndarray
+            Query embeddings, shape (n, dimension)
+
+        k: int
+            Number of chunks per query
+
+        query_filter: Optional[QueryFilter] = None
+            Metadata the hits must match, None or an empty filter
+            searches every chunk
+
+        Returns
+        -------
+        List[List[Tuple[int, float]]]
+            Record position and distance of the hits of every query,
+            nearest first, no hits if no chunk matches the filter
+        """
+
+        if self.index is None or len(self.chunks) == 0:
+            return [[] for _ in range(len(embeddings))]
+
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if not query_filter:
+            return self.get_hits(*self.index.search(embeddings, k))
+
+        rows = np.flatnonzero(query_filter.get_mask(self.chunks))
+        if len(rows) == 0:
+            return [[] for _ in range(len(embeddings))]
+
+        ids = self.chunks["id"][rows]
+        if self.spec.kind == "hnsw" and len(rows) <= EXACT_SEARCH_ROWS:
+            vectors = self.index.reconstruct_batch(np.ascontiguousarray(ids))
+            distances, positions = faiss.knn(embeddings, vectors, min(k, len(rows)))
+            return self.get_hits(distances, ids[positions])
+
+        # One bit per id, the selector must not outlive the bitmap
+        selected = np.zeros(self.meta["next_id"], dtype=bool)
+        selected[ids] = True
+        bitmap = np.packbits(selected, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+
+        share = len(rows) / len(self.chunks)
+        if self.spec.needs_training:
+            nprobe = min(self.spec.nlist, int(np.ceil(self.spec.nprobe / share)))
+            parameters = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+        elif self.spec.kind == "hnsw":
+            ef_search = min(len(self.chunks), max(k, int(np.ceil(self.spec.ef_search / share))))
+            parameters = faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+        else:
+            parameters = faiss.SearchParameters(sel=selector)
+
+        return self.get_hits(*self.index.search(embeddings, k, params=parameters))
+
+    def get_hits(self, distances: np.ndarray, ids: np.ndarray) -> List[List[Tuple[int, float]]]:
+        """ Record positions of the results of a faiss search
+
+        Parameters
+        ----------
+        distances: np.ndarray
+            Distances of the neighbors of every query
+
+        ids: np.ndarray
+            Ids of the neighbors of every query, -1 where fewer than k
+            were found
+
+        Returns
+        -------
+        List[List[Tuple[int, float]]]
+            Record position and distance of the hits of every query
+        """
+
+        hits = []
+        for query_distances, query_ids in zip(distances, ids):
+            found = query_ids >= 0
+            rows = self.get_rows(query_ids[found])
+            hits.append(list(zip(rows.tolist(), query_distances[found].tolist())))
+
+        return hits
+
+    def get_sources(self) -> Dict[Tuple[bytes, bytes], int]:
+        """ Content hash of every indexed source
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Dict[Tuple[bytes, bytes], int]
+            Source hash by (ticker, q)
+        """
+
+        return {
+            (record["ticker"], record["q"]): int(record["source_hash"])
+            for record in np.unique(self.chunks[["ticker", "q", "source_hash"]])
+        }
+
+    def remove_sources(self, keys: Iterable[Tuple[bytes, bytes]]) -> int:
+        """ Remove the chunks of sources from the index and the records
+
+        Parameters
+        ----------
+        keys: Iterable[Tuple[bytes, bytes]]
+            (ticker, q) of the sources
+
+        Returns
+        -------
+        int
+            Number of chunks removed
+        """
+
+        keys = set(keys)
+        if not keys:
+            return 0
+
+        removed = np.array(
+            [(ticker, q) in keys for ticker, q in zip(self.chunks["ticker"], self.chunks["q"])],
+            dtype=bool,
+        )
+        if not removed.any():
+            return 0
+
+        ids = np.ascontiguousarray(self.chunks["id"][removed])
+        if self.spec.kind == "hnsw":
+            self.rebuild_without(ids)
+        else:
+            self.index.remove_ids(ids)
+        self.chunks = self.chunks[~removed]
+
+        return int(removed.sum())
+
+    def rebuild_without(self, ids: np.ndarray) -> None:
+        """ Rebuild the index from its own vectors, leaving some out, for
+        index types that cannot remove vectors in place, i.e. HNSW
+
+        Parameters
+        ----------
+        ids: np.ndarray
+            Ids of the vectors to leave out
+
+        Returns
+        -------
+        None
+        """
+
+        inner = faiss.downcast_index(self.index.index)
+        vectors = inner.reconstruct_n(0, inner.ntotal)
+        vector_ids = faiss.vector_to_array(self.index.id_map)
+        kept = ~np.isin(vector_ids, ids)
+
+        index = self.spec.build(self.index.d)
+        index.add_with_ids(np.ascontiguousarray(vectors[kept]), np.ascontiguousarray(vector_ids[kept]))
+        self.index = index
+
+    def train(self, index: Any, sample: np.ndarray) -> None:
+        """ Train an empty index on the first vectors added
+
+        Parameters
+        ----------
+        index: faiss.Index
+            Index built from the spec
+
+        sample: np.ndarray
+            Training vectors
+
+        Returns
+        -------
+        None
+        """
+
+        self.spec.check_training_size(len(sample))
+        index.train(sample)
+
+    async def update(
+        self,
+        embedder: Any,
+        lines: Iterable[Dict[str, Any]],
+        chunk_tokens: int = 256,
+        chunk_overlap: int = 32,
+        batch_size: int = 32,
+        concurrency: int = 4,
+        prune: bool = False,
+    ) -> UpdateStats:
+        """ Embed and add the new and changed source lines, then save
+
+        Parameters
+        ----------
+        embedder: Any
+            Object with the generate method of lamini.Embedding
+
+        lines: Iterable[Dict[str, Any]]
+            Decoded source lines with ticker, q, transcript and
+            optionally date keys
+
+        chunk_tokens: int = 256
+            Token budget of a chunk
+
+        chunk_overlap: int = 32
+            Tokens repeated between consecutive chunks
+
+        batch_size: int = 32
+            Number of chunks per embedding call
+
+        concurrency: int = 4
+            Max number of embedding calls in flight
+
+        prune: bool = False
+            Whether to remove sources that are not in the lines
+
+        Returns
+        -------
+        UpdateStats
+            Number of sources added, changed, unchanged and removed
+        """
+
+        if self.readonly:
+            raise ValueError(f"Index {self.path} is open read only")
+
+        stats = UpdateStats()
+        indexed = self.get_sources()
+
+        # Chunks cut with other settings, or indexes of another structure,
+        # are rebuilt from scratch
+        chunking = [chunk_tokens, chunk_overlap]
+        saved = IndexSpec.from_dict(self.meta.get("index", self.spec.to_dict()))
+        rebuild = len(self.chunks) > 0 and (
+            self.meta.get("chunking", chunking) != chunking or not self.is_built_from(saved)
+        )
+        if rebuild:
+            stats.removed_chunks = len(self.chunks)
+            self.index = None
+            self.chunks = self.chunks[:0]
+        seen = set()
+        outdated = []
+        pending: List[Tuple[Dict[str, Any], int]] = []
+
+        for line in lines:
+            key = (line["ticker"].encode(), line["q"].encode())
+            source_hash = get_source_hash(line)
+            seen.add(key)
+            if not rebuild and indexed.get(key) == source_hash:
+                stats.unchanged += 1
+                continue
+            if key in indexed:
+                stats.changed += 1
+                outdated.append(key)
+            else:
+                stats.added += 1
+            pending.append((line, source_hash))
+
+        if prune:
+            stale = [key for key in indexed if key not in seen]
+            stats.removed = len(stale)
+            outdated.extend(stale)
+
+        stats.removed_chunks += self.remove_sources(outdated)
+
+        if pending:
+            # An index still to be trained is trained on the first train_size
+            # chunks, check that there are enough before anything is written
+            if self.spec.needs_training and (self.index is None or not self.index.is_trained):
+                count = sum(1 for line, _ in pending for _ in iter_chunks([line], chunk_tokens, chunk_overlap))
+                self.spec.check_training_size(min(count, self.spec.train_size))
+
+            os.makedirs(self.path, exist_ok=True)
+            records: List[Tuple] = []
+            with open(self.get_file(TEXTS_FILE), "ab") as texts:
+                chunks = self.iter_new_chunks(pending, texts, records, chunk_tokens, chunk_overlap)
+                self.index, _, stats.ingest = await ingest(
+                    embedder,
+                    chunks,
+                    index=self.index,
+                    make_index=self.spec.build,
+                    batch_size=batch_size,
+                    concurrency=concurrency,
+                    block_size=self.spec.train_size if self.spec.needs_training else BLOCK_SIZE,
+                    first_id=self.meta["next_id"],
+                    train=self.train,
+                )
+
+            self.chunks = np.concatenate([self.chunks, np.array(records, dtype=CHUNK_DTYPE)])
+            self.meta["next_id"] += len(records)
+            self.meta["dimension"] = self.index.d
+            self.meta["chunking"] = chunking
+
+        if pending or stats.removed_chunks:
+            self.meta["index"] = self.spec.to_dict()
+            self.save()
+
+        return stats
+
+    def iter_new_chunks(
+        self,
+        pending: List[Tuple[Dict[str, Any], int]],
+        texts: Any,
+        records: List[Tuple],
+        chunk_tokens: int,
+        chunk_overlap: int,
+    ) -> Iterator[TranscriptChunk]:
+        """ Append the transcripts of the pending lines to the text
+        store and chunk them, recording the chunks as they are yielded,
+        so the records follow the vector ids assigned by ingest
+
+        Parameters
+        ----------
+        pending: List[Tuple[Dict[str, Any], int]]
+            Lines to index and their source hashes
+
+        texts: Any
+            Text store opened for appending
+
+        records: List[Tuple]
+            Receives one CHUNK_DTYPE tuple per chunk
+
+        chunk_tokens: int
+            Token budget of a chunk
+
+        chunk_overlap: int
+            Tokens repeated between consecutive chunks
+
+        Yields
+        ------
+        TranscriptChunk
+            Chunks of the pending lines
+        """
+
+        for line, source_hash in pending:
+            text = line["transcript"]
+            encoded = text.encode("utf-8")
+            base = texts.tell()
+            texts.write(encoded)
+
+            date = parse_call_date(line.get("date", ""))
+            ascii_only = len(encoded) == len(text)
+
+            for chunk in iter_chunks([line], chunk_tokens, chunk_overlap):
+                if ascii_only:
+                    start, end = chunk.start, chunk.end
+                else:
+                    start = len(text[:chunk.start].encode("utf-8"))
+                    end = start + len(text[chunk.start:chunk.end].encode("utf-8"))
+                records.append((
+                    self.meta["next_id"] + len(records),
+                    base + start,
+                    base + end,
+                    date,
+                    line["ticker"].encode(),
+                    line["q"].encode(),
+                    source_hash,
+                ))
+                yield chunk
+
+    def get_live_bytes(self) -> int:
+        """ Size of the source transcripts chunks refer to
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            Bytes of the text store in use
+        """
+
+        if len(self.chunks) == 0:
+            return 0
+
+        _, sources = np.unique(self.chunks["source_hash"], return_inverse=True)
+        starts = np.full(sources.max() + 1, np.iinfo(np.int64).max)
+        ends = np.zeros(sources.max() + 1, dtype=np.int64)
+        np.minimum.at(starts, sources, self.chunks["start"])
+        np.maximum.at(ends, sources, self.chunks["end"])
+
+        return int((ends - starts).sum())
+
+    def compact(self) -> None:
+        """ Rewrite the text store without the text of removed sources
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        path = self.get_file(TEXTS_FILE)
+        partial = path + ".partial"
+
+        chunks = self.chunks.copy()
+        with open(partial, "wb") as f:
+            for source_hash in np.unique(chunks["source_hash"]):
+                rows = np.flatnonzero(chunks["source_hash"] == source_hash)
+                start = int(chunks["start"][rows].min())
+                end = int(chunks["end"][rows].max())
+                shift = f.tell() - start
+                f.write(self.texts[start:end])
+                chunks["start"][rows] += shift
+                chunks["end"][rows] += shift
+
+        self.close_texts()
+        os.replace(partial, path)
+        self.chunks = chunks
+
+    def save(self) -> None:
+        """ Write the index, the records and the metadata, each to a
+        temporary file renamed over the previous one, compacting the
+        text store first if needed
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self.open_texts()
+        if self.texts is not None and len(self.texts) - self.get_live_bytes() > COMPACT_RATIO * len(self.texts):
+            self.compact()
+
+        self.meta["count"] = len(self.chunks)
+        if self.index is None:
+            self.index = self.spec.build(self.meta["dimension"])
+
+        index_path = self.get_file(INDEX_FILE)
+        faiss.write_index(self.index, index_path + ".partial")
+        os.replace(index_path + ".partial", index_path)
+
+        chunks_path = self.get_file(CHUNKS_FILE)
+        with open(chunks_path + ".partial", "wb") as f:
+            np.save(f, self.chunks)
+        os.replace(chunks_path + ".partial", chunks_path)
+
+        meta_path = self.get_file(META_FILE)
+        with open(meta_path + ".partial", "w") as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + ".partial", meta_path)
+
+        self.open_texts()
@@ -0,0 +1,238 @@
+from typing import Any, Dict, Optional
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+def make_cache_key(
+    model_name: str,
+    prompt: str,
+    output_type: Optional[Dict[str, str]],
+    max_new_tokens: Optional[int],
+) -> str:
+    """ Hash everything that determines a generate call's response
+    into a cache key
+
+    Parameters
+    ----------
+    model_name: str
+        LLM hugging face ID
+
+    prompt: str
+        Final prompt string sent to the model
+
+    output_type: Optional[Dict[str, str]]
+        Structured output format of the call
+
+    max_new_tokens: Optional[int]
+        Generation budget of the call
+
+    Returns
+    -------
+    str
+        Hex sha256 digest of the call parameters
+    """
+
+    payload = json.dumps(
+        [model_name, prompt, output_type, max_new_tokens], sort_keys=True
+    )
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM responses stored in a SQLite file. Entries are
+    evicted least recently used first once the cache holds more than
+    max_entries responses. Hits and misses are counted for reporting.
+
+    Parameters
+    ----------
+    path: str
+        SQLite file location, created if missing unless readonly
+
+    max_entries: int = 100000
+        Max number of responses kept in the cache
+
+    readonly: bool = False
+        Serve hits from the cache without storing new responses
+        or updating recency
+
+    """
+
+    def __init__(
+        self, path: str, max_entries: int = 100000, readonly: bool = False
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.readonly = readonly
+
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = self.connect()
+        self.size = self.count()
+
+    def connect(self) -> Optional[sqlite3.Connection]:
+        """ Open the SQLite file, creating the responses table if needed
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Optional[sqlite3.Connection]
+            Open connection, None for a readonly cache without a file
+        """
+
+        if self.readonly:
+            if not os.path.exists(self.path):
+                return None
+            return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Shard workers may share the file, WAL lets readers run alongside a writer
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        connection.commit()
+
+        return connection
+
+    def get(self, key: str) -> Optional[Any]:
+        """ Look up a cached response, counting the hit or miss
+
+        Parameters
+        ----------
+        key: str
+            Cache key from make_cache_key
+
+        Returns
+        -------
+        Optional[Any]
+            Cached response, None on a miss
+        """
+
+        row = None
+        if self.connection is not None:
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        if not self.readonly:
+            self.connection.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.connection.commit()
+
+        return json.loads(row[0])
+
+    def put(self, key: str, response: Any) -> None:
+        """ Store a response, evicting the least recently used
+        entries if the cache grows past max_entries
+
+        Parameters
+        ----------
+        key: str
+            Cache key from make_cache_key
+
+        response: Any
+            JSON serializable response of the generate call
+
+        Returns
+        -------
+        None
+        """
+
+        if self.readonly or self.connection is None:
+            return
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)",
+            (key, json.dumps(response), time.time()),
+        )
+
+        # Responses are stored after a miss, so the entry is almost always new.
+        # The exact count is only taken once the estimate crosses the limit.
+        self.size += 1
+        if self.size > self.max_entries:
+            self.size = self.count()
+            if self.size > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (self.size - self.max_entries,),
+                )
+                self.size = self.max_entries
+
+        self.connection.commit()
+
+    def count(self) -> int:
+        """ Number of responses stored in the cache
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            Number of cached responses
+        """
+
+        if self.connection is None:
+            return 0
+
+        return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def report(self) -> None:
+        """ Print the hit and miss counters
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(f"Cache hits: {self.hits}, misses: {self.misses}, hit rate: {rate:.3f}")
+
+    def close(self) -> None:
+        """ Close the SQLite connection
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,204 @@
+from typing import Any, Iterable, List, Optional
+
+import os
+import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.atomic_jsonl_writer import SUFFIXES, AtomicJsonlWriter, default_encoder
+
+
+class RotatingJsonlWriter:
+    """
+    Jsonlines writer splitting its output into numbered shards of
+    bounded size, e.g. generated_q_a-00000.jsonl, generated_q_a-00001.jsonl.
+    A new shard is started once the current one reaches max_bytes, so a
+    long run leaves files that can be read, copied or uploaded while it
+    continues, and no single file grows without bound. Each shard is
+    written under a partial name and renamed once it is complete.
+
+    Shards of the prefix left in the directory by an earlier run are
+    removed when the first shard is opened, so that readers of the
+    directory never mix the rows of both runs.
+
+    Parameters
+    ----------
+    directory: str
+        Directory of the shards, created if missing
+
+    prefix: str
+        File name prefix of the shards
+
+    max_bytes: int = 256 * 1024 * 1024
+        Uncompressed size after which the next line goes to a new shard
+
+    compression: str = "none"
+        Compression of the shards, see AtomicJsonlWriter
+
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        compression: str = "none",
+    ) -> None:
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.encode = default_encoder()
+
+        self.shard_index = -1
+        self.shard_bytes = 0
+        self.shard: Optional[AtomicJsonlWriter] = None
+        self.paths: List[str] = []
+        self.count = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self) -> "RotatingJsonlWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        self.close(complete=exc_type is None)
+
+    def get_shard_path(self, shard_index: int) -> str:
+        """ Path of a shard
+
+        Parameters
+        ----------
+        shard_index: int
+            Position of the shard
+
+        Returns
+        -------
+        str
+            Shard file location
+        """
+
+        return os.path.join(
+            self.directory, f"{self.prefix}-{shard_index:05d}.jsonl{SUFFIXES[self.compression]}"
+        )
+
+    def rotate(self) -> None:
+        """ Close the current shard and open the next one
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.shard is not None:
+            self.shard.close()
+        else:
+            self.remove_stale_shards()
+
+        self.shard_index += 1
+        self.shard_bytes = 0
+
+        path = self.get_shard_path(self.shard_index)
+        self.shard = AtomicJsonlWriter(path, self.compression)
+        self.paths.append(path)
+
+    def remove_stale_shards(self) -> None:
+        """ Remove the complete and partial shards of the prefix, of
+        any compression, written by an earlier run
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        pattern = re.compile(re.escape(self.prefix) + r"-\d{5,}\.jsonl(\.gz|\.zst)?(\.partial)?")
+        for name in os.listdir(self.directory):
+            if pattern.fullmatch(name):
+                os.remove(os.path.join(self.directory, name))
+
+    def write(self, row: Any) -> None:
+        """ Append a row to the current shard, rotating first if it is full
+
+        Parameters
+        ----------
+        row: Any
+            JSON serializable row
+
+        Returns
+        -------
+        None
+        """
+
+        self.write_batch([row])
+
+    def write_batch(self, rows: Iterable[Any]) -> None:
+        """ Append rows, rotating whenever the current shard is full
+
+        Parameters
+        ----------
+        rows: Iterable[Any]
+            JSON serializable rows
+
+        Returns
+        -------
+        None
+        """
+
+        lines: List[bytes] = []
+
+        for row in rows:
+            line = self.encode(row) + b"\n"
+            if self.shard is None or (self.shard_bytes > 0 and self.shard_bytes + len(line) > self.max_bytes):
+                if lines:
+                    self.shard.write_lines(lines)
+                    lines = []
+                self.rotate()
+
+            lines.append(line)
+            self.shard_bytes += len(line)
+            self.count += 1
+
+        if lines:
+            self.shard.write_lines(lines)
+
+    def flush(self) -> None:
+        """ Flush the current shard
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.shard is not None:
+            self.shard.flush()
+
+    def close(self, complete: bool = True) -> None:
+        """ Close the current shard
+
+        Parameters
+        ----------
+        complete: bool = True
+            Whether every row was written, False leaves the last shard
+            under its partial name
+
+        Returns
+        -------
+        None
+        """
+
+        if self.shard is not None:
+            self.shard.close(complete)
+            self.shard = None
@@ -0,0 +1,172 @@
+from typing import List, NamedTuple, Tuple
+
+import re
+
+# Words and single punctuation marks, close to the number of Llama
+# tokens for English prose without loading a tokenizer
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Lines are paragraphs or speaker turns in the transcripts
+LINE_PATTERN = re.compile(r"[^\n]*\n|[^\n]+")
+
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+class Span(NamedTuple):
+    """
+    Piece of a text that chunks are built from
+
+    Parameters
+    ----------
+    start: int
+        Offset of the first character
+
+    end: int
+        Offset past the last character
+
+    tokens: int
+        Approximate number of tokens
+    """
+
+    start: int
+    end: int
+    tokens: int
+
+
+def count_tokens(text: str) -> int:
+    """ Approximate number of tokens of a text
+
+    Parameters
+    ----------
+    text: str
+        Text to count
+
+    Returns
+    -------
+    int
+        Number of words and punctuation marks
+    """
+
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def split_spans(text: str, max_tokens: int) -> List[Span]:
+    """ Split a text into sentences, never across lines, and
+    sentences over the budget into runs of words
+
+    Parameters
+    ----------
+    text: str
+        Text to split
+
+    max_tokens: int
+        Token budget of a span
+
+    Returns
+    -------
+    List[Span]
+        Consecutive spans covering the text
+    """
+
+    spans = []
+
+    for line in LINE_PATTERN.finditer(text):
+        starts = [line.start()] + [
+            line.start() + match.end() for match in SENTENCE_END_PATTERN.finditer(line.group())
+        ]
+        ends = starts[1:] + [line.end()]
+
+        for start, end in zip(starts, ends):
+            tokens = count_tokens(text[start:end])
+            if tokens <= max_tokens:
+                spans.append(Span(start, end, tokens))
+                continue
+
+            words = [match.start() for match in TOKEN_PATTERN.finditer(text, start, end)]
+            for index in range(0, len(words), max_tokens):
+                run_start = start if index == 0 else words[index]
+                run_end = words[index + max_tokens] if index + max_tokens < len(words) else end
+                spans.append(Span(run_start, run_end, min(max_tokens, len(words) - index)))
+
+    return spans
+
+
+def chunk_bounds(text: str, max_tokens: int = 512, overlap_tokens: int = 64) -> List[Tuple[int, int]]:
+    """ Split a text into windows of at most max_tokens, cut on
+    sentence boundaries, which include the ends of speaker turns.
+    Consecutive windows share up to overlap_tokens of trailing
+    sentences, so a fact split across a boundary is whole in one of
+    them. A text within the budget is a single window.
+
+    Parameters
+    ----------
+    text: str
+        Text to chunk
+
+    max_tokens: int = 512
+        Token budget of a chunk
+
+    overlap_tokens: int = 64
+        Token budget of the spans repeated from the previous chunk
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        Start and end offsets of the chunks, in order
+    """
+
+    if max_tokens < 1 or overlap_tokens < 0:
+        raise ValueError(
+            f"Expected max_tokens >= 1 and overlap_tokens >= 0, got {max_tokens}, {overlap_tokens}"
+        )
+
+    spans = split_spans(text, max_tokens)
+    if sum(span.tokens for span in spans) <= max_tokens:
+        return [(0, len(text))]
+
+    bounds = []
+    first = 0
+
+    while first < len(spans):
+        last = first
+        tokens = 0
+        while last < len(spans) and (last == first or tokens + spans[last].tokens <= max_tokens):
+            tokens += spans[last].tokens
+            last += 1
+
+        bounds.append((spans[first].start, spans[last - 1].end))
+        if last == len(spans):
+            break
+
+        # Step back over trailing spans for the overlap, always moving forward
+        next_first = last
+        overlap = 0
+        while next_first - 1 > first and overlap + spans[next_first - 1].tokens <= overlap_tokens:
+            next_first -= 1
+            overlap += spans[next_first].tokens
+        first = next_first
+
+    return bounds
+
+
+def chunk_text(text: str, max_tokens: int = 512, overlap_tokens: int = 64) -> List[str]:
+    """ Split a text into overlapping windows, see chunk_bounds
+
+    Parameters
+    ----------
+    text: str
+        Text to chunk
+
+    max_tokens: int = 512
+        Token budget of a chunk
+
+    overlap_tokens: int = 64
+        Token budget of the spans repeated from the previous chunk
+
+    Returns
+    -------
+    List[str]
+        Chunks, in order, exact substrings of the text
+    """
+
+    return [text[start:end] for start, end in chunk_bounds(text, max_tokens, overlap_tokens)]
@@ -0,0 +1,296 @@
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Sequence
+
+import math
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.prompt_templates import PromptTemplate
+from utils.text_chunker import TOKEN_PATTERN
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+# Llama 3 tokenizer.json, e.g. from
+# huggingface-cli download meta-llama/Meta-Llama-3.1-8B-Instruct tokenizer.json --local-dir data/cache
+TOKENIZER_PATH = os.environ.get(
+    "LLAMA3_TOKENIZER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache", "tokenizer.json"),
+)
+
+# Context window requests are budgeted against, prompt plus max_new_tokens
+CONTEXT_TOKENS = 8192
+
+# Llama 3 tokens per word or punctuation mark, with margin, used to scale
+# the regex estimate when the tokenizer is not available, so budgets hold
+# for numbers and rare words that split into several tokens
+FALLBACK_TOKEN_RATIO = 1.3
+
+STRATEGIES = ("head", "tail", "middle", "drop")
+
+TRUNCATION_MARKER = "\n...\n"
+
+
+class TokenCounter:
+    """
+    Token counter of the Llama 3 tokenizer, loaded from a local
+    tokenizer.json with the tokenizers package. Without either, counts
+    fall back to the word and punctuation estimate of text_chunker,
+    scaled by FALLBACK_TOKEN_RATIO so it errs on the long side.
+    Counts are cached, since the same segments, e.g. a transcript
+    chunk or a company header, recur across prompts.
+
+    Parameters
+    ----------
+    tokenizer_path: Optional[str] = None
+        tokenizer.json location, None uses TOKENIZER_PATH
+
+    cache_size: int = 4096
+        Number of segment counts kept in the LRU cache
+
+    """
+
+    def __init__(self, tokenizer_path: Optional[str] = None, cache_size: int = 4096) -> None:
+        tokenizer_path = tokenizer_path or TOKENIZER_PATH
+
+        self.tokenizer = None
+        if Tokenizer is not None and os.path.exists(tokenizer_path):
+            self.tokenizer = Tokenizer.from_file(tokenizer_path)
+
+        self.count: Callable[[str], int] = lru_cache(maxsize=cache_size)(self.count_uncached)
+
+    def count_uncached(self, text: str) -> int:
+        """ Number of tokens of a text
+
+        Parameters
+        ----------
+        text: str
+            Text to count
+
+        Returns
+        -------
+        int
+            Exact count with the tokenizer, else a scaled estimate
+        """
+
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+        return math.ceil(len(TOKEN_PATTERN.findall(text)) * FALLBACK_TOKEN_RATIO)
+
+    def get_offsets(self, text: str) -> List[int]:
+        """ Character offset where every token of a text starts
+
+        Parameters
+        ----------
+        text: str
+            Text to tokenize
+
+        Returns
+        -------
+        List[int]
+            Start offsets, with the fallback every estimated token
+            counts FALLBACK_TOKEN_RATIO times
+        """
+
+        if self.tokenizer is not None:
+            encoding = self.tokenizer.encode(text, add_special_tokens=False)
+            return [start for start, _ in encoding.offsets]
+
+        return [match.start() for match in TOKEN_PATTERN.finditer(text)]
+
+    def get_token_limit(self, max_tokens: int) -> int:
+        """ Number of offsets of get_offsets that fit max_tokens
+
+        Parameters
+        ----------
+        max_tokens: int
+            Token budget
+
+        Returns
+        -------
+        int
+            Number of leading or trailing offsets to keep
+        """
+
+        if self.tokenizer is not None:
+            return max_tokens
+
+        return int(max_tokens / FALLBACK_TOKEN_RATIO)
+
+    def truncate(self, text: str, max_tokens: int, strategy: str = "head") -> str:
+        """ Cut a text down to a token budget
+
+        Parameters
+        ----------
+        text: str
+            Text to cut
+
+        max_tokens: int
+            Token budget
+
+        strategy: str = "head"
+            "head" keeps the start, "tail" keeps the end, "middle"
+            keeps both ends and drops the middle, marking the cut
+
+        Returns
+        -------
+        str
+            The text itself if it fits, else its cut down version
+        """
+
+        if self.count(text) <= max_tokens:
+            return text
+
+        if strategy == "middle":
+            max_tokens -= self.count(TRUNCATION_MARKER)
+
+        offsets = self.get_offsets(text)
+        keep = max(self.get_token_limit(max_tokens), 0)
+
+        if keep == 0:
+            return ""
+        if strategy == "head":
+            return text[:offsets[keep]]
+        if strategy == "tail":
+            return text[offsets[len(offsets) - keep]:]
+        if strategy == "middle":
+            head = (keep + 1) // 2
+            tail = keep - head
+            tail_start = offsets[len(offsets) - tail] if tail else len(text)
+            return text[:offsets[head]] + TRUNCATION_MARKER + text[tail_start:]
+
+        raise ValueError(f"Unknown truncation strategy {strategy}, expected one of {STRATEGIES}")
+
+    def select_ranked(
+        self, chunks: Sequence[str], max_tokens: int, separator: str = "\n\n"
+    ) -> List[str]:
+        """ Keep the highest ranked chunks that fit a token budget,
+        dropping the lowest ranked ones. The first chunk is cut down
+        when even it does not fit.
+
+        Parameters
+        ----------
+        chunks: Sequence[str]
+            Chunks, best ranked first
+
+        max_tokens: int
+            Token budget of the chunks and their separators
+
+        separator: str = "\\n\\n"
+            Text the chunks are joined with
+
+        Returns
+        -------
+        List[str]
+            Kept chunks, in rank order
+        """
+
+        kept = []
+        used = 0
+        separator_tokens = self.count(separator)
+
+        for chunk in chunks:
+            tokens = self.count(chunk) + (separator_tokens if kept else 0)
+            if used + tokens > max_tokens:
+                if not kept:
+                    kept.append(self.truncate(chunk, max_tokens, "head"))
+                break
+            kept.append(chunk)
+            used += tokens
+
+        return kept
+
+
+@lru_cache(maxsize=None)
+def get_token_counter() -> TokenCounter:
+    """ Token counter shared by the prompt builders
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    TokenCounter
+        Counter of the local tokenizer, or of the fallback estimate
+    """
+
+    return TokenCounter()
+
+
+def render_within_budget(
+    template: PromptTemplate,
+    max_tokens: int,
+    field: str,
+    strategy: str,
+    counter: Optional[TokenCounter] = None,
+    **values: Any,
+) -> str:
+    """ Render a template within a token budget, cutting down one of
+    its fields when the prompt would not fit. The budget is checked
+    from the cached counts of the constant text and of each field, with
+    one token of slack per field for merges at the boundaries, so the
+    rendered prompt is never tokenized as a whole.
+
+    Parameters
+    ----------
+    template: PromptTemplate
+        Template to render
+
+    max_tokens: int
+        Token budget of the rendered prompt
+
+    field: str
+        Field to cut down, e.g. the transcript
+
+    strategy: str
+        "head", "tail" or "middle" to cut the field's text, or "drop"
+        for a field given as a list of ranked chunks, which keeps the
+        best ranked ones that fit, joined by blank lines
+
+    counter: Optional[TokenCounter] = None
+        Token counter, None uses the shared one
+
+    **values: Any
+        Value of every field
+
+    Returns
+    -------
+    str
+        Rendered prompt
+
+    Raises
+    ------
+    ValueError
+        If the prompt does not fit even with the field left empty, so
+        no request is sent that the model would reject
+    """
+
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown truncation strategy {strategy}, expected one of {STRATEGIES}")
+
+    counter = counter or get_token_counter()
+
+    fixed_tokens = counter.count("".join(template.segments)) + len(template.fields)
+    for _, name in template.fields:
+        if name != field:
+            fixed_tokens += counter.count(str(values[name]))
+
+    field_budget = max_tokens - fixed_tokens
+    if field_budget < 0:
+        raise ValueError(
+            f"Prompt needs {fixed_tokens} tokens without its {field}, over the budget of {max_tokens}"
+        )
+
+    value = values[field]
+    if strategy == "drop":
+        value = "\n\n".join(counter.select_ranked(value, field_budget))
+    else:
+        value = counter.truncate(str(value), field_budget, strategy)
+
+    return template.render(**{**values, field: value})
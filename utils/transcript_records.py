@@ -0,0 +1,193 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import sys
+import weakref
+
+
+class Transcript:
+    """
+    Earnings call transcript with its call details. Every record made
+    from the call refers to one shared instance, see TranscriptStore.
+
+    Parameters
+    ----------
+    ticker: str
+        Company ticker
+
+    exchange: str
+        Exchange, or company name, of the listing
+
+    date: str
+        Date of the call
+
+    q: str
+        Quarter of the call, e.g. 2020-Q3
+
+    text: str
+        Full transcript
+
+    """
+
+    __slots__ = ("ticker", "exchange", "date", "q", "text", "__weakref__")
+
+    def __init__(self, ticker: str, exchange: str, date: str, q: str, text: str) -> None:
+        self.ticker = ticker
+        self.exchange = exchange
+        self.date = date
+        self.q = q
+        self.text = text
+
+
+class TranscriptStore:
+    """
+    Interned transcripts keyed by (ticker, q). A call loaded again while
+    records of it are still in flight gets the same Transcript, and a
+    transcript is freed as soon as no record refers to it, so the store
+    does not grow with the corpus.
+
+    Parameters
+    ----------
+    None
+
+    """
+
+    def __init__(self) -> None:
+        self.transcripts: "weakref.WeakValueDictionary[Tuple[str, str], Transcript]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    def __len__(self) -> int:
+        return len(self.transcripts)
+
+    def get(self, line: Dict[str, Any]) -> Transcript:
+        """ Shared transcript of an earnings call line
+
+        Parameters
+        ----------
+        line: Dict[str, Any]
+            Decoded earnings call, with ticker, exchange, date, q and
+            transcript keys
+
+        Returns
+        -------
+        Transcript
+            Stored transcript for the ticker and quarter
+        """
+
+        key = (sys.intern(line["ticker"]), sys.intern(line["q"]))
+
+        transcript = self.transcripts.get(key)
+        if transcript is None:
+            transcript = Transcript(
+                key[0], sys.intern(line["exchange"]), line["date"], key[1], line["transcript"]
+            )
+            self.transcripts[key] = transcript
+
+        return transcript
+
+
+class TranscriptChunk:
+    """
+    Window of a transcript, kept as offsets into the shared text
+
+    Parameters
+    ----------
+    transcript: Transcript
+        Transcript the chunk is cut from
+
+    start: int
+        Offset of the first character
+
+    end: int
+        Offset past the last character
+
+    index: int
+        Position of the chunk in the transcript
+
+    count: int
+        Number of chunks of the transcript
+
+    """
+
+    __slots__ = ("transcript", "start", "end", "index", "count")
+
+    def __init__(self, transcript: Transcript, start: int, end: int, index: int, count: int) -> None:
+        self.transcript = transcript
+        self.start = start
+        self.end = end
+        self.index = index
+        self.count = count
+
+    @property
+    def text(self) -> str:
+        """ Text of the chunk, sliced from the transcript on access
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            Chunk text
+        """
+
+        return self.transcript.text[self.start:self.end]
+
+
+class QuestionSet:
+    """
+    Questions generated from a transcript chunk
+
+    Parameters
+    ----------
+    chunk: TranscriptChunk
+        Chunk the questions are about
+
+    questions: List[str]
+        Generated questions
+
+    """
+
+    __slots__ = ("chunk", "questions")
+
+    def __init__(self, chunk: TranscriptChunk, questions: List[str]) -> None:
+        self.chunk = chunk
+        self.questions = questions
+
+
+class QAPair:
+    """
+    Generated question about a transcript chunk, answered once the
+    answer generator's response is set on its PromptObject
+
+    Parameters
+    ----------
+    chunk: TranscriptChunk
+        Chunk the question is about
+
+    question: str
+        Generated question
+
+    grounded: Optional[bool] = None
+        Whether the numbers of the answer are in the chunk, None if
+        not checked
+
+    ungrounded_numbers: Optional[List[str]] = None
+        Numbers of the answer missing from the chunk, None if not checked
+
+    """
+
+    __slots__ = ("chunk", "question", "grounded", "ungrounded_numbers")
+
+    def __init__(
+        self,
+        chunk: TranscriptChunk,
+        question: str,
+        grounded: Optional[bool] = None,
+        ungrounded_numbers: Optional[List[str]] = None,
+    ) -> None:
+        self.chunk = chunk
+        self.question = question
+        self.grounded = grounded
+        self.ungrounded_numbers = ungrounded_numbers